@@ -10,6 +10,7 @@ class BaseLoader(object):
         self.institutional_category_cache = {}
         self.functional_category_cache = {}
         self.geographical_category_cache = {}
+        self.category_index = {}
 
     # Make input file delimiter configurable by children
     def _get_delimiter(self):
@@ -19,6 +20,10 @@ class BaseLoader(object):
     def _get_data_files_encoding(self):
         return 'utf-8'
 
+    # Make the size of the bulk inserts configurable by children
+    def _get_batch_size(self):
+        return 5000
+
     # Read number in Spanish format (123.456,78), and return as number of cents
     def _read_spanish_number(self, s):
         if (s.strip()==""):
@@ -50,17 +55,54 @@ class BaseLoader(object):
         return hasattr(settings, 'USE_SUBPROGRAMMES') and settings.USE_SUBPROGRAMMES
 
 
+    # Load all the categories of a budget in memory, indexed by their codes, so budget lines
+    # can be matched without hitting the database once per line. Categories are indexed by
+    # the tuple of fields we match them against; if there are duplicates we keep the first
+    # one, as a `.filter(...).first()` would do. Once a budget is preloaded, the `fetch_*`
+    # methods below use the index instead of querying the database.
+    def preload_categories(self, budget):
+        self.category_index[budget.id] = {
+            'institutional': self._index_categories(InstitutionalCategory, budget,
+                                ['institution', 'section', 'department']),
+            'functional': self._index_categories(FunctionalCategory, budget,
+                                ['area', 'policy', 'function', 'programme', 'subprogramme']),
+            'economic': self._index_categories(EconomicCategory, budget,
+                                ['expense', 'chapter', 'article', 'heading', 'subheading']),
+            'funding': self._index_categories(FundingCategory, budget,
+                                ['expense', 'source', 'fund_class', 'fund']),
+            'geographic': self._index_categories(GeographicCategory, budget,
+                                ['code']),
+        }
+        return self.category_index[budget.id]
+
+    # Drop the categories preloaded for a budget, once it's loaded, so they're not kept in
+    # memory while loading the following ones
+    def forget_categories(self, budget):
+        self.category_index.pop(budget.id, None)
+
+    def _index_categories(self, model, budget, fields):
+        index = {}
+        for category in model.objects.filter(budget=budget).order_by('id'):
+            key = tuple(getattr(category, field) for field in fields)
+            if key not in index:
+                index[key] = category
+        return index
+
     # Get a functional category from the database, with caching!
     def fetch_functional_category(self, budget, fc_area, fc_policy, fc_function, fc_programme, fc_subprogramme):
         key = (budget, fc_area, fc_policy, fc_function, fc_programme, fc_subprogramme)
         if key not in self.functional_category_cache:
-            fc = FunctionalCategory.objects.filter( area=fc_area,
-                                                    policy=fc_policy,
-                                                    function=fc_function,
-                                                    programme=fc_programme,
-                                                    subprogramme=fc_subprogramme,
-                                                    budget=budget)
-            self.functional_category_cache[key] = fc.first() if fc else None
+            if budget.id in self.category_index:
+                self.functional_category_cache[key] = self.category_index[budget.id]['functional'] \
+                    .get((fc_area, fc_policy, fc_function, fc_programme, fc_subprogramme))
+            else:
+                fc = FunctionalCategory.objects.filter( area=fc_area,
+                                                        policy=fc_policy,
+                                                        function=fc_function,
+                                                        programme=fc_programme,
+                                                        subprogramme=fc_subprogramme,
+                                                        budget=budget)
+                self.functional_category_cache[key] = fc.first() if fc else None
         return self.functional_category_cache[key]
 
     def fetch_functional_category_by_full_code(self, budget, fc_code):
@@ -75,33 +117,48 @@ class BaseLoader(object):
     def fetch_economic_category(self, budget, is_expense, ec_code):
         key = (budget, is_expense, ec_code)
         if key not in self.economic_category_cache:
-            ec = EconomicCategory.objects.filter(expense=is_expense,
-                                                chapter=ec_code[0],
-                                                article=ec_code[0:2] if len(ec_code) >= 2 else None,
-                                                heading=ec_code[0:3] if len(ec_code) >= 3 else None,
-                                                subheading = None,
-                                                budget=budget)
-            self.economic_category_cache[key] = ec.first() if ec else None
+            chapter = ec_code[0]
+            article = ec_code[0:2] if len(ec_code) >= 2 else None
+            heading = ec_code[0:3] if len(ec_code) >= 3 else None
+            if budget.id in self.category_index:
+                self.economic_category_cache[key] = self.category_index[budget.id]['economic'] \
+                    .get((is_expense, chapter, article, heading, None))
+            else:
+                ec = EconomicCategory.objects.filter(expense=is_expense,
+                                                    chapter=chapter,
+                                                    article=article,
+                                                    heading=heading,
+                                                    subheading = None,
+                                                    budget=budget)
+                self.economic_category_cache[key] = ec.first() if ec else None
         return self.economic_category_cache[key]
 
     # Get an institutional category from the database, with caching!
     def fetch_institutional_category(self, budget, ic_institution, ic_section, ic_department):
         key = (budget, ic_institution, ic_section, ic_department)
         if key not in self.institutional_category_cache:
-            ic = InstitutionalCategory.objects.filter(  institution=ic_institution,
-                                                        section=ic_section,
-                                                        department=ic_department,
-                                                        budget=budget)
-            self.institutional_category_cache[key] = ic.first() if ic else None
+            if budget.id in self.category_index:
+                self.institutional_category_cache[key] = self.category_index[budget.id]['institutional'] \
+                    .get((ic_institution, ic_section, ic_department))
+            else:
+                ic = InstitutionalCategory.objects.filter(  institution=ic_institution,
+                                                            section=ic_section,
+                                                            department=ic_department,
+                                                            budget=budget)
+                self.institutional_category_cache[key] = ic.first() if ic else None
         return self.institutional_category_cache[key]
 
     # Get a geographical category from the database, with caching!
     def fetch_geographical_category(self, budget, gc_code):
         key = (budget, gc_code)
         if key not in self.geographical_category_cache:
-            gc = GeographicCategory.objects.filter( code=gc_code,
-                                                    budget=budget)
-            self.geographical_category_cache[key] = gc.first() if gc else None
+            if budget.id in self.category_index:
+                self.geographical_category_cache[key] = self.category_index[budget.id]['geographic'] \
+                    .get((gc_code, ))
+            else:
+                gc = GeographicCategory.objects.filter( code=gc_code,
+                                                        budget=budget)
+                self.geographical_category_cache[key] = gc.first() if gc else None
         return self.geographical_category_cache[key]
 
     # Get a from the database, with caching!
@@ -9,22 +9,32 @@ import os.path
 
 class BudgetLoader(BaseLoader):
     def load(self, entity, year, path, status):
-        # Delete the existing budget if needed
-        budget = Budget.objects.filter(entity=entity, year=year)
-        if budget:
-            budget.delete()
-
+        # Load the budget on the side, it will replace the existing one when complete
         print("Cargando presupuesto de %s..." % path)
-        budget = Budget(entity=entity, year=year, status=status)
-        budget.save()
-        self.load_institutional_hierarchy(budget, path)
-        self.load_economic_hierarchy(budget, path)
-        self.load_functional_hierarchy(budget, path)
-        self.load_funding_hierarchy(budget, path)
-        self.load_data_files(budget, path)
-
-        print("Cargando ejecución presupuestaria de %s..." % path)
-        self.load_execution_data_files(budget, path)
+        budget = Budget.objects.create_staging(entity, year, status)
+        try:
+            self.load_institutional_hierarchy(budget, path)
+            self.load_economic_hierarchy(budget, path)
+            self.load_functional_hierarchy(budget, path)
+            self.load_funding_hierarchy(budget, path)
+
+            # The categories are all in place now, so index them once for all the data files
+            self.preload_categories(budget)
+            self.load_data_files(budget, path)
+
+            print("Cargando ejecución presupuestaria de %s..." % path)
+            self.load_execution_data_files(budget, path)
+        except:
+            # Don't leave the half loaded budget behind
+            Budget.objects.discard_staging(budget)
+            raise
+        finally:
+            self.forget_categories(budget)
+
+        Budget.objects.publish(budget, entity)
+
+        # The descriptions may have changed, so the cached ones are not valid anymore
+        Budget.objects.update_descriptions(entity)
 
     def get_default_institutional_categories(self):
         return []
@@ -273,58 +283,54 @@ class BudgetLoader(BaseLoader):
                 'amount': self._read_spanish_number(amount)
             })
 
+    # Match the data items against the budget categories, and store them in the database.
+    # We load all the budget categories in memory first, and insert the items in bulk, since
+    # doing it one line at a time meant several database round trips per line. The categories
+    # are preloaded by `load`; we only do it here for loaders that skip that.
     def process_data_items(self, budget, items, is_expense, is_actual):
+        categories = self.category_index.get(budget.id) or self.preload_categories(budget)
+        batch_size = self._get_batch_size()
+
+        budget_items = []
         for item in items:
             # Ignore null entries or entries with no amount
             if item == None or item['amount'] == 0:
                 continue
 
             # Match budget item data to existing categories
-            ic = InstitutionalCategory.objects.filter(budget=budget,
-                                            institution=item['ic_institution'],
-                                            section=item['ic_section'],
-                                            department=item['ic_department'])
+            ic = categories['institutional'].get((item['ic_institution'],
+                                                item['ic_section'],
+                                                item['ic_department']))
             if not ic:
-                print("ALERTA: No se encuentra la institución '%s' para '%s': %s€" % (item['ic_code'], item['description'], item['amount']))
+                print("ALERTA: No se encuentra la institución '%s' para '%s': %s€" % (item.get('ic_code', item['ic_department']), item['description'], item['amount']))
                 continue
-            else:
-                ic = ic.first()
-
-            fc = FunctionalCategory.objects.filter(budget=budget,
-                                                area=item['fc_area'],
-                                                policy=item['fc_policy'],
-                                                function=item['fc_function'],
-                                                programme=item['fc_programme'],
-                                                subprogramme=item['fc_subprogramme'] if self._use_subprogrammes() else None)
+
+            fc = categories['functional'].get((item['fc_area'],
+                                            item['fc_policy'],
+                                            item['fc_function'],
+                                            item['fc_programme'],
+                                            item['fc_subprogramme'] if self._use_subprogrammes() else None))
             if not fc:
                 code = item['fc_subprogramme'] if self._use_subprogrammes() else item['fc_programme']
                 print("ALERTA: No se encuentra la categoría funcional '%s' para '%s': %s€" % (code, item['description'], item['amount']))
                 continue
-            else:
-                fc = fc.first()
 
-            ec = EconomicCategory.objects.filter(budget=budget,
-                                                expense=is_expense,
-                                                chapter=item['ec_chapter'],
-                                                article=item['ec_article'],
-                                                heading=item['ec_heading'],
-                                                subheading=item['ec_subheading'])
+            ec = categories['economic'].get((is_expense,
+                                            item['ec_chapter'],
+                                            item['ec_article'],
+                                            item['ec_heading'],
+                                            item['ec_subheading']))
             if not ec:
                 print("ALERTA: No se encuentra la categoría económica '%s' para '%s': %s€" % (item['ec_code'], item['description'], item['amount']))
                 continue
-            else:
-                ec = ec.first()
 
-            fdc = FundingCategory.objects.filter(budget=budget,
-                                                expense=is_expense,
-                                                source=item['fdc_code'][0],
-                                                fund_class=item['fdc_code'][0:2],
-                                                fund=item['fdc_code'])
+            fdc = categories['funding'].get((is_expense,
+                                            item['fdc_code'][0],
+                                            item['fdc_code'][0:2],
+                                            item['fdc_code']))
             if not fdc:
                 print("ALERTA: No se encuentra la categoría de financiación '%s' para '%s': %s€" % (item['fdc_code'], item['description'], item['amount']))
                 continue
-            else:
-                fdc = fdc.first()
 
             # When there is no description for the budget_item take the one from the parent economic category
             if item['description'] == None or item['description'] == "":
@@ -332,16 +338,23 @@ class BudgetLoader(BaseLoader):
 
             # Create the budget item
             if item['amount'] != "":
-                BudgetItem(institutional_category=ic,
-                          functional_category=fc,
-                          economic_category=ec,
-                          funding_category=fdc,
-                          expense=is_expense,
-                          actual=is_actual,
-                          item_number=item['item_number'],
-                          amount=item['amount'],
-                          description=item['description'][0:512],
-                          budget=budget).save()
+                budget_items.append(BudgetItem(institutional_category=ic,
+                                                functional_category=fc,
+                                                economic_category=ec,
+                                                funding_category=fdc,
+                                                expense=is_expense,
+                                                actual=is_actual,
+                                                item_number=item['item_number'],
+                                                amount=item['amount'],
+                                                description=item['description'][0:512],
+                                                budget=budget))
+
+            # Flush the pending items every now and then, to keep memory usage under control
+            if len(budget_items) >= batch_size:
+                BudgetItem.objects.bulk_create(budget_items)
+                budget_items = []
+
+        BudgetItem.objects.bulk_create(budget_items)
 
     # Are we using subprogrammes? (Default: false)
     def _use_subprogrammes(self):
@@ -1,9 +1,12 @@
 # -*- coding: UTF-8 -*-
 from budget_app.loaders import BaseLoader
 from budget_app.models import *
+from django.conf import settings
+from django.db import connection
 from decimal import *
 import datetime
 import csv
+import io
 import os
 import re
 
@@ -11,6 +14,23 @@ import re
 # Generic payments loader
 class PaymentsLoader(BaseLoader):
 
+    # The columns we fill in when storing payments using COPY
+    PAYMENT_COLUMNS = [
+        'budget_id',
+        'area',
+        'programme',
+        'functional_category_id',
+        'economic_category_id',
+        'institutional_category_id',
+        'date',
+        'payee',
+        'payee_fiscal_id',
+        'anonymized',
+        'expense',
+        'amount',
+        'description',
+    ]
+
     def load(self, entity, year, path, status):
         items = self.parse_data(os.path.join(path, 'pagos.csv'))
 
@@ -21,13 +41,27 @@ class PaymentsLoader(BaseLoader):
         else:
             budget = budget.first()
 
-        # Delete previous payments for the given budget if they exist
-        Payment.objects.filter(budget=budget).delete()
+        # If the payments table is partitioned, load the payments into a new table, and
+        # swap it for the existing partition once done (see `swap_partition`)
+        if is_partitioned('payments'):
+            staging_table = create_staging_table('payments', budget)
+            if len(items) > 0:
+                print("Cargando pagos para entidad '%s' año %s..." % (entity.name, year))
+                self.load_items(budget, items, staging_table)
+            swap_partition('payments', budget, staging_table)
+
+        else:
+            # Delete previous payments for the given budget if they exist
+            Payment.objects.filter(budget=budget).delete()
+
+            # Store the data in the database
+            if len(items) > 0:
+                print("Cargando pagos para entidad '%s' año %s..." % (entity.name, year))
+                self.load_items(budget, items)
 
-        # Store the data in the database
-        if len(items) > 0:
-            print("Cargando pagos para entidad '%s' año %s..." % (entity.name, year))
-            self.load_items(budget, items)
+        # Update the aggregated payments and the list of payees, used by the payments page
+        PaymentRollup.objects.rebuild(budget)
+        PayeeSummary.objects.rebuild(entity)
 
     def parse_data(self, filename):
         items = []
@@ -77,8 +111,24 @@ class PaymentsLoader(BaseLoader):
     # since we have complex queries in the application that expect a number of different tables
     # to match perfectly (and they were built when the data was always fine, for historical reasons).
     # But for payments we're going to leave the fields null in the database, should be cleaner.
-    def load_items(self, budget, items):
-        payment_objects = []
+    #
+    # The payments are stored in the given table, if any, instead of the payments one. Only
+    # possible using COPY, the ORM doesn't know about that table.
+    def load_items(self, budget, items, table=None):
+        # Match the payments against the budget categories in memory
+        self.preload_categories(budget)
+        try:
+            payments = self.each_payment(budget, items)
+            if table or self._use_copy():
+                self.copy_payments(payments, table or 'payments')
+            else:
+                self.bulk_create_payments(payments)
+        finally:
+            self.forget_categories(budget)
+
+    # Resolve the categories of the given payment lines, returning the column values
+    # of each payment to be stored, as a dictionary indexed by model field name.
+    def each_payment(self, budget, items):
         for item in items:
             fields = self.parse_item(budget, item)
 
@@ -127,24 +177,79 @@ class PaymentsLoader(BaseLoader):
             anonymized = fields.get('anonymized', False)
             payee_fiscal_id = fields.get('payee_fiscal_id', '')
 
-            # Create the payment object
-            obj = Payment(area=fields['area'],
-                    programme=programme,
-                    functional_category=fc,
-                    economic_category=ec,
-                    institutional_category=ic,
-                    date=fields['date'],
-                    payee=fields['payee'],
-                    payee_fiscal_id=payee_fiscal_id,
-                    anonymized=anonymized,
-                    expense=True,
-                    amount=fields['amount'],
-                    description=fields['description'],
-                    budget=budget)
-            payment_objects.append(obj)
+            yield {
+                'budget_id': budget.id,
+                'area': fields['area'],
+                'programme': programme,
+                'functional_category_id': fc.id if fc else None,
+                'economic_category_id': ec.id if ec else None,
+                'institutional_category_id': ic.id if ic else None,
+                'date': fields['date'],
+                'payee': fields['payee'],
+                'payee_fiscal_id': payee_fiscal_id,
+                'anonymized': anonymized,
+                'expense': True,
+                'amount': fields['amount'],
+                'description': fields['description'],
+            }
+
+    # Store the payments using the ORM, in batches
+    def bulk_create_payments(self, payments):
+        batch_size = self._get_batch_size()
+        payment_objects = []
+        for payment in payments:
+            payment_objects.append(Payment(**payment))
+            if len(payment_objects) >= batch_size:
+                Payment.objects.bulk_create(payment_objects)
+                payment_objects = []
 
         Payment.objects.bulk_create(payment_objects)
 
+    # Store the payments using PostgreSQL's COPY, in batches. We skip the ORM altogether,
+    # so we need to fill in the timestamps ourselves.
+    def copy_payments(self, payments, table='payments'):
+        columns = self.PAYMENT_COLUMNS + ['created_at', 'updated_at']
+        sql = "COPY %s (%s) FROM STDIN WITH (FORMAT csv, NULL '\\N')" % (table, ', '.join(columns))
+        now = datetime.datetime.now().isoformat(' ')
+
+        batch_size = self._get_batch_size()
+        with connection.cursor() as cursor:
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            pending = 0
+            for payment in payments:
+                writer.writerow([self._to_copy_value(payment[column]) for column in self.PAYMENT_COLUMNS] + [now, now])
+                pending += 1
+                if pending >= batch_size:
+                    self._copy_buffer(cursor, sql, buffer)
+                    buffer = io.StringIO()
+                    writer = csv.writer(buffer)
+                    pending = 0
+
+            if pending > 0:
+                self._copy_buffer(cursor, sql, buffer)
+
+    def _copy_buffer(self, cursor, sql, buffer):
+        buffer.seek(0)
+        cursor.copy_expert(sql, buffer)
+
+    # Convert a value to its COPY text representation
+    def _to_copy_value(self, value):
+        if value is None:
+            return '\\N'
+        if isinstance(value, bool):
+            return 't' if value else 'f'
+        if isinstance(value, (datetime.date, datetime.datetime)):
+            return value.strftime('%Y-%m-%d')
+        return value
+
+    # Should we use PostgreSQL's COPY to store the payments? (Default: false)
+    # It's much faster for entities with millions of payments, but it's only available when
+    # running on PostgreSQL, so we fall back to the ORM on any other database.
+    def _use_copy(self):
+        return hasattr(settings, 'PAYMENTS_LOADER_USE_COPY') and settings.PAYMENTS_LOADER_USE_COPY \
+                and connection.vendor == 'postgresql'
+
     # Get the amount for a budget line
     def _get_amount(self, item):
         return self._read_english_number(item[9])
@@ -11,14 +11,29 @@ class SimpleBudgetLoader(BaseLoader):
         return ['ingresos.csv', 'gastos.csv', 'ejecucion_ingresos.csv', 'ejecucion_gastos.csv']
 
     def load(self, entity, year, path, status):
-        # Parse the incoming data and keep in memory
-        budget_items = []
-        for filename in self._get_input_filenames():
-            self.parse_budget_data(budget_items, os.path.join(path, filename))
+        # Parse the incoming data lazily, one line at a time, so we never keep whole files
+        # in memory, however large they are
+        budget_items = self.each_budget_item(path)
 
         # Now load the data one budget at a time
         self.load_budget(path, entity, year, status, budget_items)
 
+    # Iterate over the budget items in all the input files
+    def each_budget_item(self, path):
+        for filename in self._get_input_filenames():
+            for item in self.each_file_item(os.path.join(path, filename)):
+                yield item
+
+    # Iterate over the budget items in a single input file. Override this (or read_budget_data)
+    # to customize how a file is read. Themes overriding the old list-based parse_budget_data
+    # still work: we detect it and fall back to it, at the cost of keeping that file in memory.
+    def each_file_item(self, filename):
+        if type(self).parse_budget_data is not SimpleBudgetLoader.parse_budget_data:
+            budget_items = []
+            self.parse_budget_data(budget_items, filename)
+            return iter(budget_items)
+        return self.read_budget_data(filename)
+
 
     # OVERRIDE THIS!
     # I don't think it's worth offering a base implementation, not at this point at least, since
@@ -28,38 +43,52 @@ class SimpleBudgetLoader(BaseLoader):
         return {}
 
 
+    # Kept for compatibility with themes calling or overriding it, see each_file_item
     def parse_budget_data(self, budget_items, filename):
+        budget_items.extend(self.read_budget_data(filename))
+
+    def read_budget_data(self, filename):
         if os.path.isfile(filename):
             print("Leyendo datos de %s..." % filename)
-            reader = csv.reader(open(filename, 'r', encoding=self._get_data_files_encoding()), delimiter=self._get_delimiter())
-            for index, line in enumerate(reader):
-                if line==[] or re.match("^#", line[0]):     # Ignore comments and empty lines
-                    continue
+            with open(filename, 'r', encoding=self._get_data_files_encoding()) as f:
+                reader = csv.reader(f, delimiter=self._get_delimiter())
+                for index, line in enumerate(reader):
+                    if line==[] or re.match("^#", line[0]):     # Ignore comments and empty lines
+                        continue
 
-                # Finally, we have useful data
-                budget_items.append(self.parse_item(filename, line))
+                    # Finally, we have useful data
+                    yield self.parse_item(filename, line)
 
 
     def load_budget(self, path, entity, year, status, items):
-        # Delete previous budget for the given entity/year if it exists
-        Budget.objects.filter(entity=entity, year=year).delete()
-
-        # Store the data in the database
+        # Store the data in the database, on the side: it will replace the existing budget
+        # for the given entity/year, if any, when complete.
         print(u"Cargando presupuesto para entidad '%s' año %s..." % (entity.name, year))
-        budget = Budget(entity=entity, year=year, status=status)
-        budget.save()
-
-        # Load the economic and functional classification from a manually edited file
-        self.load_economic_classification(path, budget)
-        self.load_institutional_classification(path, budget)
-        self.load_functional_classification(path, budget)
-        self.load_geographic_classification(path, budget)
-
-        # Process the budget item
-        self.load_budget_items(budget, items)
-
-
-    # Load the budget items into the database. Do it in bulk to avoid hitting the database.
+        budget = Budget.objects.create_staging(entity, year, status)
+        try:
+            # Load the economic and functional classification from a manually edited file
+            self.load_economic_classification(path, budget)
+            self.load_institutional_classification(path, budget)
+            self.load_functional_classification(path, budget)
+            self.load_geographic_classification(path, budget)
+
+            # Process the budget item
+            self.load_budget_items(budget, items)
+        except:
+            # Don't leave the half loaded budget behind
+            Budget.objects.discard_staging(budget)
+            raise
+
+        # Replace the previous budget
+        Budget.objects.publish(budget, entity)
+
+        # The descriptions may have changed, so the cached ones are not valid anymore
+        Budget.objects.update_descriptions(entity)
+
+
+    # Load the budget items into the database. Do it in bulk to avoid hitting the database,
+    # flushing fixed-size batches as we go, so memory usage doesn't depend on the input size.
+    # The budget items can be any iterable, they are consumed only once.
     def load_budget_items(self, budget, budget_items):
         # Since the incoming data is not fully classified along the four dimensions we defined
         # for the main budget (Aragón, the good one), we are forced to assign the items a
@@ -90,6 +119,7 @@ class SimpleBudgetLoader(BaseLoader):
         # Store data in the database
         budgeted_income = 0
         budgeted_expense = 0
+        batch_size = self._get_batch_size()
         budget_item_objects = []
         for item in budget_items:
             # Ignore null entries or entries with no amount
@@ -148,7 +178,11 @@ class SimpleBudgetLoader(BaseLoader):
                       budget=budget)
             budget_item_objects.append(obj)
 
-        # Save the objects in one transaction
+            if len(budget_item_objects) >= batch_size:
+                BudgetItem.objects.bulk_create(budget_item_objects)
+                budget_item_objects = []
+
+        # Save the remaining objects
         BudgetItem.objects.bulk_create(budget_item_objects)
 
         if budgeted_income != budgeted_expense:
@@ -1,5 +1,5 @@
 # -*- coding: UTF-8 -*-
-from budget_app.models import InflationStat, PopulationStat, Entity
+from budget_app.models import InflationStat, PopulationStat, Entity, STAGING_ENTITY_LEVEL
 import csv
 import re
 import os.path
@@ -44,7 +44,7 @@ class StatLoader(object):
         PopulationStat.objects.all().delete()
 
     def _get_entity(self, code, name):
-        entity = Entity.objects.filter(code=code)
+        entity = Entity.objects.filter(code=code).exclude(level=STAGING_ENTITY_LEVEL)
         if not entity:
             raise Exception("Entity (%s/%s) not found" % (code, name))
         return entity.first()
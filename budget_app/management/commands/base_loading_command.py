@@ -1,13 +1,53 @@
 # -*- coding: UTF-8 -*-
 
+import io
+import multiprocessing
 import os.path
 import sys
 import logging
+import traceback
 
-from django.core.management.base import BaseCommand
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stdout
+from django.core.management.base import BaseCommand, CommandError
 from django.conf import settings
+from django.db import connections
 from budget_app.loaders import *
-from budget_app.models import Entity
+from budget_app.models import DataVersion, Entity, GLOBAL_DATA_VERSION
+
+
+# Let the application know the data has changed, so pages cached before are not used anymore.
+# To be called by every command modifying the data.
+def bump_data_version():
+    version = DataVersion.objects.bump(GLOBAL_DATA_VERSION)
+    print("Versión de los datos actualizada a %d" % version)
+
+# Load the data for a given entity and year using the theme loader with the given name
+def load_unit(loader_name, entity, year, path, status):
+    # Import the loader dynamically.
+    # See https://stackoverflow.com/questions/301134/dynamic-module-import-in-python
+    module = __import__(
+        settings.THEME+'.loaders',
+        globals(),
+        locals(),
+        [loader_name]
+    )
+    loader = module.__dict__[loader_name]()
+    loader.load(entity, year, path, status)
+
+# Entry point for parallel loads: runs in a worker process, so it gets only plain values
+# as arguments, and returns the unit output instead of printing it, so the logs of
+# different units don't get mixed up. Errors are returned too, to be reported at the end.
+def _load_unit_in_worker(loader_name, entity_id, year, path, status):
+    output = io.StringIO()
+    try:
+        with redirect_stdout(output):
+            load_unit(loader_name, Entity.objects.get(id=entity_id), year, path, status)
+        return (True, output.getvalue())
+    except Exception:
+        return (False, output.getvalue() + traceback.format_exc())
+    finally:
+        connections.close_all()
 
 class BaseLoadingCommand(BaseCommand):
     logging.disable(logging.ERROR)   # Avoid SQL logging on console
@@ -33,6 +73,13 @@ class BaseLoadingCommand(BaseCommand):
             default=settings.MAIN_ENTITY_NAME,
             help='Set entiy name')
 
+        parser.add_argument('--jobs',
+            action='store',
+            dest='jobs',
+            type=int,
+            default=1,
+            help='Number of years/languages to load in parallel')
+
     help = u"Carga el presupuesto del año"
 
     @staticmethod
@@ -62,6 +109,8 @@ class BaseLoadingCommand(BaseCommand):
         level = options['level']
         name = options['name']
 
+        # Every entity, year and language is an independent load, i.e. a unit of work
+        units = []
         for language in languages:
             # In Python 3 we need a fresh year iterator for every language iteration
             years = self._parse_number_range(options['years'])
@@ -90,16 +139,49 @@ class BaseLoadingCommand(BaseCommand):
                 except (IOError, IndexError):
                     status = ''
 
-                # Import the loader dynamically.
-                # See https://stackoverflow.com/questions/301134/dynamic-module-import-in-python
-                module = __import__(
-                    settings.THEME+'.loaders',
-                    globals(),
-                    locals(),
-                    [loader_name]
-                )
-                loader = module.__dict__[loader_name]()
-                loader.load(entity, year, path, status)
+                units.append((language, entity, year, path, status))
+
+        try:
+            if options['jobs'] > 1:
+                self._load_in_parallel(loader_name, units, options['jobs'])
+            else:
+                for language, entity, year, path, status in units:
+                    load_unit(loader_name, entity, year, path, status)
+        finally:
+            # Even if some load failed, others may have modified the data
+            bump_data_version()
+
+    # Load the given units in a pool of processes, each one with its own database connection.
+    # We keep going when a unit fails, and report all the failures at the end.
+    def _load_in_parallel(self, loader_name, units, jobs):
+        # Forked workers would inherit the open database connection otherwise, and a
+        # connection can't be shared across processes. Every worker will open its own.
+        connections.close_all()
+
+        failures = []
+        context = multiprocessing.get_context('fork')
+        with ProcessPoolExecutor(max_workers=jobs, mp_context=context) as executor:
+            futures = {}
+            for language, entity, year, path, status in units:
+                future = executor.submit(_load_unit_in_worker, loader_name, entity.id, year, path, status)
+                futures[future] = "%s %s (%s)" % (entity.name, year, language)
+
+            for future in as_completed(futures):
+                unit_name = futures[future]
+                try:
+                    success, output = future.result()
+                except Exception:
+                    success, output = False, traceback.format_exc()
+
+                print("=== %s ===" % unit_name)
+                print(output, end='')
+                if not success:
+                    failures.append(unit_name)
+
+        if failures:
+            for unit_name in failures:
+                print("ERROR: Falló la carga de %s" % unit_name, file=sys.stderr)
+            raise CommandError("%d de %d cargas fallaron" % (len(failures), len(units)))
 
     def _get_entity(self, level, name, language=None):
         entity = Entity.objects.filter(level=level, name=name, language=language)
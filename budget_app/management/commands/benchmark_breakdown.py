@@ -0,0 +1,172 @@
+# -*- coding: UTF-8 -*-
+
+import json
+import logging
+import random
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from budget_app.models import BudgetBreakdown
+
+
+# The original BudgetBreakdown implementation, kept as a reference for the benchmark
+class LegacyBudgetBreakdown:
+    def __init__(self, criteria=[]):
+        self.criteria = criteria
+        self.names = []
+        self.years = {}
+        self.subtotals = {}
+        self.total_expense = {}
+        self.total_income = {}
+
+    def add_item(self, column, item):
+        if not column in self.names:
+            self.names.append(column)
+            self.years[column] = item.year if hasattr(item, 'year') else ''
+
+        if item.expense:
+            if column not in self.total_expense:
+                self.total_expense[column] = 0
+            self.total_expense[column] += item.amount
+        else:
+            if column not in self.total_income:
+                self.total_income[column] = 0
+            self.total_income[column] += item.amount
+
+        if len(self.criteria) > 0:
+            if hasattr(self.criteria[0], '__call__'):
+                value = self.criteria[0](item)
+            else:
+                value = getattr(item, self.criteria[0])
+                if hasattr(value, '__call__'):
+                    value = value()
+
+            if value == None:
+                return
+
+            if value not in self.subtotals:
+                self.subtotals[value] = LegacyBudgetBreakdown(self.criteria[1:])
+            self.subtotals[value].add_item(column, item)
+
+    def to_json(self, labels=None, uid=None):
+        data = {
+            'expense': self.total_expense,
+            'income': self.total_income
+        }
+        if not uid:
+            data['years'] = self.years
+        if labels and uid:
+            data['label'] = labels.get(uid)
+        if len(self.subtotals) > 0:
+            data['sub'] = {}
+            for subtotal in self.subtotals:
+                data['sub'][subtotal] = self.subtotals[subtotal].to_json(uid=subtotal, labels=labels)
+        return data if uid else json.dumps(data)
+
+
+# A fake denormalized budget item, with the same fields and methods as the real one
+class SyntheticItem:
+    def __init__(self, year, actual, expense, amount, programme, heading, department, item_number):
+        self.year = year
+        self.actual = actual
+        self.expense = expense
+        self.amount = amount
+        self.policy = programme[0:2]
+        self.programme = programme
+        self.chapter = heading[0]
+        self.article = heading[0:2]
+        self.heading = heading
+        self.subheading = None
+        self.institution = department[0]
+        self.department = department
+        self.item_number = item_number
+
+    def economic_uid(self):
+        return str(self.year) + '/' + self.heading + '/' + self.item_number
+
+    def uid(self):
+        return self.department + '/' + self.economic_uid()
+
+
+def _get_year_tagged_department(item):
+    return getattr(item, 'department') + '/' + str(getattr(item, 'year'))
+
+
+# Breakdowns similar to the ones calculated in the policy pages
+CRITERIA = [
+    ['programme'],
+    ['chapter', 'article', 'heading', 'uid'],
+    ['institution', _get_year_tagged_department],
+]
+
+
+class Command(BaseCommand):
+    logging.disable(logging.ERROR)   # Avoid SQL logging on console
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items',
+            action='store',
+            dest='items',
+            type=int,
+            default=200000,
+            help='Number of synthetic budget items to aggregate')
+
+    help = u"Compara el rendimiento de BudgetBreakdown con la implementación original"
+
+    def handle(self, *args, **options):
+        items = self._generate_items(options['items'])
+
+        results = {}
+        for label, breakdown_class in [('Original', LegacyBudgetBreakdown), ('Actual', BudgetBreakdown)]:
+            breakdowns, elapsed, memory = self._measure(breakdown_class, items)
+            nodes = sum(self._count_nodes(breakdown) for breakdown in breakdowns)
+            results[label] = [breakdown.to_json() for breakdown in breakdowns]
+            print("%s: %d items/s, %d nodos, %d bytes/nodo" % \
+                    (label, len(items) / elapsed, nodes, memory / nodes))
+
+        if results['Original'] != results['Actual']:
+            raise CommandError("Los resultados de ambas implementaciones no coinciden")
+
+    def _measure(self, breakdown_class, items):
+        # Time the aggregation...
+        breakdowns = [breakdown_class(criteria) for criteria in CRITERIA]
+        start = time.perf_counter()
+        self._aggregate(breakdowns, items)
+        elapsed = time.perf_counter() - start
+
+        # ...and then, separately, the memory used, since tracing slows things down
+        tracemalloc.start()
+        breakdowns = [breakdown_class(criteria) for criteria in CRITERIA]
+        self._aggregate(breakdowns, items)
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+        return (breakdowns, elapsed, memory)
+
+    def _aggregate(self, breakdowns, items):
+        for item in items:
+            column_name = ('actual_' if item.actual else '') + str(item.year)
+            for breakdown in breakdowns:
+                breakdown.add_item(column_name, item)
+
+    def _count_nodes(self, breakdown):
+        return 1 + sum(self._count_nodes(child) for child in breakdown.subtotals.values())
+
+    def _generate_items(self, count):
+        random.seed(0)
+        programmes = ['%02d%02d' % (random.randint(10, 99), random.randint(0, 99)) for i in range(200)]
+        headings = ['%d%d%d' % (random.randint(1, 9), random.randint(0, 9), random.randint(0, 9)) for i in range(300)]
+        departments = ['%d%02d' % (random.randint(1, 9), random.randint(0, 99)) for i in range(50)]
+
+        items = []
+        for i in range(count):
+            items.append(SyntheticItem(random.randint(2015, 2024),
+                                        random.random() < 0.5,
+                                        random.random() < 0.7,
+                                        random.randint(1, 10000000),
+                                        random.choice(programmes),
+                                        random.choice(headings),
+                                        random.choice(departments),
+                                        str(random.randint(0, 99))))
+        return items
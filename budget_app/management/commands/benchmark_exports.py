@@ -0,0 +1,141 @@
+# -*- coding: UTF-8 -*-
+
+import csv
+import io
+import logging
+import random
+import time
+
+from collections import namedtuple
+from functools import reduce
+
+from django.core.management.base import BaseCommand, CommandError
+from budget_app.models import BudgetBreakdown
+from budget_app.views.csv_xls import stream_economic_breakdown, stream_entity_functional_breakdown, write_header
+
+
+# The original export code, kept as a reference for the benchmark
+def _legacy_unique(list):
+    return reduce(lambda l, x: l.append(x) or l if x not in l else l, list, [])
+
+def legacy_write_breakdown_item(writer, year, item, field, ids, descriptions=None):
+    budget_column_name = str(year)
+    actual_column_name = 'actual_'+str(year)
+    totals = item.total_expense if field == 'expense' else item.total_income
+
+    if not totals.get(budget_column_name) and not totals.get(actual_column_name):
+        return
+
+    values = [year]
+
+    for id in ids:
+        values.append(id)
+        if descriptions!=None:
+            values.append( descriptions.get(id, '') )
+
+    values.append( totals[budget_column_name] / 100.0 if budget_column_name in totals else None )
+    values.append( totals[actual_column_name] / 100.0 if actual_column_name in totals else None )
+
+    writer.writerow(values)
+
+def legacy_write_economic_breakdown(c, writer):
+    write_header(writer, [u'Año.csv', u'Id Capítulo', u'Nombre Capítulo', u'Id Artículo', u'Nombre Artículo', 'Id Concepto', 'Nombre Concepto', 'Presupuesto Gastos', 'Gastos Reales'])
+    for year in sorted(_legacy_unique(c['breakdowns']['economic'].years.values())):
+        for chapter_id, chapter in c['breakdowns']['economic'].subtotals.items():
+            legacy_write_breakdown_item(writer, year, chapter, 'expense', [chapter_id, None, None], c['descriptions']['economic'])
+            for article_id, article in chapter.subtotals.items():
+                legacy_write_breakdown_item(writer, year, article, 'expense', [chapter_id, article_id, None], c['descriptions']['economic'])
+                for heading_id, heading in article.subtotals.items():
+                    legacy_write_breakdown_item(writer, year, heading, 'expense', [chapter_id, article_id, heading_id], c['descriptions']['economic'])
+
+def legacy_write_entity_functional_breakdown(c, writer):
+    write_header(writer, [u'Año.csv', u'Id Política', u'Nombre Política', 'Id Programa', 'Nombre Programa', 'Presupuesto Gasto', 'Gasto Real'])
+    for year in sorted(_legacy_unique(c['breakdowns']['functional'].years.values())):
+        for policy_id, policy in c['breakdowns']['functional'].subtotals.items():
+            legacy_write_breakdown_item(writer, year, policy, 'expense', [policy_id, None], c['descriptions']['functional'])
+            for programme_id, programme in policy.subtotals.items():
+                legacy_write_breakdown_item(writer, year, programme, 'expense', [policy_id, programme_id], c['descriptions']['functional'])
+
+
+# A fake denormalized budget item, with the fields used by the breakdowns below
+SyntheticItem = namedtuple('SyntheticItem', 'year actual expense amount chapter article heading policy programme')
+
+WRITERS = [
+    ('económica', legacy_write_economic_breakdown, stream_economic_breakdown),
+    ('funcional', legacy_write_entity_functional_breakdown, stream_entity_functional_breakdown),
+]
+
+
+class Command(BaseCommand):
+    logging.disable(logging.ERROR)   # Avoid SQL logging on console
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items',
+            action='store',
+            dest='items',
+            type=int,
+            default=200000,
+            help='Number of synthetic budget items in the breakdowns')
+
+        parser.add_argument('--years',
+            action='store',
+            dest='years',
+            type=int,
+            default=15,
+            help='Number of years in the breakdowns')
+
+    help = u"Compara el rendimiento de la exportación de desgloses a CSV con la implementación original"
+
+    def handle(self, *args, **options):
+        c = self._generate_context(options['items'], options['years'])
+
+        for name, legacy_writer, writer in WRITERS:
+            legacy_output, legacy_elapsed = self._measure(lambda w: legacy_writer(c, w))
+            output, elapsed = self._measure(lambda w: list(writer(c, w)))
+
+            if legacy_output != output:
+                raise CommandError("Los resultados de ambas implementaciones no coinciden (%s)" % name)
+
+            lines = output.count('\n')
+            print("%s: %d líneas. Original: %d líneas/s. Actual: %d líneas/s" % \
+                    (name, lines, lines / legacy_elapsed, lines / elapsed))
+
+    def _measure(self, write):
+        output = io.StringIO()
+        start = time.perf_counter()
+        write(csv.writer(output))
+        return (output.getvalue(), time.perf_counter() - start)
+
+    def _generate_context(self, count, year_count):
+        random.seed(0)
+        headings = ['%d%d%d' % (random.randint(1, 9), random.randint(0, 9), random.randint(0, 9)) for i in range(500)]
+        programmes = ['%02d%02d' % (random.randint(10, 99), random.randint(0, 99)) for i in range(300)]
+        years = list(range(2024 - year_count + 1, 2025))
+
+        economic = BudgetBreakdown(['chapter', 'article', 'heading'])
+        functional = BudgetBreakdown(['policy', 'programme'])
+        for i in range(count):
+            heading = random.choice(headings)
+            programme = random.choice(programmes)
+            item = SyntheticItem(random.choice(years),
+                                    random.random() < 0.5,
+                                    True,
+                                    random.randint(1, 10000000),
+                                    heading[0],
+                                    heading[0:2],
+                                    heading,
+                                    programme[0:2],
+                                    programme)
+            column_name = ('actual_' if item.actual else '') + str(item.year)
+            economic.add_item(column_name, item)
+            functional.add_item(column_name, item)
+
+        descriptions = {}
+        for uid in headings + programmes:
+            for length in range(1, len(uid) + 1):
+                descriptions[uid[0:length]] = 'Descripción %s' % uid[0:length]
+
+        return {
+            'breakdowns': {'economic': economic, 'functional': functional},
+            'descriptions': {'economic': descriptions, 'functional': descriptions}
+        }
@@ -0,0 +1,119 @@
+# -*- coding: UTF-8 -*-
+
+import logging
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import connection, transaction
+from budget_app.loaders import PaymentsLoader
+from budget_app.models import Budget, Entity, EconomicCategory, FunctionalCategory, Payment
+
+
+# A payments loader that always uses the ORM, whatever the settings
+class OrmPaymentsLoader(PaymentsLoader):
+    def _use_copy(self):
+        return False
+
+# A payments loader that always uses COPY
+class CopyPaymentsLoader(PaymentsLoader):
+    def _use_copy(self):
+        return True
+
+
+class Command(BaseCommand):
+    logging.disable(logging.ERROR)   # Avoid SQL logging on console
+
+    def add_arguments(self, parser):
+        parser.add_argument('year')
+
+        parser.add_argument('--rows',
+            action='store',
+            dest='rows',
+            type=int,
+            default=100000,
+            help='Number of synthetic payments to load')
+
+        parser.add_argument('--language',
+            action='store',
+            dest='language',
+            default=settings.LANGUAGE_CODE,
+            help='Set data language')
+
+        parser.add_argument('--level',
+            action='store',
+            dest='level',
+            default=settings.MAIN_ENTITY_LEVEL,
+            help='Set entity level')
+
+        parser.add_argument('--name',
+            action='store',
+            dest='name',
+            default=settings.MAIN_ENTITY_NAME,
+            help='Set entiy name')
+
+    help = u"Compara la velocidad de carga de pagos usando el ORM y usando COPY. " \
+            u"Los pagos cargados se descartan al terminar"
+
+    def handle(self, *args, **options):
+        entity = Entity.objects.filter(level=options['level'], name=options['name'], language=options['language']).first()
+        if not entity:
+            raise CommandError("Entity (%s/%s) not found" % (options['level'], options['name']))
+        budget = Budget.objects.filter(entity=entity, year=options['year']).first()
+        if not budget:
+            raise CommandError("Budget (%s/%s) not found" % (entity.name, options['year']))
+
+        items = self._generate_items(budget, options['rows'])
+
+        loaders = [('ORM', OrmPaymentsLoader)]
+        if connection.vendor == 'postgresql':
+            loaders.append(('COPY', CopyPaymentsLoader))
+        else:
+            print("COPY sólo está disponible en PostgreSQL, se omite.")
+
+        for label, loader_class in loaders:
+            # Load the payments in a transaction we roll back afterwards, so the data
+            # in the database is left as it was.
+            with transaction.atomic():
+                existing = Payment.objects.filter(budget=budget).count()
+                start = time.perf_counter()
+                loader_class().load_items(budget, items)
+                elapsed = time.perf_counter() - start
+                count = Payment.objects.filter(budget=budget).count() - existing
+                transaction.set_rollback(True)
+
+            print("%s: %d pagos en %.2fs (%d pagos/s)" % (label, count, elapsed, count / elapsed))
+
+    # Build synthetic payment lines, in the format expected by the generic loader,
+    # classified along the categories of the given budget.
+    def _generate_items(self, budget, rows):
+        economic_codes = EconomicCategory.objects \
+                            .filter(budget=budget, expense=True, heading__isnull=False, subheading__isnull=True) \
+                            .values_list('heading', flat=True)
+        economic_codes = list(economic_codes) or ['']
+        if PaymentsLoader()._use_subprogrammes():
+            functional_codes = FunctionalCategory.objects \
+                                .filter(budget=budget, subprogramme__isnull=False) \
+                                .values_list('subprogramme', flat=True)
+        else:
+            functional_codes = FunctionalCategory.objects \
+                                .filter(budget=budget, programme__isnull=False, subprogramme__isnull=True) \
+                                .values_list('programme', flat=True)
+        functional_codes = list(functional_codes) or ['']
+
+        items = []
+        for i in range(rows):
+            items.append([
+                'Area %d' % (i % 20),
+                random.choice(functional_codes),
+                random.choice(economic_codes),
+                '',
+                '%s-%02d-%02d' % (budget.year, i % 12 + 1, i % 28 + 1),
+                '',
+                'Proveedor %d' % (i % 5000),
+                '',
+                'Pago %d' % i,
+                '%d.%02d' % (random.randint(1, 100000), random.randint(0, 99)),
+            ])
+        return items
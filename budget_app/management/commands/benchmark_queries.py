@@ -0,0 +1,167 @@
+# -*- coding: UTF-8 -*-
+
+import json
+import logging
+import statistics
+
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import connection
+from budget_app.models import Budget, BudgetCubeManager, BudgetItemManager, Entity, EconomicCategory, \
+                                FunctionalCategory, InstitutionalCategory, get_denormalized_sql
+
+
+# The budget item queries run by the pages (see `get_budget_breakdown` calls in the views),
+# as (name, table, constraints, arguments). The arguments are taken from the sample
+# categories found in the database, see `_get_samples`.
+QUERIES = [
+    ('resumen', 'budget_cubes', "e.id = %s", ['entity']),
+    ('entidad', 'budget_items', "e.id = %s", ['entity']),
+    ('entidad, funcional', 'budget_items', "e.id = %s and fc.area <> 'X'", ['entity']),
+    ('entidad, económica', 'budget_cubes', "e.id = %s and ec.chapter <> 'X'", ['entity']),
+    ('política', 'budget_items', "fc.policy = %s and e.id = %s", ['policy', 'entity']),
+    ('programa', 'budget_items', "fc.programme = %s and e.id = %s", ['programme', 'entity']),
+    ('subprograma', 'budget_items', "fc.subprogramme = %s and e.id = %s", ['subprogramme', 'entity']),
+    ('artículo', 'budget_items', "ec.article = %s and e.id = %s and i.expense = %s", ['article', 'entity', 'expense']),
+    ('capítulo', 'budget_items', "ec.chapter = %s and e.id = %s", ['chapter', 'entity']),
+    ('sección', 'budget_items', "ic.department = %s and e.id = %s and i.expense = true", ['department', 'entity']),
+    ('entidades', 'budget_items', "e.level = %s and ec.chapter <> 'X'", ['level']),
+]
+
+ITEM_FIELDS = {
+    'budget_items': BudgetItemManager.ITEM_FIELDS,
+    'budget_cubes': BudgetCubeManager.ITEM_FIELDS,
+}
+
+
+class Command(BaseCommand):
+    logging.disable(logging.ERROR)   # Avoid SQL logging on console
+
+    def add_arguments(self, parser):
+        parser.add_argument('--repeat',
+            action='store',
+            dest='repeat',
+            type=int,
+            default=3,
+            help='Number of times each query is run')
+
+        parser.add_argument('--output',
+            action='store',
+            dest='output',
+            help='Save the results as JSON in the given file')
+
+        parser.add_argument('--baseline',
+            action='store',
+            dest='baseline',
+            help='Compare with the results previously saved in the given file')
+
+        parser.add_argument('--tolerance',
+            action='store',
+            dest='tolerance',
+            type=float,
+            default=1.5,
+            help='Slowdown over the baseline considered a regression (default: 1.5)')
+
+    help = u"Mide con EXPLAIN ANALYZE las consultas de partidas presupuestarias de las páginas"
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Este benchmark necesita PostgreSQL")
+
+        samples = self._get_samples()
+
+        results = {}
+        for name, table, constraints, arguments in QUERIES:
+            if any(samples.get(argument) is None for argument in arguments):
+                print("%s: no hay datos de ejemplo, se omite" % name)
+                continue
+
+            sql = get_denormalized_sql(table, ITEM_FIELDS[table], constraints)
+            results[name] = self._explain(sql, [samples[argument] for argument in arguments], options['repeat'])
+            print("%s: %.1fms, %d filas%s" % (name,
+                                                results[name]['time'],
+                                                results[name]['rows'],
+                                                self._describe_seq_scans(results[name]['seq_scans'])))
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+        if options['baseline']:
+            self._compare(results, options['baseline'], options['tolerance'])
+
+    # Run the query with EXPLAIN ANALYZE, returning the median execution time, the number
+    # of rows returned and the tables read sequentially, which should only be small ones.
+    def _explain(self, sql, arguments, repeat):
+        timings = []
+        with connection.cursor() as cursor:
+            for i in range(repeat):
+                cursor.execute("explain (analyze, buffers, format json) " + sql, arguments)
+                plan = cursor.fetchone()[0]
+                if isinstance(plan, str):
+                    plan = json.loads(plan)
+                timings.append(plan[0]['Execution Time'])
+
+        return {
+            'time': statistics.median(timings),
+            'rows': plan[0]['Plan']['Actual Rows'],
+            'seq_scans': sorted(set(self._get_seq_scans(plan[0]['Plan'])))
+        }
+
+    def _get_seq_scans(self, node):
+        if node['Node Type'] == 'Seq Scan':
+            yield node['Relation Name']
+        for child in node.get('Plans', []):
+            yield from self._get_seq_scans(child)
+
+    def _describe_seq_scans(self, seq_scans):
+        return (" (lectura secuencial de %s)" % ', '.join(seq_scans)) if seq_scans else ""
+
+    def _compare(self, results, baseline_filename, tolerance):
+        with open(baseline_filename) as f:
+            baseline = json.load(f)
+
+        regressions = []
+        for name, result in results.items():
+            if name not in baseline:
+                continue
+            before = baseline[name]['time']
+            # Ignore differences below a millisecond, they're just noise
+            if result['time'] > before * tolerance and result['time'] - before > 1:
+                regressions.append(name)
+            print("%s: %.1fms antes, %.1fms ahora" % (name, before, result['time']))
+
+        if regressions:
+            raise CommandError("Consultas más lentas que en %s: %s" % (baseline_filename, ', '.join(regressions)))
+
+    # Pick a category of each kind, from the latest budget of the main entity
+    def _get_samples(self):
+        entity = Entity.objects.filter(level=settings.MAIN_ENTITY_LEVEL,
+                                        name=settings.MAIN_ENTITY_NAME,
+                                        language=settings.LANGUAGE_CODE).first()
+        if not entity:
+            raise CommandError("No se encuentra la entidad principal")
+
+        samples = {
+            'entity': entity.id,
+            'level': entity.level,
+            'expense': True,
+        }
+
+        budget = Budget.objects.filter(entity=entity).order_by('-year').first()
+        if budget:
+            functional_categories = FunctionalCategory.objects.filter(budget=budget)
+            economic_categories = EconomicCategory.objects.filter(budget=budget, expense=True)
+            institutional_categories = InstitutionalCategory.objects.filter(budget=budget)
+            samples['policy'] = self._first(functional_categories, 'policy')
+            samples['programme'] = self._first(functional_categories, 'programme')
+            samples['subprogramme'] = self._first(functional_categories, 'subprogramme')
+            samples['chapter'] = self._first(economic_categories, 'chapter')
+            samples['article'] = self._first(economic_categories, 'article')
+            samples['department'] = self._first(institutional_categories, 'department')
+
+        return samples
+
+    def _first(self, categories, field):
+        return categories.filter(**{field+'__isnull': False}) \
+                            .order_by(field).values_list(field, flat=True).first()
@@ -0,0 +1,110 @@
+# -*- coding: UTF-8 -*-
+
+import logging
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import connection, transaction
+
+
+# Words used to make up the synthetic payments, and the searches we time
+WORDS = ['suministro', 'material', 'oficina', 'mantenimiento', 'edificio', 'servicio', 'limpieza',
+         'transporte', 'escolar', 'obras', 'reparación', 'vía', 'pública', 'subvención', 'asociación',
+         'cultural', 'deportiva', 'alquiler', 'maquinaria', 'consultoría', 'informática', 'licencias',
+         'energía', 'eléctrica', 'agua', 'seguridad', 'vigilancia', 'formación', 'personal', 'festejos']
+QUERIES = ['limpieza', 'material de oficina', 'subvención asociación cultural', 'zanahoria']
+
+
+class Command(BaseCommand):
+    logging.disable(logging.ERROR)   # Avoid SQL logging on console
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows',
+            action='store',
+            dest='rows',
+            type=int,
+            default=1000000,
+            help='Number of synthetic payments to search')
+
+        parser.add_argument('--repeat',
+            action='store',
+            dest='repeat',
+            type=int,
+            default=5,
+            help='Number of times each search is run')
+
+    help = u"Compara la búsqueda de texto en pagos con y sin vector de búsqueda indexado"
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Este benchmark necesita PostgreSQL")
+
+        # Work on a temporary table, inside a transaction we roll back at the end
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                print("Creando %d pagos sintéticos..." % options['rows'])
+                self._create_payments(cursor, options['rows'])
+
+                # Search calculating the vectors on the fly, as before...
+                before = self._time_queries(cursor,
+                        "to_tsvector('"+settings.SEARCH_CONFIG+"',payee||' '||description)",
+                        options['repeat'])
+
+                # ...and using an indexed generated column, as now
+                start = time.perf_counter()
+                cursor.execute(
+                    "alter table benchmark_payments add column search_vector tsvector "
+                        "generated always as (to_tsvector('"+settings.SEARCH_CONFIG+"'::regconfig, payee||' '||description)) stored")
+                cursor.execute("create index on benchmark_payments using gin (search_vector)")
+                cursor.execute("analyze benchmark_payments")
+                print("Vector de búsqueda e índice creados en %.1fs" % (time.perf_counter() - start))
+
+                after = self._time_queries(cursor, "search_vector", options['repeat'])
+
+            transaction.set_rollback(True)
+
+        for query in QUERIES:
+            print("'%s': %d resultados, %.1fms antes, %.1fms ahora" % \
+                    (query, before[query][0], before[query][1] * 1000, after[query][1] * 1000))
+
+    def _create_payments(self, cursor, rows):
+        cursor.execute(
+            "create temporary table benchmark_payments ("
+                "id serial primary key, "
+                "payee varchar(200) not null, "
+                "description varchar(300) not null, "
+                "amount bigint not null)")
+
+        # Descriptions are made of four random words
+        words = "array[%s]" % ', '.join(["'%s'" % word for word in WORDS])
+        random_word = "(%s)[1 + floor(random() * %d)::int]" % (words, len(WORDS))
+        cursor.execute(
+            "insert into benchmark_payments (payee, description, amount) "
+            "select "
+                "'Beneficiario ' || floor(random() * 5000)::int, "
+                "%s || ' ' || %s || ' ' || %s || ' ' || %s, "
+                "floor(random() * 100000000)::bigint "
+            "from generate_series(1, %%s)" % (random_word, random_word, random_word, random_word),
+            [rows])
+        cursor.execute("analyze benchmark_payments")
+
+    # Return the number of results and the median time of the search queries, like in
+    # PaymentManager.search, which gets all the results sorted by amount
+    def _time_queries(self, cursor, vector, repeat):
+        results = {}
+        for query in QUERIES:
+            sql = "select id, payee, description, amount from benchmark_payments " \
+                    "where "+vector+" @@ plainto_tsquery('"+settings.SEARCH_CONFIG+"',%s) " \
+                    "order by amount desc"
+
+            timings = []
+            for i in range(repeat):
+                start = time.perf_counter()
+                cursor.execute(sql, [query])
+                rows = cursor.fetchall()
+                timings.append(time.perf_counter() - start)
+
+            results[query] = (len(rows), statistics.median(timings))
+        return results
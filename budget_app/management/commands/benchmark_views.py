@@ -0,0 +1,461 @@
+# -*- coding: UTF-8 -*-
+
+import datetime
+import json
+import logging
+import math
+import random
+import time
+import tracemalloc
+
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import translation
+from budget_app.models import Budget, BudgetCube, BudgetItem, EconomicCategory, Entity, FunctionalCategory, \
+                                FundingCategory, Goal, GoalActivity, GoalIndicator, InflationStat, InstitutionalCategory, \
+                                PayeeSummary, Payment, PaymentRollup, PopulationStat
+from budget_app.management.commands import bump_data_version
+
+
+# Words used to make up the synthetic descriptions, and the search we time
+WORDS = ['servicio', 'suministro', 'material', 'oficina', 'mantenimiento', 'edificio', 'limpieza',
+         'transporte', 'escolar', 'obras', 'reparación', 'vía', 'pública', 'subvención', 'asociación',
+         'cultural', 'deportiva', 'alquiler', 'maquinaria', 'consultoría', 'informática', 'licencias',
+         'energía', 'eléctrica', 'agua', 'seguridad', 'vigilancia', 'formación', 'personal', 'festejos']
+
+# The pages we time, as (name, URL name, URL arguments, query parameters). Argument and
+# parameter values are filled in with the sample data found in the database, see `_get_samples`.
+VIEWS = [
+    ('budgets', 'budgets', {}, {}),
+    ('policies_show', 'policies_show', {'id': '%(policy)s', 'title': 'benchmark'}, {}),
+    ('programmes_show', 'programmes_show', {'id': '%(programme)s', 'title': 'benchmark'}, {}),
+    ('entities_show_helper', 'entities_policies', {'id': '%(entity)s'}, {}),
+    ('payment_search', 'payment_search', {}, {}),
+    ('payment_search, beneficiario', 'payment_search', {}, {'payee': '%(payee)s'}),
+    ('search', 'search', {}, {'q': '%(word)s'}),
+    ('monitoring', 'monitoring', {}, {}),
+    ('csv, política', 'functional_policy_breakdown', {'id': '%(policy)s', 'format': 'csv'}, {}),
+    ('xlsx, política', 'functional_policy_breakdown', {'id': '%(policy)s', 'format': 'xlsx'}, {}),
+    ('csv, pagos', 'entity_payments', {'slug': '%(slug)s', 'format': 'csv'}, {}),
+    ('xlsx, pagos', 'entity_payments', {'slug': '%(slug)s', 'format': 'xlsx'}, {}),
+]
+
+# We want to time the views themselves, not the page cache or the prebuilt exports
+BYPASSED_MIDDLEWARE = [
+    'project.middleware.VersionedUpdateCacheMiddleware',
+    'project.middleware.VersionedFetchFromCacheMiddleware',
+    'project.middleware.PrebuiltExportsMiddleware',
+]
+
+# The level of the secondary entities we create, besides the main one
+SECONDARY_ENTITY_LEVEL = 'municipio'
+
+
+class Command(BaseCommand):
+    logging.disable(logging.ERROR)   # Avoid SQL logging on console
+
+    def add_arguments(self, parser):
+        parser.add_argument('--entities',
+            action='store',
+            dest='entities',
+            type=int,
+            default=3,
+            help='Number of synthetic entities, including the main one')
+
+        parser.add_argument('--years',
+            action='store',
+            dest='years',
+            type=int,
+            default=5,
+            help='Number of years of data for each entity')
+
+        parser.add_argument('--items',
+            action='store',
+            dest='items',
+            type=int,
+            default=5000,
+            help='Number of budget items in each budget')
+
+        parser.add_argument('--payments',
+            action='store',
+            dest='payments',
+            type=int,
+            default=10000,
+            help='Number of payments in each budget')
+
+        parser.add_argument('--goals',
+            action='store',
+            dest='goals',
+            type=int,
+            default=50,
+            help='Number of goals in each budget')
+
+        parser.add_argument('--repeat',
+            action='store',
+            dest='repeat',
+            type=int,
+            default=10,
+            help='Number of times each page is requested')
+
+        parser.add_argument('--keepdb',
+            action='store_true',
+            dest='keepdb',
+            default=False,
+            help='Keep the test database, and its data, for the next run')
+
+        parser.add_argument('--output',
+            action='store',
+            dest='output',
+            help='Save the results as JSON in the given file')
+
+        parser.add_argument('--baseline',
+            action='store',
+            dest='baseline',
+            help='Compare with the results previously saved in the given file')
+
+        parser.add_argument('--tolerance',
+            action='store',
+            dest='tolerance',
+            type=float,
+            default=1.5,
+            help='Slowdown over the baseline considered a regression (default: 1.5)')
+
+    help = u"Mide el tiempo de respuesta de las páginas principales sobre datos sintéticos en una base de datos de test"
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("Este benchmark necesita PostgreSQL")
+
+        # Work on a separate database, as the tests do, so we never touch the real data.
+        # Caches are kept in memory too, so the real ones don't mix with the synthetic data.
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, keepdb=options['keepdb'], serialize=False)
+        try:
+            with override_settings(CACHES=self._get_memory_caches(),
+                                    MIDDLEWARE=[m for m in settings.MIDDLEWARE if m not in BYPASSED_MIDDLEWARE],
+                                    ALLOWED_HOSTS=list(settings.ALLOWED_HOSTS) + ['testserver']):
+                if self._get_main_entity():
+                    print("Usando los datos sintéticos existentes")
+                else:
+                    self._generate_data(options)
+
+                results = {
+                    'data': self._get_data_size(),
+                    'views': self._time_views(self._get_samples(), options['repeat'])
+                }
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0, keepdb=options['keepdb'])
+
+        if options['output']:
+            with open(options['output'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+        if options['baseline']:
+            self._compare(results, options['baseline'], options['tolerance'])
+
+    def _get_memory_caches(self):
+        return {alias: {
+                    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                    'LOCATION': 'benchmark_views_%s' % alias
+                } for alias in settings.CACHES}
+
+    #
+    # TIMING
+    #
+
+    # Request every page a number of times, returning its median and 95th percentile
+    # response times, in milliseconds, the number of queries and the peak memory allocated.
+    # The default cache, with the search results, is cleared before each request, so we
+    # time the whole of it every time.
+    # The queries and memory are measured on separate requests, as keeping track of them
+    # slows things down. Queries run in other threads (see `SEARCH_THREADS`) aren't counted.
+    def _time_views(self, samples, repeat):
+        client = Client()
+        results = {}
+        for name, url_name, arguments, parameters in VIEWS:
+            with translation.override(settings.LANGUAGE_CODE):
+                url = reverse(url_name, kwargs={key: value % samples for key, value in arguments.items()})
+            parameters = {key: value % samples for key, value in parameters.items()}
+
+            # The first request warms up the process-wide caches, like the descriptions
+            size = len(self._request(client, url, parameters))
+
+            # Count them now, the log is cleared when the next request starts
+            with CaptureQueriesContext(connection) as queries:
+                self._request(client, url, parameters)
+            query_count = len(queries.captured_queries)
+
+            timings = []
+            for i in range(repeat):
+                start = time.perf_counter()
+                self._request(client, url, parameters)
+                timings.append((time.perf_counter() - start) * 1000)
+
+            tracemalloc.start()
+            self._request(client, url, parameters)
+            peak_memory = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            results[name] = {
+                'url': url,
+                'p50': self._percentile(timings, 50),
+                'p95': self._percentile(timings, 95),
+                'queries': query_count,
+                'memory': peak_memory,
+                'size': size,
+            }
+            print("%s: p50 %.1fms, p95 %.1fms, %d consultas, %.1fMB de memoria, %d bytes" % (name,
+                                                                                results[name]['p50'],
+                                                                                results[name]['p95'],
+                                                                                results[name]['queries'],
+                                                                                peak_memory / 1024 / 1024,
+                                                                                size))
+        return results
+
+    # Request a page, reading the whole of it, which for the exports is when the work happens
+    def _request(self, client, url, parameters):
+        caches['default'].clear()
+        response = client.get(url, parameters)
+        if response.status_code != 200:
+            raise CommandError("Error %d al pedir %s" % (response.status_code, url))
+        return b''.join(response.streaming_content) if response.streaming else response.content
+
+    def _percentile(self, values, percentile):
+        values = sorted(values)
+        return values[max(0, math.ceil(len(values) * percentile / 100.0) - 1)]
+
+    def _compare(self, results, baseline_filename, tolerance):
+        with open(baseline_filename) as f:
+            baseline = json.load(f)
+
+        if baseline['data'] != results['data']:
+            print("AVISO: Los datos no coinciden con los de %s, los resultados no son comparables" % baseline_filename)
+
+        regressions = []
+        for name, result in results['views'].items():
+            if name not in baseline['views']:
+                continue
+            before = baseline['views'][name]
+            # Ignore differences below a millisecond, they're just noise
+            if result['p50'] > before['p50'] * tolerance and result['p50'] - before['p50'] > 1:
+                regressions.append(name)
+            print("%s: %.1fms antes, %.1fms ahora; %d consultas antes, %d ahora" % \
+                    (name, before['p50'], result['p50'], before['queries'], result['queries']))
+
+        if regressions:
+            raise CommandError("Páginas más lentas que en %s: %s" % (baseline_filename, ', '.join(regressions)))
+
+    def _get_main_entity(self):
+        return Entity.objects.filter(level=settings.MAIN_ENTITY_LEVEL,
+                                        name=settings.MAIN_ENTITY_NAME,
+                                        language=settings.LANGUAGE_CODE).first()
+
+    # Pick the sample policy, programme, entity and payee the pages are requested for
+    def _get_samples(self):
+        entity = self._get_main_entity()
+        budget = Budget.objects.latest(entity.id)
+        programme = FunctionalCategory.objects.filter(budget=budget, programme__isnull=False) \
+                                                .exclude(area='X') \
+                                                .order_by('programme') \
+                                                .first()
+        secondary_entity = Entity.objects.filter(level=SECONDARY_ENTITY_LEVEL,
+                                                    language=settings.LANGUAGE_CODE) \
+                                            .order_by('code') \
+                                            .first()
+        payee = PayeeSummary.objects.search(entity).filter(payments_count__gt=1).first()
+
+        return {
+            'policy': programme.policy,
+            'programme': programme.programme,
+            'entity': (secondary_entity or entity).code,
+            'slug': entity.slug,
+            'payee': payee.payee if payee else '',
+            'word': WORDS[0],
+        }
+
+    def _get_data_size(self):
+        return {
+            'entities': Entity.objects.count(),
+            'budgets': Budget.objects.count(),
+            'items': BudgetItem.objects.count(),
+            'payments': Payment.objects.count(),
+            'goals': Goal.objects.count(),
+        }
+
+    #
+    # SYNTHETIC DATA
+    #
+
+    def _generate_data(self, options):
+        random.seed(0)
+        start = time.perf_counter()
+
+        entities = [Entity(code='0',
+                            level=settings.MAIN_ENTITY_LEVEL,
+                            name=settings.MAIN_ENTITY_NAME,
+                            language=settings.LANGUAGE_CODE)]
+        for i in range(1, options['entities']):
+            entities.append(Entity(code=str(i),
+                                    level=SECONDARY_ENTITY_LEVEL,
+                                    name='Municipio %d' % i,
+                                    language=settings.LANGUAGE_CODE))
+
+        payees = ['%s %d S.L.' % (random.choice(WORDS).capitalize(), i) for i in range(max(1, options['payments'] // 20))]
+        last_year = datetime.date.today().year - 1
+        years = range(last_year - options['years'] + 1, last_year + 1)
+        InflationStat.objects.bulk_create([InflationStat(year=year, inflation=round(random.uniform(0, 4), 1)) for year in years])
+
+        for entity in entities:
+            entity.save()
+            population = random.randint(1000, 1000000)
+            PopulationStat.objects.bulk_create([PopulationStat(entity=entity, year=year, population=population) for year in years])
+
+            for year in years:
+                print("Creando el presupuesto de %s para %d..." % (entity.name, year))
+                with transaction.atomic():
+                    budget = Budget(entity=entity, year=year, status='')
+                    budget.save()
+                    categories = self._create_categories(budget)
+                    self._create_items(budget, categories, options['items'])
+                    self._create_payments(budget, categories, payees, options['payments'])
+                    self._create_goals(budget, categories, options['goals'])
+                    BudgetCube.objects.rebuild(budget)
+                    PaymentRollup.objects.rebuild(budget)
+
+            PayeeSummary.objects.rebuild(entity)
+            Budget.objects.update_descriptions(entity)
+
+        bump_data_version()
+        print("Datos sintéticos creados en %.1fs" % (time.perf_counter() - start))
+
+    def _describe(self, code):
+        return '%s %s' % (random.choice(WORDS).capitalize(), code)
+
+    # Create the same category hierarchies for every budget, returning the lowest level
+    # of each one, which is what the items point to
+    def _create_categories(self, budget):
+        economic = []
+        funding = []
+        for expense in [True, False]:
+            for chapter in '123456789':
+                economic.append(EconomicCategory(budget=budget, expense=expense, chapter=chapter, description=self._describe(chapter)))
+                for article in [chapter + str(i) for i in range(4)]:
+                    economic.append(EconomicCategory(budget=budget, expense=expense, chapter=chapter, article=article, description=self._describe(article)))
+                    for heading in [article + str(i) for i in range(5)]:
+                        economic.append(EconomicCategory(budget=budget, expense=expense, chapter=chapter, article=article, heading=heading, description=self._describe(heading)))
+
+            for source in '123':
+                funding.append(FundingCategory(budget=budget, expense=expense, source=source, description=self._describe(source)))
+                for fund_class in [source + str(i) for i in range(3)]:
+                    funding.append(FundingCategory(budget=budget, expense=expense, source=source, fund_class=fund_class, description=self._describe(fund_class)))
+                    fund = fund_class + '000'
+                    funding.append(FundingCategory(budget=budget, expense=expense, source=source, fund_class=fund_class, fund=fund, description=self._describe(fund)))
+
+        # Income is not classified functionally, see `BudgetLoader.get_default_functional_categories`
+        functional = [FunctionalCategory(budget=budget, area='X', policy='XX', function='XXX', programme='XXXX', description='Ingresos')]
+        for area in '123456789':
+            functional.append(FunctionalCategory(budget=budget, area=area, description=self._describe(area)))
+            for policy in [area + str(i) for i in range(1, 4)]:
+                functional.append(FunctionalCategory(budget=budget, area=area, policy=policy, description=self._describe(policy)))
+                for function in [policy + str(i) for i in range(2)]:
+                    functional.append(FunctionalCategory(budget=budget, area=area, policy=policy, function=function, description=self._describe(function)))
+                    for programme in [function + str(i) for i in range(2)]:
+                        functional.append(FunctionalCategory(budget=budget, area=area, policy=policy, function=function, programme=programme, description=self._describe(programme)))
+
+        institutional = []
+        for institution in '123':
+            institutional.append(InstitutionalCategory(budget=budget, institution=institution, description=self._describe(institution)))
+            for section in [institution + str(i) for i in range(5)]:
+                institutional.append(InstitutionalCategory(budget=budget, institution=institution, section=section, description=self._describe(section)))
+                for department in [section + str(i) for i in range(4)]:
+                    institutional.append(InstitutionalCategory(budget=budget, institution=institution, section=section, department=department, description=self._describe(department)))
+
+        EconomicCategory.objects.bulk_create(economic)
+        FundingCategory.objects.bulk_create(funding)
+        FunctionalCategory.objects.bulk_create(functional)
+        InstitutionalCategory.objects.bulk_create(institutional)
+
+        # Read them back, to get their ids
+        return {
+            'economic': {expense: list(EconomicCategory.objects.filter(budget=budget, expense=expense, heading__isnull=False).order_by('id'))
+                            for expense in [True, False]},
+            'funding': {expense: list(FundingCategory.objects.filter(budget=budget, expense=expense, fund__isnull=False).order_by('id'))
+                            for expense in [True, False]},
+            'functional': list(FunctionalCategory.objects.filter(budget=budget, programme__isnull=False).exclude(area='X').order_by('id')),
+            'income_functional': FunctionalCategory.objects.get(budget=budget, area='X'),
+            'institutional': list(InstitutionalCategory.objects.filter(budget=budget, department__isnull=False).order_by('id')),
+        }
+
+    def _create_items(self, budget, categories, count):
+        items = []
+        for i in range(count):
+            expense = random.random() < 0.7
+            ec = random.choice(categories['economic'][expense])
+            items.append(BudgetItem(budget=budget,
+                                    actual=random.random() < 0.5,
+                                    expense=expense,
+                                    item_number=str(i % 1000),
+                                    description=ec.description,
+                                    amount=random.randint(100000, 10000000000),
+                                    economic_category=ec,
+                                    functional_category=random.choice(categories['functional']) if expense else categories['income_functional'],
+                                    funding_category=random.choice(categories['funding'][expense]),
+                                    institutional_category=random.choice(categories['institutional'])))
+        BudgetItem.objects.bulk_create(items, batch_size=5000)
+
+    def _create_payments(self, budget, categories, payees, count):
+        payments = []
+        for i in range(count):
+            anonymized = random.random() < 0.05
+            payee = random.randrange(len(payees))
+            fc = random.choice(categories['functional'])
+            payments.append(Payment(budget=budget,
+                                    area=fc.description,
+                                    programme=fc.programme,
+                                    functional_category=fc,
+                                    economic_category=random.choice(categories['economic'][True]),
+                                    institutional_category=random.choice(categories['institutional']),
+                                    date=datetime.date(budget.year, random.randint(1, 12), random.randint(1, 28)),
+                                    payee='Persona física' if anonymized else payees[payee],
+                                    payee_fiscal_id='' if anonymized else 'B%08d' % payee,
+                                    anonymized=anonymized,
+                                    expense=True,
+                                    description=' '.join(random.sample(WORDS, 4)),
+                                    amount=random.randint(1000, 100000000)))
+        Payment.objects.bulk_create(payments, batch_size=5000)
+
+    def _create_goals(self, budget, categories, count):
+        goals = []
+        for i in range(count):
+            fc = categories['functional'][i % len(categories['functional'])]
+            goals.append(Goal(budget=budget,
+                                uid='%s%d' % (fc.programme, i),
+                                institutional_category=random.choice(categories['institutional']),
+                                functional_category=fc,
+                                goal_number=str(i % 100),
+                                description=self._describe(i),
+                                report=''))
+        Goal.objects.bulk_create(goals)
+
+        activities = []
+        indicators = []
+        for goal in Goal.objects.filter(budget=budget).order_by('id'):
+            for i in range(1, 3):
+                activities.append(GoalActivity(goal=goal, activity_number=str(i), description=self._describe(i)))
+
+                target = random.randint(1, 1000)
+                actual = random.randint(0, target)
+                indicators.append(GoalIndicator(goal=goal,
+                                                indicator_number=str(i),
+                                                description=self._describe(i),
+                                                unit='unidades',
+                                                target=target,
+                                                actual=actual,
+                                                score=float(actual) / target))
+        GoalActivity.objects.bulk_create(activities)
+        GoalIndicator.objects.bulk_create(indicators)
@@ -0,0 +1,126 @@
+# -*- coding: UTF-8 -*-
+
+import logging
+import random
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand
+from django.http import HttpResponse
+from openpyxl import Workbook
+from tempfile import NamedTemporaryFile
+
+from budget_app.views.csv_xls import XLSXGenerator, stream_entity_payment_breakdown
+
+
+# The original XLSXGenerator implementation, kept as a reference for the benchmark
+class LegacyWorksheetWrapper:
+    def __init__(self, worksheet):
+        self.worksheet = worksheet
+        self.current_row = 1
+
+    def writerow(self, values):
+        column = 1
+        for value in values:
+            self.worksheet.cell(column=column, row=self.current_row, value=value)
+            column += 1
+        self.current_row += 1
+
+class LegacyXLSXGenerator:
+    def __init__(self, filename, content_generator):
+        self.filename = filename
+        self.content_generator = content_generator
+
+    def generate_response(self, c):
+        workbook = Workbook()
+        worksheet = workbook.worksheets[0]
+        for line in (self.content_generator(c, LegacyWorksheetWrapper(worksheet)) or []):
+            pass
+
+        with NamedTemporaryFile() as tmp:
+            workbook.save(tmp.name)
+            tmp.seek(0)
+
+            response = HttpResponse(tmp.read(), content_type='application/ms-excel; charset=utf-8')
+            response['Content-Disposition'] = 'attachment; filename="%s"' % self.filename
+            return response
+
+
+# A fake denormalized payment, with the fields used by the payments export
+class SyntheticPayment:
+    def __init__(self, year, area, payee, description, amount):
+        self.year = year
+        self.area = area
+        self.payee = payee
+        self.description = description
+        self.amount = amount
+
+
+class Command(BaseCommand):
+    logging.disable(logging.ERROR)   # Avoid SQL logging on console
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows',
+            action='store',
+            dest='rows',
+            type=int,
+            default=500000,
+            help='Number of synthetic payments to export')
+
+        parser.add_argument('--skip-legacy',
+            action='store_true',
+            dest='skip_legacy',
+            default=False,
+            help='Measure only the current implementation')
+
+    help = u"Compara el rendimiento de la exportación de pagos a Excel con la implementación original"
+
+    def handle(self, *args, **options):
+        payments = self._generate_payments(options['rows'])
+
+        generators = [('Actual', XLSXGenerator)]
+        if not options['skip_legacy']:
+            generators.insert(0, ('Original', LegacyXLSXGenerator))
+
+        for label, generator_class in generators:
+            size, elapsed, memory = self._measure(generator_class, payments)
+            print("%s: %d filas/s, %.1f MB de fichero, %.1f MB de memoria máxima" % \
+                    (label, len(payments) / elapsed, size / 1048576.0, memory / 1048576.0))
+
+    def _measure(self, generator_class, payments):
+        # Time the export...
+        start = time.perf_counter()
+        size = self._export(generator_class, payments)
+        elapsed = time.perf_counter() - start
+
+        # ...and then, separately, the memory used, since tracing slows things down.
+        # Note the synthetic payments are created before, so they're not counted.
+        tracemalloc.start()
+        self._export(generator_class, payments)
+        memory = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+        return (size, elapsed, memory)
+
+    # Generate the file and read the response, as the browser would do
+    def _export(self, generator_class, payments):
+        c = {'payments': iter(payments)}
+        response = generator_class('pagos.xlsx', stream_entity_payment_breakdown).generate_response(c)
+        if response.streaming:
+            size = sum(len(chunk) for chunk in response.streaming_content)
+        else:
+            size = len(response.content)
+        response.close()
+        return size
+
+    def _generate_payments(self, count):
+        random.seed(0)
+        areas = ['Área %d' % i for i in range(30)]
+        payees = ['Beneficiario %d' % i for i in range(5000)]
+        descriptions = ['Concepto de pago número %d' % i for i in range(20000)]
+
+        return [SyntheticPayment(random.randint(2015, 2024),
+                                    random.choice(areas),
+                                    random.choice(payees),
+                                    random.choice(descriptions),
+                                    random.randint(100, 100000000)) for i in range(count)]
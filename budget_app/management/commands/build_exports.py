@@ -0,0 +1,191 @@
+# -*- coding: UTF-8 -*-
+
+import hashlib
+import logging
+import os
+import os.path
+import re
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.test import RequestFactory
+from django.urls import reverse, resolve, NoReverseMatch
+from django.utils import translation
+from budget_app.models import DataVersion, GLOBAL_DATA_VERSION, Entity, FunctionalCategory, EconomicCategory, \
+                                InstitutionalCategory, Payment, Investment, MainInvestment
+from budget_app.views.prebuilt_exports import MANIFEST_FILENAME, get_exports_path, write_manifest
+
+
+FORMATS = ['csv', 'xlsx']
+
+# How the files we store are named, see `_render`
+EXPORT_FILENAME = re.compile(r'^[0-9a-f]{64}\.(%s)$' % '|'.join(FORMATS))
+
+
+class Command(BaseCommand):
+    logging.disable(logging.ERROR)   # Avoid SQL logging on console
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format',
+            action='append',
+            dest='formats',
+            choices=FORMATS,
+            help='Generate only the given format (can be repeated)')
+
+    help = u"Genera de antemano los ficheros CSV/Excel descargables, tras una carga de datos"
+
+    def handle(self, *args, **options):
+        formats = options['formats'] or FORMATS
+        exports_path = get_exports_path()
+        os.makedirs(exports_path, exist_ok=True)
+
+        # Get the version now: if the data changes while we're working, the files
+        # will be considered out of date and won't be used.
+        version = DataVersion.objects.current(GLOBAL_DATA_VERSION)
+
+        files = {}
+        failures = 0
+        for language in self._get_languages():
+            with translation.override(language):
+                for view_name, args in self._get_exports(language):
+                    for format in formats:
+                        try:
+                            path = reverse(view_name, args=args+[format])
+                        except NoReverseMatch:
+                            continue
+
+                        # A failed file doesn't stop the build, but it's reported, on stderr, and
+                        # makes the command fail at the end
+                        start = time.perf_counter()
+                        try:
+                            files[path] = self._render(path, language, exports_path)
+                            print("200 %s (%.2fs)" % (path, time.perf_counter() - start))
+                        except Exception as e:
+                            failures += 1
+                            self.stderr.write("%s %s (%.2fs)" % (e, path, time.perf_counter() - start))
+
+        write_manifest(version, files)
+        self._remove_old_files(exports_path, files)
+
+        if failures:
+            raise CommandError("%d de %d ficheros fallaron" % (failures, len(files) + failures))
+
+    # Call the view for the given path, and store the result named after its content hash
+    def _render(self, path, language, exports_path):
+        request = RequestFactory().get(path)
+        request.LANGUAGE_CODE = language
+        match = resolve(path)
+        response = match.func(request, *match.args, **match.kwargs)
+        if response.status_code != 200:
+            raise Exception(response.status_code)
+
+        # Don't leave half written files behind if rendering fails
+        hash = hashlib.sha256()
+        f = tempfile.NamedTemporaryFile(dir=exports_path, delete=False)
+        try:
+            with f:
+                for chunk in (response.streaming_content if response.streaming else [response.content]):
+                    hash.update(chunk)
+                    f.write(chunk)
+
+            filename = '%s.%s' % (hash.hexdigest(), path.rsplit('.', 1)[1])
+            os.replace(f.name, os.path.join(exports_path, filename))
+        finally:
+            response.close()
+            if os.path.exists(f.name):
+                os.remove(f.name)
+
+        return {
+            'file': filename,
+            'content_type': response['Content-Type'],
+            'content_disposition': response['Content-Disposition']
+        }
+
+    # Delete files from previous builds no longer in use. Anything else in the folder (which
+    # may be shared with other files) is left alone.
+    def _remove_old_files(self, exports_path, files):
+        in_use = set(export['file'] for export in files.values())
+        for filename in os.listdir(exports_path):
+            path = os.path.join(exports_path, filename)
+            if EXPORT_FILENAME.match(filename) and filename not in in_use \
+                    and os.path.isfile(path) and not os.path.islink(path):
+                os.remove(path)
+
+    def _get_languages(self):
+        if len(settings.LANGUAGES) > 1:
+            return [language for language, name in settings.LANGUAGES]
+        return [settings.LANGUAGE_CODE]
+
+    # Return the downloadable files linked from the site pages, as (view name, arguments) pairs.
+    # Note the exports for an article or policy of a secondary entity are not included: there
+    # are too many of them, so they're still generated when requested.
+    def _get_exports(self, language):
+        main_entity = Entity.objects.filter(level=settings.MAIN_ENTITY_LEVEL,
+                                            name=settings.MAIN_ENTITY_NAME,
+                                            language=language).first()
+        if not main_entity:
+            return []
+
+        exports = []
+
+        # Entity pages
+        entities = Entity.objects.filter(language=language)
+        for entity in entities:
+            for view_name in ['entity_expenses', 'entity_functional', 'entity_institutional', 'entity_income']:
+                exports.append((view_name, [entity.level, entity.slug]))
+
+        for level in set(entity.level for entity in entities if entity.level != settings.MAIN_ENTITY_LEVEL):
+            exports.append(('entities_expenses', [level]))
+            exports.append(('entities_income', [level]))
+
+        # Policies, programmes and subprogrammes
+        functional_categories = FunctionalCategory.objects.filter(budget__entity=main_entity)
+        for policy in self._distinct(functional_categories, 'policy', policy__isnull=False, function__isnull=True):
+            for breakdown in ['functional', 'economic', 'funding', 'institutional']:
+                exports.append(('%s_policy_breakdown' % breakdown, [policy]))
+            if hasattr(settings, 'SHOW_MONITORING') and settings.SHOW_MONITORING:
+                exports.append(('policy_monitoring_breakdown', [policy]))
+
+        for programme in self._distinct(functional_categories, 'programme', programme__isnull=False, subprogramme__isnull=True):
+            for breakdown in ['functional', 'economic', 'funding', 'institutional']:
+                exports.append(('%s_programme_breakdown' % breakdown, [programme]))
+            if hasattr(settings, 'SHOW_MONITORING') and settings.SHOW_MONITORING:
+                exports.append(('programme_monitoring_breakdown', [programme]))
+
+        if hasattr(settings, 'USE_SUBPROGRAMMES') and settings.USE_SUBPROGRAMMES:
+            for subprogramme in self._distinct(functional_categories, 'subprogramme', subprogramme__isnull=False):
+                for breakdown in ['economic', 'funding', 'institutional']:
+                    exports.append(('%s_subprogramme_breakdown' % breakdown, [subprogramme]))
+
+        # Income and expense articles
+        economic_categories = EconomicCategory.objects.filter(budget__entity=main_entity)
+        for article in self._distinct(economic_categories, 'article', expense=True, article__isnull=False, heading__isnull=True):
+            for breakdown in ['functional', 'economic', 'funding', 'institutional']:
+                exports.append(('%s_article_expenditures_breakdown' % breakdown, [article]))
+
+        for article in self._distinct(economic_categories, 'article', expense=False, article__isnull=False, heading__isnull=True):
+            for breakdown in ['economic', 'funding', 'institutional']:
+                exports.append(('%s_article_revenues_breakdown' % breakdown, [article]))
+
+        # Sections
+        institutional_categories = InstitutionalCategory.objects.filter(budget__entity=main_entity)
+        for section in self._distinct(institutional_categories, 'department', department__isnull=False):
+            for breakdown in ['functional', 'economic']:
+                exports.append(('%s_section_breakdown' % breakdown, [section]))
+
+        # Payments and investments
+        if Payment.objects.filter(budget__entity=main_entity).exists():
+            exports.append(('entity_payments', [main_entity.slug]))
+
+        if Investment.objects.filter(budget__entity=main_entity).exists():
+            exports.append(('entity_investments_breakdown', [main_entity.slug]))
+
+        if MainInvestment.objects.filter(budget__entity=main_entity).exists():
+            exports.append(('entity_main_investments_breakdown', [main_entity.slug]))
+
+        return exports
+
+    def _distinct(self, categories, field, **constraints):
+        return categories.filter(**constraints).order_by(field).values_list(field, flat=True).distinct()
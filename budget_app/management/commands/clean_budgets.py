@@ -1,89 +1,116 @@
 # -*- coding: UTF-8 -*-
 # See #372 for further info.
 
-import os.path
+import datetime
 import logging
+import time
 
 from django.core.management.base import BaseCommand
-from django.db import models, connection, transaction
+from django.db import connection, transaction
+from django.utils import timezone
+from budget_app.models import Budget, Entity, STAGING_ENTITY_LEVEL
+from budget_app.management.commands import bump_data_version
+
+
+# The tables referring to each kind of category, which must have no rows pointing to
+# a category before we can delete it
+ECONOMIC_CATEGORY_REFERENCES = ['budget_items', 'payments']
+FUNCTIONAL_CATEGORY_REFERENCES = ['budget_items', 'payments', 'goals', 'investments', 'main_investments']
+
 
 class Command(BaseCommand):
     logging.disable(logging.ERROR)   # Avoid SQL logging on console
 
+    def add_arguments(self, parser):
+        parser.add_argument('--staging-hours',
+            action='store',
+            dest='staging_hours',
+            type=int,
+            default=24,
+            help='Delete budgets left behind by unfinished loads started this many hours ago or more (default: 24)')
+
     help = u"Borra categorías funcionales no utilizadas de la base de datos, en caso de que sea necesario."
 
     def handle(self, *args, **options):
-        self._clean_unused_functional_categories()
-        self._clean_unused_economic_categories()
+        start = time.perf_counter()
+        # Deleting budgets drops their partitions, if any, which locks the whole tables,
+        # so do it before, not inside, the long transaction cleaning the categories
+        self._clean_staging_budgets(options['staging_hours'])
+        with transaction.atomic(), connection.cursor() as cursor:
+            self._clean_unused_functional_categories(cursor)
+            self._clean_unused_economic_categories(cursor)
+        print(u"Limpieza terminada en %.1fs" % (time.perf_counter() - start))
+
+        bump_data_version()
+
+    # Budgets left behind by loads that didn't finish, see `BudgetManager.create_staging`.
+    # Recent ones may belong to loads still running (maybe in other processes), so leave
+    # them alone: they'd fail when publishing the budget.
+    def _clean_staging_budgets(self, hours):
+        cutoff = timezone.now() - datetime.timedelta(hours=hours)
+        staging_entities = Entity.objects.filter(level=STAGING_ENTITY_LEVEL, created_at__lt=cutoff)
+        print(u"Borrando presupuestos de cargas no terminadas hace más de %d horas..." % hours)
+        for table, rows in Budget.objects.delete_budgets(Budget.objects.filter(entity__in=staging_entities)):
+            print(u"  %s: %d filas eliminadas" % (table, rows))
+        staging_entities.delete()
 
     # XXX: This assumes subheadings are not used, i.e. the SimpleBudgetLoader was used. See #495.
-    def _clean_unused_economic_categories(self):
+    def _clean_unused_economic_categories(self, cursor):
         # Clean unused headings, i.e. those without related budget items
-        self._clean_unused_headings('true')
-        self._clean_unused_headings('false')
+        self._clean_unused_headings(cursor, True)
+        self._clean_unused_headings(cursor, False)
 
         # Clean unused articles, i.e. those without children headings (after those were cleaned)
-        self._clean_unused_articles('true')
-        self._clean_unused_articles('false')
-
-    def _clean_unused_headings(self, is_expense):
-        sql = "DELETE " \
-              "FROM economic_categories " \
-              "WHERE economic_categories.id in (" \
-                "select ec.id " \
-                "from " \
-                  "economic_categories ec " \
-                  "left join budget_items bi " \
-                  "on ec.id = bi.economic_category_id " \
-                "where " \
-                  "heading is not null and " \
-                  "ec.expense="+is_expense+" and " \
-                  "bi.id is null" \
-                ")"
-        print("Borrando conceptos (expense="+is_expense+") no utilizados...")
-        self._execute_transaction(sql)
-
-    def _clean_unused_articles(self, is_expense):
-        sql = "DELETE " \
-              "FROM economic_categories " \
-              "WHERE " \
-                "heading is null and " \
-                "expense="+is_expense+" and " \
-                "economic_categories.article not in (" \
-                  "select article " \
-                  "from economic_categories " \
+        self._clean_unused_articles(cursor, True)
+        self._clean_unused_articles(cursor, False)
+
+    def _clean_unused_headings(self, cursor, is_expense):
+        sql = "delete " \
+              "from economic_categories as ec " \
+              "where " \
+                "ec.heading is not null and " \
+                "ec.expense = %s and " + \
+                self._not_referenced('ec', 'economic_category_id', ECONOMIC_CATEGORY_REFERENCES)
+        print(u"Borrando conceptos (expense=%s) no utilizados..." % is_expense)
+        self._execute(cursor, 'economic_categories', sql, [is_expense])
+
+    # Look for the children headings in the same budget, which is what the index on
+    # (budget, article) is for; the article codes may mean different things in other years.
+    def _clean_unused_articles(self, cursor, is_expense):
+        sql = "delete " \
+              "from economic_categories as ec " \
+              "where " \
+                "ec.heading is null and " \
+                "ec.article is not null and " \
+                "ec.expense = %s and " \
+                "not exists (" \
+                  "select 1 " \
+                  "from economic_categories h " \
                   "where " \
-                    "heading is not null and " \
-                    "expense="+is_expense+ \
-                  ")"
-        print("Borrando artículos (expense="+is_expense+") no utilizados...")
-        self._execute_transaction(sql)
+                    "h.budget_id = ec.budget_id and " \
+                    "h.article = ec.article and " \
+                    "h.expense = ec.expense and " \
+                    "h.heading is not null" \
+                ")"
+        print(u"Borrando artículos (expense=%s) no utilizados..." % is_expense)
+        self._execute(cursor, 'economic_categories', sql, [is_expense])
 
     # XXX: This may not work correctly when subprogrammes are enabled. See #495
-    def _clean_unused_functional_categories(self):
-        sql = "DELETE " \
-              "FROM functional_categories " \
-              "WHERE functional_categories.id in (" \
-                "select fc.id " \
-                "from " \
-                  "functional_categories fc " \
-                  "left join budget_items bi " \
-                  "on fc.id = bi.functional_category_id " \
-                "where " \
-                  "programme is not null and " \
-                  "bi.id is null" \
-                ")"
+    def _clean_unused_functional_categories(self, cursor):
+        sql = "delete " \
+              "from functional_categories as fc " \
+              "where " \
+                "fc.programme is not null and " + \
+                self._not_referenced('fc', 'functional_category_id', FUNCTIONAL_CATEGORY_REFERENCES)
+        print(u"Borrando categorías funcionales no utilizadas...")
+        self._execute(cursor, 'functional_categories', sql)
+
+    # NOT EXISTS lets PostgreSQL stop at the first reference found, using the foreign key
+    # indexes, instead of going through whole tables as the old NOT IN and LEFT JOIN did.
+    def _not_referenced(self, alias, column, tables):
+        return " and ".join("not exists (select 1 from %s r where r.%s = %s.id)" % (table, column, alias)
+                            for table in tables)
 
-        print("Borrando categorías funcionales no utilizadas...")
-        self._execute_transaction(sql)
-
-    def _execute_transaction(self, sql):
-        # We apparently need to explicitely call a transaction. Otherwise, Django seems to be
-        # waiting for something to happen via 'the normal channels' and our raw query doesn't
-        # get commited to the database.
-        # Transaction handling has changed much in Django 1.6+. The following is the old
-        # behaviour. See https://django-chinese-docs.readthedocs.io/en/latest/topics/db/transactions.html
-        with transaction.commit_on_success():
-          with connection.cursor() as cursor:
-            cursor.execute(sql)
-            print(cursor.rowcount)
+    def _execute(self, cursor, table, sql, params=None):
+        cursor.execute(sql, params)
+        print(u"  %s: %d filas eliminadas" % (table, cursor.rowcount))
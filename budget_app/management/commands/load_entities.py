@@ -6,6 +6,7 @@ import logging
 from django.core.management.base import BaseCommand
 from django.conf import settings
 from budget_app.loaders import EntityLoader
+from budget_app.management.commands import bump_data_version
 
 class Command(BaseCommand):
     logging.disable(logging.ERROR)   # Avoid SQL logging on console
@@ -15,3 +16,4 @@ class Command(BaseCommand):
     def handle(self, *args, **options):
         path = os.path.join(settings.ROOT_PATH, settings.THEME, 'data')
         EntityLoader().load(os.path.join(path, 'entidades.csv'))
+        bump_data_version()
@@ -6,6 +6,7 @@ import logging
 from django.core.management.base import BaseCommand
 from django.conf import settings
 from budget_app.loaders import GlossaryLoader
+from budget_app.management.commands import bump_data_version
 
 PATH_TO_DEFAULT = os.path.join(settings.ROOT_PATH, 'budget_app', 'static')
 
@@ -57,3 +58,5 @@ class Command(BaseCommand):
                         os.path.join(PATH_TO_DEFAULT, default_filename),
                         language
                     )
+
+        bump_data_version()
@@ -0,0 +1,107 @@
+# -*- coding: UTF-8 -*-
+
+import logging
+import re
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from budget_app.models import Budget, PARTITIONED_TABLES, is_partitioned
+
+
+class Command(BaseCommand):
+    logging.disable(logging.ERROR)   # Avoid SQL logging on console
+
+    def add_arguments(self, parser):
+        parser.add_argument('--revert',
+            action='store_true',
+            dest='revert',
+            default=False,
+            help='Turn the partitioned tables back into normal tables')
+
+    help = u"Particiona por presupuesto las tablas de partidas y pagos (PostgreSQL 12 o superior)"
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError("El particionado de tablas necesita PostgreSQL")
+
+        for table in PARTITIONED_TABLES:
+            if is_partitioned(table) != options['revert']:
+                print("La tabla %s ya está %s" % (table, 'sin particionar' if options['revert'] else 'particionada'))
+                continue
+
+            start = time.perf_counter()
+            with transaction.atomic(), connection.cursor() as cursor:
+                if options['revert']:
+                    self._unpartition(cursor, table)
+                else:
+                    self._partition(cursor, table)
+            print("Tabla %s %sparticionada en %.1fs" % (table, 'des' if options['revert'] else '', time.perf_counter() - start))
+
+    # Replace the table with a partitioned one, with a partition per budget
+    def _partition(self, cursor, table):
+        old_table = self._rename_table(cursor, table)
+
+        cursor.execute(
+            "create table %s (like %s including defaults including generated including constraints including storage) "
+                "partition by list (budget_id)" % (table, old_table))
+        for budget_id in Budget.objects.values_list('id', flat=True):
+            cursor.execute("create table %s_b%d partition of %s for values in (%d)" % (table, budget_id, table, budget_id))
+        cursor.execute("create table %s_default partition of %s default" % (table, table))
+
+        # The partition key must be part of the primary key
+        self._move_rows(cursor, old_table, table, "id, budget_id")
+
+    # Replace the partitioned table with a normal one
+    def _unpartition(self, cursor, table):
+        old_table = self._rename_table(cursor, table)
+
+        cursor.execute(
+            "create table %s (like %s including defaults including generated including constraints including storage)" % \
+            (table, old_table))
+
+        self._move_rows(cursor, old_table, table, "id")
+
+    # Rename the table out of the way, returning the new name. Its id sequence is detached
+    # from it, so it's not dropped along with it, and used by the new table.
+    def _rename_table(self, cursor, table):
+        old_table = table + '_old'
+        cursor.execute("alter table %s rename to %s" % (table, old_table))
+        cursor.execute("alter sequence %s_id_seq owned by none" % table)
+        return old_table
+
+    # Copy the rows to the new table, and recreate there the primary key, indexes and
+    # foreign keys of the old one, which we drop.
+    def _move_rows(self, cursor, old_table, table, primary_key):
+        # Generated columns (the search vectors) are calculated again, they can't be copied
+        cursor.execute(
+            "select column_name from information_schema.columns "
+            "where table_name = %s and table_schema = current_schema() and is_generated = 'NEVER' "
+            "order by ordinal_position",
+            [old_table])
+        columns = ', '.join(row[0] for row in cursor.fetchall())
+        cursor.execute("insert into %s (%s) select %s from %s" % (table, columns, columns, old_table))
+
+        cursor.execute(
+            "select pg_get_indexdef(indexrelid) from pg_index "
+            "where indrelid = %s::regclass and not indisprimary",
+            [old_table])
+        indexes = [row[0] for row in cursor.fetchall()]
+
+        cursor.execute(
+            "select conname, pg_get_constraintdef(oid) from pg_constraint "
+            "where conrelid = %s::regclass and contype = 'f'",
+            [old_table])
+        foreign_keys = cursor.fetchall()
+
+        # Index names are unique in the schema, so they're available once the old table is gone
+        cursor.execute("drop table %s" % old_table)
+
+        cursor.execute("alter table %s add primary key (%s)" % (table, primary_key))
+        for index in indexes:
+            cursor.execute(re.sub(r' ON (ONLY )?(\S+\.)?%s ' % old_table, ' ON %s ' % table, index))
+        for name, definition in foreign_keys:
+            cursor.execute("alter table %s add constraint %s %s" % (table, name, definition))
+
+        cursor.execute("alter sequence %s_id_seq owned by %s.id" % (table, table))
+        cursor.execute("analyze %s" % table)
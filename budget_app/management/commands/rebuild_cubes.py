@@ -0,0 +1,40 @@
+# -*- coding: UTF-8 -*-
+
+import logging
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef
+from budget_app.models import Budget, BudgetCube, STAGING_ENTITY_LEVEL
+from budget_app.management.commands import bump_data_version
+
+
+class Command(BaseCommand):
+    logging.disable(logging.ERROR)   # Avoid SQL logging on console
+
+    def add_arguments(self, parser):
+        parser.add_argument('--missing',
+            action='store_true',
+            dest='missing',
+            default=False,
+            help='Only rebuild the cubes of budgets which have none')
+
+    help = u"Recalcula los agregados (cubos) de los presupuestos, usados por los desgloses"
+
+    # The cubes are calculated when a budget is published (see `BudgetManager.publish`), but
+    # budgets stored some other way, e.g. by an old theme loader, may not have them.
+    def handle(self, *args, **options):
+        start = time.perf_counter()
+        budgets = Budget.objects.exclude(entity__level=STAGING_ENTITY_LEVEL).select_related('entity')
+        if options['missing']:
+            budgets = budgets.filter(~Exists(BudgetCube.objects.filter(budget=OuterRef('pk'))))
+
+        count = 0
+        for budget in budgets.order_by('entity__name', 'year'):
+            print(u"Recalculando agregados para entidad '%s' año %s..." % (budget.entity.name, budget.year))
+            BudgetCube.objects.rebuild(budget)
+            count += 1
+        print(u"Agregados de %d presupuestos recalculados en %.1fs" % (count, time.perf_counter() - start))
+
+        if count:
+            bump_data_version()
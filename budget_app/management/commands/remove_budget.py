@@ -1,11 +1,12 @@
 # -*- coding: UTF-8 -*-
 
-import os.path
 import logging
+import time
 
 from django.core.management.base import BaseCommand
 from django.conf import settings
-from budget_app.models import Entity, Budget
+from budget_app.models import Entity, Budget, PayeeSummary
+from budget_app.management.commands import bump_data_version
 
 class Command(BaseCommand):
     logging.disable(logging.ERROR)   # Avoid SQL logging on console
@@ -52,7 +53,7 @@ class Command(BaseCommand):
             else:
                 year = int(part)
                 result.append(year)
-        result = map(str, result)
+        result = list(map(str, result))
         return result
 
     def handle(self, *args, **options):
@@ -61,26 +62,30 @@ class Command(BaseCommand):
         level = options['level']
         name = options['name']
 
-        for language in languages:
-            entity = self._get_entity(level, name, language)
+        start = time.perf_counter()
+        entities = [self._get_entity(level, name, language) for language in languages]
+
+        budgets = []
+        for entity in entities:
             for year in years:
-                path = os.path.join(
-                    settings.ROOT_PATH,
-                    settings.THEME,
-                    'data',
-                    language,
-                    level,
-                    # XXX: It would make sense to include always the entity name,
-                    # but we weren't doing it in the past, so we'd need to change
-                    # all the themes. So we'll live with this ugly patch:
-                    # append the entity name only if given in the command line.
-                    '' if len(args) < 3 else args[2],
-                    year
-                )
-
-                # Delete previous budget for the given entity/year if it exists
                 print(u"Eliminando presupuesto para entidad '%s' año %s..." % (entity.name, year))
-                Budget.objects.filter(entity=entity, year=year).delete()
+                budgets.extend(Budget.objects.filter(entity=entity, year=year))
+
+        # All of them in a single transaction, so we never end up half way
+        deleted = Budget.objects.delete_budgets(budgets)
+
+        for table, rows in deleted:
+            print(u"  %s: %d filas eliminadas" % (table, rows))
+        print(u"Presupuestos eliminados en %.1fs" % (time.perf_counter() - start))
+
+        for entity in entities:
+            # The cached descriptions include those of the deleted budgets
+            Budget.objects.update_descriptions(entity)
+
+            # And so do the payees, since payments are deleted along with their budget
+            PayeeSummary.objects.rebuild(entity)
+
+        bump_data_version()
 
     def _get_entity(self, level, name, language=None):
         entity = Entity.objects.filter(level=level, name=name, language=language)
@@ -0,0 +1,110 @@
+# -*- coding: UTF-8 -*-
+
+import logging
+import time
+import urllib.error
+import urllib.request
+
+from django.core.management.base import BaseCommand, CommandError
+from django.conf import settings
+from django.urls import reverse, NoReverseMatch
+from django.utils import translation
+from budget_app.models import Budget, Entity, FunctionalCategory
+
+
+# The most visited pages, which we want to have in the cache before visitors get to them
+WARM_UP_URL_NAMES = [
+    'welcome',
+    'budgets',
+    'policies',
+    'payments',
+    'investments',
+    'main_investments',
+    'glossary',
+    'tax_receipt',
+    'typeahead',    # Rebuilds the search suggestions index of the process serving it
+]
+
+
+class Command(BaseCommand):
+    logging.disable(logging.ERROR)   # Avoid SQL logging on console
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url',
+            action='store',
+            dest='base_url',
+            default='http://localhost:8000',
+            help='Base URL of the running site')
+
+        parser.add_argument('--timeout',
+            action='store',
+            dest='timeout',
+            type=int,
+            default=120,
+            help='Timeout for each request, in seconds')
+
+    help = u"Visita las páginas principales del sitio para que estén en la caché tras una carga de datos"
+
+    def handle(self, *args, **options):
+        base_url = options['base_url'].rstrip('/')
+
+        failures = 0
+        urls = self._get_urls()
+        for url in urls:
+            start = time.perf_counter()
+            try:
+                with urllib.request.urlopen(base_url + url, timeout=options['timeout']) as response:
+                    response.read()
+                    status = response.status
+            except urllib.error.HTTPError as e:
+                status = e.code
+            except urllib.error.URLError as e:
+                status = e.reason
+            elapsed = time.perf_counter() - start
+
+            print("%s %s (%.2fs)" % (status, url, elapsed))
+            if status != 200:
+                failures += 1
+
+        if failures:
+            raise CommandError("%d de %d páginas fallaron" % (failures, len(urls)))
+
+    # Return the paths of the pages to visit, for all the available languages
+    def _get_urls(self):
+        if len(settings.LANGUAGES) > 1:
+            languages = [language for language, name in settings.LANGUAGES]
+        else:
+            languages = [settings.LANGUAGE_CODE]
+
+        urls = []
+        for language in languages:
+            with translation.override(language):
+                for url_name in WARM_UP_URL_NAMES:
+                    try:
+                        urls.append(reverse(url_name))
+                    except NoReverseMatch:
+                        pass
+
+                urls.extend(self._get_policy_urls(language))
+
+        # Themes can add their own pages
+        if hasattr(settings, 'WARM_UP_URLS'):
+            urls.extend(settings.WARM_UP_URLS)
+        return urls
+
+    # Return the paths of the policy pages of the main entity latest budget
+    def _get_policy_urls(self, language):
+        entity = Entity.objects.filter(level=settings.MAIN_ENTITY_LEVEL,
+                                        name=settings.MAIN_ENTITY_NAME,
+                                        language=language).first()
+        if not entity:
+            return []
+
+        budget = Budget.objects.latest(entity.id)
+        if not budget:
+            return []
+
+        policies = FunctionalCategory.objects.filter(budget=budget,
+                                                        policy__isnull=False,
+                                                        function__isnull=True)
+        return [reverse('policies_show', args=[policy.policy, policy.slug()]) for policy in policies]
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+
+from django.db import migrations, models
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('budget_app', '0002_add_current_year_spending_to_main_investments'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BudgetCube',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('actual', models.BooleanField()),
+                ('expense', models.BooleanField()),
+                ('amount', models.BigIntegerField()),
+                ('budget', models.ForeignKey(to='budget_app.Budget', on_delete=models.CASCADE)),
+                ('economic_category', models.ForeignKey(db_column='economic_category_id', to='budget_app.EconomicCategory', on_delete=models.CASCADE)),
+                ('functional_category', models.ForeignKey(db_column='functional_category_id', to='budget_app.FunctionalCategory', on_delete=models.CASCADE)),
+                ('funding_category', models.ForeignKey(db_column='funding_category_id', to='budget_app.FundingCategory', on_delete=models.CASCADE)),
+                ('institutional_category', models.ForeignKey(db_column='institutional_category_id', to='budget_app.InstitutionalCategory', on_delete=models.CASCADE)),
+            ],
+            options={
+                'db_table': 'budget_cubes',
+            },
+            bases=(models.Model,),
+        ),
+
+        # Aggregate the budgets already in the database
+        migrations.RunSQL(
+            "insert into budget_cubes "
+                "(budget_id, actual, expense, "
+                "functional_category_id, economic_category_id, "
+                "institutional_category_id, funding_category_id, amount) "
+            "select "
+                "budget_id, actual, expense, "
+                "functional_category_id, economic_category_id, "
+                "institutional_category_id, funding_category_id, sum(amount) "
+            "from budget_items "
+            "group by "
+                "budget_id, actual, expense, "
+                "functional_category_id, economic_category_id, "
+                "institutional_category_id, funding_category_id",
+            migrations.RunSQL.noop
+        ),
+    ]
@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+
+from django.db import migrations, models
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('budget_app', '0003_add_budget_cubes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DataVersion',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('version', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'data_versions',
+            },
+            bases=(models.Model,),
+        ),
+    ]
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+from django.conf import settings
+from django.db import migrations
+
+
+# Full-text search vectors, calculated by PostgreSQL (12 or later) when a row is written, and
+# indexed, so searches don't need to calculate them for every row on every query. The columns
+# are not part of the models: they're only used in the raw search queries.
+#
+# Note the vectors are calculated using the SEARCH_CONFIG in place when migrating. If it
+# changes later on, migrate back to 0004 and forward again to recalculate them.
+SEARCH_VECTORS = [
+    # Table, column, indexed text
+    ('budget_items', 'search_vector', "description"),
+    ('payments', 'search_vector', "payee||' '||description"),
+    ('payments', 'description_search_vector', "description"),
+    ('economic_categories', 'search_vector', "description"),
+    ('functional_categories', 'search_vector', "description"),
+    ('institutional_categories', 'search_vector', "description"),
+    ('entities', 'search_vector', "name"),
+    ('glossary_terms', 'search_vector', "title||' '||description"),
+]
+
+def add_search_vectors(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    for table, column, text in SEARCH_VECTORS:
+        schema_editor.execute(
+            "alter table %s add column %s tsvector "
+                "generated always as (to_tsvector('%s'::regconfig, %s)) stored" % \
+                (table, column, settings.SEARCH_CONFIG, text))
+        schema_editor.execute(
+            "create index %s_%s_idx on %s using gin (%s)" % (table, column, table, column))
+
+def remove_search_vectors(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+
+    for table, column, text in SEARCH_VECTORS:
+        schema_editor.execute("alter table %s drop column %s" % (table, column))
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('budget_app', '0004_add_data_versions'),
+    ]
+
+    operations = [
+        migrations.RunPython(add_search_vectors, remove_search_vectors),
+    ]
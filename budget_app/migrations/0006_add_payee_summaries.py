@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+
+from django.db import migrations, models
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('budget_app', '0005_add_search_vectors'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayeeSummary',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('payee', models.CharField(max_length=200)),
+                ('amount', models.BigIntegerField()),
+                ('payments_count', models.IntegerField()),
+                ('first_year', models.IntegerField()),
+                ('last_year', models.IntegerField()),
+                ('entity', models.ForeignKey(to='budget_app.Entity', on_delete=models.CASCADE)),
+            ],
+            options={
+                'db_table': 'payee_summaries',
+                'index_together': {('entity', 'payee')},
+            },
+            bases=(models.Model,),
+        ),
+
+        # Summarize the payments already in the database
+        migrations.RunSQL(
+            "insert into payee_summaries "
+                "(entity_id, payee, amount, payments_count, first_year, last_year) "
+            "select "
+                "b.entity_id, p.payee, sum(p.amount), count(*), min(b.year), max(b.year) "
+            "from payments p "
+                "inner join budgets b on p.budget_id = b.id "
+            "group by "
+                "b.entity_id, p.payee",
+            migrations.RunSQL.noop
+        ),
+    ]
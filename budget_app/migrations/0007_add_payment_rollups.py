@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+
+from django.db import migrations, models
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ('budget_app', '0006_add_payee_summaries'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentRollup',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', serialize=False, auto_created=True, primary_key=True)),
+                ('dimension', models.CharField(max_length=20)),
+                ('value', models.CharField(max_length=200, null=True)),
+                ('payments_count', models.IntegerField()),
+                ('amount', models.BigIntegerField()),
+                ('budget', models.ForeignKey(to='budget_app.Budget', on_delete=models.CASCADE)),
+            ],
+            options={
+                'db_table': 'payment_rollups',
+                'index_together': {('budget', 'dimension')},
+            },
+            bases=(models.Model,),
+        ),
+
+        # Aggregate the payments already in the database
+        migrations.RunSQL(
+            "insert into payment_rollups "
+                "(budget_id, dimension, value, payments_count, amount) "
+            "select budget_id, 'payee', payee, count(*), sum(amount) "
+            "from payments "
+            "where anonymized = FALSE "
+            "group by budget_id, payee",
+            migrations.RunSQL.noop
+        ),
+        migrations.RunSQL(
+            "insert into payment_rollups "
+                "(budget_id, dimension, value, payments_count, amount) "
+            "select budget_id, 'area', area, count(*), sum(amount) "
+            "from payments "
+            "group by budget_id, area",
+            migrations.RunSQL.noop
+        ),
+        migrations.RunSQL(
+            "insert into payment_rollups "
+                "(budget_id, dimension, value, payments_count, amount) "
+            "select p.budget_id, 'department', ic.department, count(*), sum(p.amount) "
+            "from payments p "
+                "left join institutional_categories ic on p.institutional_category_id = ic.id "
+            "group by p.budget_id, ic.department",
+            migrations.RunSQL.noop
+        ),
+    ]
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+from django.db import migrations, models
+
+# Indexes matching the constraints used by the pages when querying budget items: all the
+# queries filter by entity, so by budget, plus a category code (policy, programme...) or side.
+class Migration(migrations.Migration):
+    dependencies = [
+        ('budget_app', '0007_add_payment_rollups'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='budget',
+            index=models.Index(fields=['entity', 'year'], name='budgets_entity_year_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='budgetitem',
+            index=models.Index(fields=['budget', 'expense', 'actual'], name='budget_items_budget_side_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='budgetcube',
+            index=models.Index(fields=['budget', 'expense', 'actual'],
+                                include=('functional_category', 'economic_category', 'institutional_category',
+                                            'funding_category', 'amount'),
+                                name='budget_cubes_budget_side_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='functionalcategory',
+            index=models.Index(fields=['budget', 'policy'], name='fc_budget_policy_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='functionalcategory',
+            index=models.Index(fields=['budget', 'programme'], name='fc_budget_programme_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='functionalcategory',
+            index=models.Index(fields=['budget', 'subprogramme'], name='fc_budget_subprogramme_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='economiccategory',
+            index=models.Index(fields=['budget', 'chapter'], name='ec_budget_chapter_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='economiccategory',
+            index=models.Index(fields=['budget', 'article'], name='ec_budget_article_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='institutionalcategory',
+            index=models.Index(fields=['budget', 'department'], name='ic_budget_department_idx'),
+        ),
+    ]
@@ -1,6 +1,8 @@
 from .entity import *
 from .budget import *
 from .budget_item import *
+from .budget_cube import *
+from .data_version import *
 from .budget_breakdown import *
 from .economic_category import *
 from .functional_category import *
@@ -15,4 +17,7 @@ from .inflation_stat import *
 from .investment import *
 from .main_investment import *
 from .payment import *
+from .payee_summary import *
+from .payment_rollup import *
+from .partitions import *
 from .population_stat import *
@@ -1,7 +1,11 @@
 # -*- coding: UTF-8 -*-
 
-from django.db import models
+import json
+import zlib
+
+from django.db import models, connection, transaction
 from django.core.cache import caches
+from django.utils import translation
 from django.utils.translation import ugettext as _
 from django.conf import settings
 
@@ -10,9 +14,39 @@ from .functional_category import FunctionalCategory
 from .funding_category import FundingCategory
 from .institutional_category import InstitutionalCategory
 from .geographic_category import GeographicCategory
+from .data_version import DataVersion
+from .budget_cube import BudgetCube
+from .entity import Entity, STAGING_ENTITY_LEVEL, staging_code
+from .payee_summary import PayeeSummary
+from .partitions import create_partitions, drop_partitions
+
+# The tables holding the data of a budget, in the order they have to be emptied when
+# deleting it, so no row is left pointing to a deleted one: goal details first, then
+# items, payments and the like, the categories they refer to and the budget itself.
+# Each one comes with the condition selecting the rows of the budgets being deleted.
+BUDGET_DATA_TABLES = [
+    ('goal_activities', "goal_id in (select id from goals where budget_id in (%s))"),
+    ('goal_indicators', "goal_id in (select id from goals where budget_id in (%s))"),
+    ('goals', "budget_id in (%s)"),
+    ('budget_cubes', "budget_id in (%s)"),
+    ('budget_items', "budget_id in (%s)"),
+    ('payment_rollups', "budget_id in (%s)"),
+    ('payments', "budget_id in (%s)"),
+    ('investments', "budget_id in (%s)"),
+    ('main_investments', "budget_id in (%s)"),
+    ('economic_categories', "budget_id in (%s)"),
+    ('functional_categories', "budget_id in (%s)"),
+    ('funding_categories', "budget_id in (%s)"),
+    ('geographic_categories', "budget_id in (%s)"),
+    ('institutional_categories', "budget_id in (%s)"),
+    ('budgets', "id in (%s)"),
+]
 
 
 class BudgetManager(models.Manager):
+    # Latest descriptions calculated by this process, see `get_all_descriptions`
+    _descriptions = {}
+
     # Return the latest (not pending approval) budget for the given entity
     def latest(self, entity_id):
         return self.filter(entity_id=entity_id) \
@@ -20,6 +54,80 @@ class BudgetManager(models.Manager):
                     .order_by('-year') \
                     .first()
 
+    # Create a budget to load the data of an entity and year into. It belongs to a temporary
+    # entity, with no language, its own level and a prefixed code, so it's not visible in the
+    # site until it's published. If the load fails, the budget must be thrown away, see
+    # `discard_staging`.
+    def create_staging(self, entity, year, status):
+        staging_entity = Entity(code=staging_code(entity.code),
+                                level=STAGING_ENTITY_LEVEL,
+                                name='%s (%s)' % (entity.name[:180], STAGING_ENTITY_LEVEL),
+                                language='')
+        staging_entity.save()
+
+        budget = self.model(entity=staging_entity, year=year, status=status)
+        budget.save()
+        create_partitions(budget)
+        return budget
+
+    # Replace the existing budget of the entity for the same year, if any, with the given
+    # staging budget, once loaded. The switch happens in a single short transaction, so the
+    # site shows either the old budget or the new one, never a partially loaded one. The
+    # old budget is deleted afterwards, along with the temporary entity, and so are its
+    # payments, so the payees of the entity are recalculated.
+    #
+    # The aggregated amounts used by the breakdowns (see BudgetCube) are calculated here, not
+    # in the loaders, so no budget is published without them, whichever loader stored it.
+    def publish(self, budget, entity):
+        try:
+            BudgetCube.objects.rebuild(budget)
+        except:
+            self.discard_staging(budget)
+            raise
+
+        staging_entity = budget.entity
+        with transaction.atomic():
+            replaced = self.filter(entity=entity, year=budget.year).update(entity=staging_entity)
+            self.filter(id=budget.id).update(entity=entity)
+        budget.entity = entity
+
+        self.delete_budgets(self.filter(entity=staging_entity))
+        staging_entity.delete()
+
+        if replaced:
+            PayeeSummary.objects.rebuild(entity)
+
+    # Delete a staging budget whose load failed, along with its temporary entity
+    def discard_staging(self, budget):
+        staging_entity = budget.entity
+        self.delete_budgets([budget])
+        staging_entity.delete()
+
+    # Delete the given budgets along with all their data, returning the number of rows
+    # removed from each table. Django's delete() would load every related object before
+    # deleting it, which takes ages for budgets with hundreds of thousands of items, so
+    # we go table by table instead (see `BUDGET_DATA_TABLES`), in a single transaction.
+    # Partitions are dropped first, each in its own short transaction: detaching them locks
+    # the whole partitioned table, which we don't want to hold while deleting the rest.
+    # That's why this, and `publish`, which calls it, must not be called inside a transaction
+    # when the tables are partitioned: the locks would be held until the end of it.
+    def delete_budgets(self, budgets):
+        budgets = list(budgets)
+        if not budgets:
+            return []
+
+        placeholders = ', '.join(['%s'] * len(budgets))
+        budget_ids = [budget.id for budget in budgets]
+        for budget in budgets:
+            drop_partitions(budget)
+
+        result = []
+        with transaction.atomic(), connection.cursor() as cursor:
+            for table, condition in BUDGET_DATA_TABLES:
+                cursor.execute("delete from %s where %s" % (table, condition % placeholders), budget_ids)
+                result.append((table, cursor.rowcount))
+        return result
+
     # Return a list of years for which we have a budget
     # TODO: I don't think we should we using this, without filtering for entity.
     # (Although, in practice, most of the times we have only one entity.)
@@ -77,24 +185,57 @@ class BudgetManager(models.Manager):
                 result[item.uid()] = item.description
         return result
 
-    # Get all descriptions available
+    # Get all descriptions available.
+    # Calculating them means going through all the categories of all the years, so they're
+    # stored, compressed, in the shared 'descriptions' cache. The cache key includes the
+    # entity data version, which the loaders increase every time they change the data
+    # (see `update_descriptions`), so we never get stale descriptions. We also keep the
+    # latest version in memory, to avoid decompressing them in every request.
     def get_all_descriptions(self, entity):
-        def calculate_all_descriptions(self, entity):
-            return {
-                'functional': self._to_hash(FunctionalCategory.objects \
-                    .filter(budget_id__entity=entity).exclude(description='').order_by('budget_id__year')),
-                'income': self._get_economic_descriptions(EconomicCategory.objects \
-                    .income().filter(budget_id__entity=entity).exclude(description='').order_by('budget_id__year')),
-                'expense': self._get_economic_descriptions(EconomicCategory.objects \
-                    .expenses().filter(budget_id__entity=entity).exclude(description='').order_by('budget_id__year')),
-                'funding': self._to_hash(FundingCategory.objects \
-                    .filter(budget_id__entity=entity).exclude(description='').order_by('budget_id__year')),
-                'geographic': self._to_hash(GeographicCategory.objects \
-                    .filter(budget_id__entity=entity).exclude(description='').order_by('budget_id__year')),
-                'institutional': self._get_institutional_descriptions(InstitutionalCategory.objects \
-                    .filter(budget_id__entity=entity).exclude(description='').order_by('budget_id__year'))
-            }
-        return caches['default'].get_or_set('entity_'+entity.code, lambda: calculate_all_descriptions(self, entity))
+        language = translation.get_language()
+        version = DataVersion.objects.current(self._get_descriptions_version_name(entity))
+        memory_key = (entity.id, language)
+
+        cached = self._descriptions.get(memory_key)
+        if cached is None or cached[0] != version:
+            cache_key = 'descriptions_%s_%s_%s' % (entity.id, language, version)
+            data = caches['descriptions'].get(cache_key)
+            if data is None:
+                descriptions = self._calculate_all_descriptions(entity)
+                caches['descriptions'].set(cache_key, zlib.compress(json.dumps(descriptions).encode('utf-8')))
+            else:
+                descriptions = json.loads(zlib.decompress(data).decode('utf-8'))
+            cached = (version, descriptions)
+            self._descriptions[memory_key] = cached
+
+        # Callers often add or replace some of the description sets, so return a copy
+        return dict(cached[1])
+
+    # Invalidate the cached descriptions for an entity, after its data has changed, and
+    # calculate them again, so the first visitors don't have to wait.
+    def update_descriptions(self, entity):
+        DataVersion.objects.bump(self._get_descriptions_version_name(entity))
+        with translation.override(entity.language):
+            self.get_all_descriptions(entity)
+
+    def _get_descriptions_version_name(self, entity):
+        return 'descriptions_%s' % entity.id
+
+    def _calculate_all_descriptions(self, entity):
+        return {
+            'functional': self._to_hash(FunctionalCategory.objects \
+                .filter(budget_id__entity=entity).exclude(description='').order_by('budget_id__year')),
+            'income': self._get_economic_descriptions(EconomicCategory.objects \
+                .income().filter(budget_id__entity=entity).exclude(description='').order_by('budget_id__year')),
+            'expense': self._get_economic_descriptions(EconomicCategory.objects \
+                .expenses().filter(budget_id__entity=entity).exclude(description='').order_by('budget_id__year')),
+            'funding': self._to_hash(FundingCategory.objects \
+                .filter(budget_id__entity=entity).exclude(description='').order_by('budget_id__year')),
+            'geographic': self._to_hash(GeographicCategory.objects \
+                .filter(budget_id__entity=entity).exclude(description='').order_by('budget_id__year')),
+            'institutional': self._get_institutional_descriptions(InstitutionalCategory.objects \
+                .filter(budget_id__entity=entity).exclude(description='').order_by('budget_id__year'))
+        }
 
 
 class Budget(models.Model):
@@ -108,6 +249,9 @@ class Budget(models.Model):
 
     class Meta:
         db_table = "budgets"
+        indexes = [
+            models.Index(fields=['entity', 'year'], name='budgets_entity_year_idx'),
+        ]
 
     def __unicode__(self):
         return self.name()
@@ -1,50 +1,84 @@
 import json
 
+from types import MappingProxyType
 
+
+# Return a function extracting the value of a classification criteria from a budget item.
+# Sometimes the criteria is not a string, but a lambda, which we can use as is; sometimes
+# it's a string pointing to an attribute or a method of the item.
+def _compile_criteria(criteria):
+    if hasattr(criteria, '__call__'):
+        return criteria
+
+    def accessor(item):
+        value = getattr(item, criteria)
+        return value() if hasattr(value, '__call__') else value
+    return accessor
+
+
+# Leaf nodes (the majority) never have children, so they all share the same, read-only, subtotals
+_NO_SUBTOTALS = MappingProxyType({})
+
+
+# A tree of budget amounts, aggregated by column (i.e. year) along a list of criteria.
+# We create lots of these per request (one per node in the tree) so nodes are kept as
+# small as possible, and the criteria accessors are calculated once and shared by all nodes.
 class BudgetBreakdown:
+    __slots__ = ('criteria', 'years', 'subtotals', 'total_expense', 'total_income', '_accessors')
+
     def __init__(self, criteria=[]):
+        self._init_node(criteria, tuple(_compile_criteria(c) for c in criteria))
+
+    def _init_node(self, criteria, accessors):
         self.criteria = criteria
-        self.names = []
-        self.years = {}
-        self.subtotals = {}
+        self._accessors = accessors
+        self.years = {}     # Column name to year, in the order columns were added
+        self.subtotals = {} if accessors else _NO_SUBTOTALS
         self.total_expense = {}
         self.total_income = {}
 
+    # Create a child node, reusing the compiled accessors
+    def _create_child(self):
+        child = BudgetBreakdown.__new__(BudgetBreakdown)
+        child._init_node(self.criteria[1:], self._accessors[1:])
+        return child
+
+    # The list of columns in the breakdown
+    @property
+    def names(self):
+        return list(self.years)
+
     # Add a new budget item to the breakdown
     def add_item(self, column, item):
-        # Check whether the column exist, and add if needed
-        if not column in self.names:
-            self.names.append(column)
-            self.years[column] = item.year if hasattr(item, 'year') else ''
-
-        # Basic aggregation
-        if item.expense:
-            if column not in self.total_expense:
-                self.total_expense[column] = 0
-            self.total_expense[column] += item.amount
-        else:
-            if column not in self.total_income:
-                self.total_income[column] = 0
-            self.total_income[column] += item.amount
-
-        # Breakdown aggregation
-        if len(self.criteria) > 0:  # We have a criteria to classify on
-            # Sometimes the criteria is not a string, but a lambda
-            if hasattr(self.criteria[0], '__call__'):
-                value = self.criteria[0](item)
-            else:  # Sometimes it's just a string pointing to an attribute...
-                value = getattr(item, self.criteria[0])
-                # ...or a method
-                if hasattr(value, '__call__'):
-                    value = value()
+        amount = item.amount
+        is_expense = item.expense
+
+        # Go down the tree, aggregating the amount at each level
+        node = self
+        while True:
+            # Check whether the column exist, and add if needed
+            years = node.years
+            if column not in years:
+                years[column] = item.year if hasattr(item, 'year') else ''
+
+            # Basic aggregation
+            totals = node.total_expense if is_expense else node.total_income
+            totals[column] = totals.get(column, 0) + amount
+
+            # Breakdown aggregation, if we have a criteria to classify on
+            accessors = node._accessors
+            if not accessors:
+                return
 
             # Check we have an actual value for the given criteria
+            value = accessors[0](item)
             if value == None:
                 return
 
-            if value not in self.subtotals:
-                self.subtotals[value] = BudgetBreakdown(self.criteria[1:])
-            self.subtotals[value].add_item(column, item)
+            child = node.subtotals.get(value)
+            if child is None:
+                child = node.subtotals[value] = node._create_child()
+            node = child
 
     # Simplified JSON output, for cleaner view code
     def to_json(self, labels=None, uid=None):
@@ -0,0 +1,95 @@
+from django.db import models, connection
+
+from .budget_item import BudgetItem, get_denormalized_sql, each_denormalized_row
+from .streaming import stream_raw
+
+
+class BudgetCubeManager(models.Manager):
+    # Recalculate the aggregated amounts for the given budget. Called when publishing a
+    # budget, once its items have been stored, see `BudgetManager.publish`.
+    def rebuild(self, budget):
+        self.filter(budget=budget).delete()
+
+        sql = \
+            "insert into budget_cubes " \
+                "(budget_id, actual, expense, " \
+                "functional_category_id, economic_category_id, " \
+                "institutional_category_id, funding_category_id, amount) " \
+            "select " \
+                "i.budget_id, i.actual, i.expense, " \
+                "i.functional_category_id, i.economic_category_id, " \
+                "i.institutional_category_id, i.funding_category_id, sum(i.amount) " \
+            "from " \
+                "budget_items i " \
+            "where " \
+                "i.budget_id = %s " \
+            "group by " \
+                "i.budget_id, i.actual, i.expense, " \
+                "i.functional_category_id, i.economic_category_id, " \
+                "i.institutional_category_id, i.funding_category_id"
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [budget.id])
+
+    # Same as BudgetItemManager.each_denormalized, and using the same table aliases, so the
+    # same constraints can be used on both, but returning one record per combination of
+    # categories instead of one per budget item. There's no item number or description here,
+    # so this can't be used to build breakdowns down to the budget item level.
+    ITEM_FIELDS = "i.id, '' as item_number, '' as description, i.expense, i.actual, i.amount"
+
+    def each_denormalized(self, additional_constraints=None, additional_arguments=None, fetch_size=None):
+        sql = get_denormalized_sql("budget_cubes", self.ITEM_FIELDS, additional_constraints)
+        return stream_raw(self, sql, additional_arguments, fetch_size)
+
+    def each_denormalized_tuple(self, additional_constraints=None, additional_arguments=None, fetch_size=None):
+        sql = get_denormalized_sql("budget_cubes", self.ITEM_FIELDS, additional_constraints)
+        return each_denormalized_row(sql, additional_arguments, fetch_size)
+
+    # Same as `each_denormalized_tuple`, but going through the budget items of the budgets
+    # with no cubes, so they're not missing from the breakdowns. That shouldn't happen, but
+    # a loader may store the items without publishing the budget. See `rebuild_cubes`.
+    def each_aggregated_tuple(self, additional_constraints=None, additional_arguments=None, fetch_size=None):
+        yield from self.each_denormalized_tuple(additional_constraints, additional_arguments, fetch_size)
+
+        constraints = "not exists (select 1 from budget_cubes c where c.budget_id = b.id)"
+        if additional_constraints:
+            constraints = "(" + additional_constraints + ") and " + constraints
+        yield from BudgetItem.objects.each_denormalized_tuple(constraints, additional_arguments, fetch_size)
+
+
+# Budget amounts added up along the four classifications, i.e. the budget items of a budget
+# minus the item level detail. Used to build breakdowns without going through all the items.
+class BudgetCube(models.Model):
+    budget = models.ForeignKey('Budget', on_delete=models.CASCADE)
+    actual = models.BooleanField()
+    expense = models.BooleanField()
+    amount = models.BigIntegerField()
+    economic_category = models.ForeignKey('EconomicCategory',
+                            db_column='economic_category_id',
+                            on_delete=models.CASCADE)
+    functional_category = models.ForeignKey('FunctionalCategory',
+                            db_column='functional_category_id',
+                            on_delete=models.CASCADE)
+    funding_category = models.ForeignKey('FundingCategory',
+                            db_column='funding_category_id',
+                            on_delete=models.CASCADE)
+    institutional_category = models.ForeignKey('InstitutionalCategory',
+                            db_column='institutional_category_id',
+                            on_delete=models.CASCADE)
+
+    objects = BudgetCubeManager()
+
+    class Meta:
+        db_table = "budget_cubes"
+        # Covering all the columns read from the cubes, so they're read from the index only
+        indexes = [
+            models.Index(fields=['budget', 'expense', 'actual'],
+                            include=['functional_category', 'economic_category', 'institutional_category',
+                                        'funding_category', 'amount'],
+                            name='budget_cubes_budget_side_idx'),
+        ]
+
+    # Whether an item is a financial expense or income. Only works on a denormalized record.
+    # See BudgetItem.is_financial.
+    def is_financial(self):
+        return getattr(self, 'chapter') == '8' or getattr(self, 'chapter') == '9'
@@ -1,50 +1,113 @@
-from django.db import models
+from collections import namedtuple
+from django.db import models, connection
 from django.conf import settings
 
+from .search_results import SearchResults
+from .streaming import get_chunked_cursor, get_fetch_size, stream_raw
+
+
+# Columns returned by the denormalized budget item queries, in order
+DENORMALIZED_FIELDS = [
+    'policy', 'function', 'programme', 'subprogramme',
+    'chapter', 'article', 'heading', 'subheading',
+    'institution', 'department',
+    'source', 'fund',
+    'id', 'item_number', 'description', 'expense', 'actual', 'amount',
+    'year',
+    'name'
+]
+
+# A denormalized budget item, as returned by `each_denormalized_tuple`. Much lighter than
+# a model instance, but with the same fields and methods needed to build breakdowns.
+class DenormalizedBudgetItem(namedtuple('DenormalizedBudgetItem', DENORMALIZED_FIELDS)):
+    __slots__ = ()
+
+    # See BudgetItem.economic_uid()
+    def economic_uid(self):
+        subheading = self.subheading or self.heading or self.article or self.chapter
+        return str(self.year) + '/' + subheading + '/' + (self.item_number or '')
+
+    def uid(self):
+        return (self.department or '') + '/' + self.economic_uid()
+
+    def is_financial(self):
+        return self.chapter == '8' or self.chapter == '9'
+
+
+# Return the query to get denormalized budget items from the given table, i.e. budget items
+# joined with their categories, budget and entity. The item fields are given as a parameter,
+# so we can use the same query for tables without item numbers or descriptions.
+def get_denormalized_sql(table, item_fields, additional_constraints=None):
+    sql = \
+        "select " \
+            "fc.policy, fc.function, fc.programme, fc.subprogramme, " \
+            "ec.chapter, ec.article, ec.heading, ec.subheading, " \
+            "ic.institution, ic.department, " \
+            "fdc.source, fdc.fund, "\
+            + item_fields + ", " \
+            "b.year, " \
+            "e.name " \
+        "from " \
+            + table + " i, " \
+            "functional_categories fc, " \
+            "institutional_categories ic, " \
+            "economic_categories ec, " \
+            "funding_categories fdc, " \
+            "budgets b, " \
+            "entities e " \
+        "where " \
+            "i.functional_category_id = fc.id and " \
+            "i.institutional_category_id = ic.id and " \
+            "i.economic_category_id = ec.id and " \
+            "i.funding_category_id = fdc.id and " \
+            "i.budget_id = b.id and " \
+            "b.entity_id = e.id"
+
+    if additional_constraints:
+        sql += " and " + additional_constraints
+
+    return sql
+
+# Run a denormalized items query, returning plain tuples, fetched in chunks using a
+# server-side cursor where available, so we never have the whole result set in memory.
+def each_denormalized_row(sql, arguments, fetch_size=None):
+    fetch_size = fetch_size or get_fetch_size()
+    with get_chunked_cursor(connection) as cursor:
+        cursor.execute(sql, arguments)
+        while True:
+            rows = cursor.fetchmany(fetch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield DenormalizedBudgetItem._make(row)
+
 
 class BudgetItemManager(models.Manager):
-    def each_denormalized(self, additional_constraints=None, additional_arguments=None):
-        sql = \
-            "select " \
-                "fc.policy, fc.function, fc.programme, fc.subprogramme, " \
-                "ec.chapter, ec.article, ec.heading, ec.subheading, " \
-                "ic.institution, ic.department, " \
-                "fdc.source, fdc.fund, "\
-                "i.id, i.item_number, i.description, i.expense, i.actual, i.amount, " \
-                "b.year, " \
-                "e.name " \
-            "from " \
-                "budget_items i, " \
-                "functional_categories fc, " \
-                "institutional_categories ic, " \
-                "economic_categories ec, " \
-                "funding_categories fdc, " \
-                "budgets b, " \
-                "entities e " \
-            "where " \
-                "i.functional_category_id = fc.id and " \
-                "i.institutional_category_id = ic.id and " \
-                "i.economic_category_id = ec.id and " \
-                "i.funding_category_id = fdc.id and " \
-                "i.budget_id = b.id and " \
-                "b.entity_id = e.id"
-
-        if additional_constraints:
-            sql += " and " + additional_constraints
-
-        return self.raw(sql, additional_arguments)
+    ITEM_FIELDS = "i.id, i.item_number, i.description, i.expense, i.actual, i.amount"
+
+    # The results are streamed from the database, `fetch_size` rows at a time (see
+    # StreamingRawQuery), so use `iterator()` if going through them only once.
+    def each_denormalized(self, additional_constraints=None, additional_arguments=None, fetch_size=None):
+        sql = get_denormalized_sql("budget_items", self.ITEM_FIELDS, additional_constraints)
+        return stream_raw(self, sql, additional_arguments, fetch_size)
+
+    # Same as `each_denormalized`, but returning DenormalizedBudgetItem tuples instead of
+    # model instances, which is much faster when going through lots of items.
+    def each_denormalized_tuple(self, additional_constraints=None, additional_arguments=None, fetch_size=None):
+        sql = get_denormalized_sql("budget_items", self.ITEM_FIELDS, additional_constraints)
+        return each_denormalized_row(sql, additional_arguments, fetch_size)
 
     # Do a full-text search in the database. Note we ignore execution data, as it doesn't
     # add anything new to the budget descriptions.
     def search(self, query, year, language, page):
-        sql = "select " \
+        select = \
             "b.year, " \
             "e.name, e.level, " \
             "i.id, i.item_number, i.description, i.amount, i.expense, " \
             "ec.article, ec.heading, ec.subheading, " \
             "ic.institution, ic.department, " \
-            "fc.policy, fc.programme, fc.subprogramme " \
-          "from " \
+            "fc.policy, fc.programme, fc.subprogramme"
+        sql = "from " \
             "budget_items i, " \
             "budgets b, " \
             "entities e, " \
@@ -59,14 +122,16 @@ class BudgetItemManager(models.Manager):
             "i.functional_category_id = fc.id and " \
             "i.institutional_category_id = ic.id and " \
             "i.economic_category_id = ec.id and " \
-            "e.language='"+language+"' and " \
-            "to_tsvector('"+settings.SEARCH_CONFIG+"',i.description) @@ plainto_tsquery('"+settings.SEARCH_CONFIG+"',%s)"
+            "e.language = %s and " \
+            "i.search_vector @@ plainto_tsquery('"+settings.SEARCH_CONFIG+"',%s)"
+        arguments = [language, query]
 
         if year:
-            sql += " and b.year='%s'" % year
+            sql += " and b.year = %s"
+            arguments.append(year)
 
-        sql += " order by i.amount desc"
-        return self.raw(sql, (query, ))
+        # The results are fetched one page at a time, see SearchResults
+        return SearchResults(self, select, sql, arguments, "i.amount desc, i.id")
 
 
 class BudgetItem(models.Model):
@@ -95,6 +160,9 @@ class BudgetItem(models.Model):
 
     class Meta:
         db_table = "budget_items"
+        indexes = [
+            models.Index(fields=['budget', 'expense', 'actual'], name='budget_items_budget_side_idx'),
+        ]
 
     # Return a budget id unique across all years, so we can match them later
     # with the descriptions. Important note: this won't work in a normal budget
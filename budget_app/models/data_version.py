@@ -0,0 +1,65 @@
+import time
+
+from django.conf import settings
+from django.db import models, transaction
+
+
+# The version of the whole data set, increased every time a management command changes it.
+# Used to invalidate the page cache (see project.middleware).
+GLOBAL_DATA_VERSION = 'data'
+
+
+# For how long, in seconds, the versions returned by `DataVersionManager.cached` are kept
+# in memory before reading them again from the database (Default: 5)
+def get_data_version_max_age():
+    if hasattr(settings, 'DATA_VERSION_MAX_AGE'):
+        return settings.DATA_VERSION_MAX_AGE
+    return 5
+
+
+class DataVersionManager(models.Manager):
+    # Versions read by `cached` in this process, with the time they were read, by name
+    _cached = {}
+
+    # Return the current version of the given data set
+    def current(self, name):
+        version = self.filter(name=name).values_list('version', flat=True).first()
+        return version or 0
+
+    # Same as `current`, but reading the version from the database at most once every
+    # few seconds (see DATA_VERSION_MAX_AGE), for code running on every request, like the
+    # page cache: a page served from the cache shouldn't need the database at all. So
+    # changes made by other processes are noticed a few seconds late.
+    def cached(self, name):
+        now = time.monotonic()
+        cached = self._cached.get(name)
+        if cached is None or now - cached[1] >= get_data_version_max_age():
+            cached = (self.current(name), now)
+            self._cached[name] = cached
+        return cached[0]
+
+    # Increase the version of the given data set, after it's been modified, returning
+    # the new version. Everything cached using the old version won't be used anymore.
+    def bump(self, name):
+        with transaction.atomic():
+            data_version, created = self.select_for_update().get_or_create(name=name)
+            data_version.version += 1
+            data_version.save()
+        self._cached.pop(name, None)
+        return data_version.version
+
+
+# A counter for a data set (e.g. the budgets of an entity), increased every time the data
+# changes. Used to build cache keys, so caches are invalidated when the data is reloaded.
+class DataVersion(models.Model):
+    name = models.CharField(max_length=100, unique=True)
+    version = models.IntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = DataVersionManager()
+
+    class Meta:
+        db_table = "data_versions"
+
+    def __unicode__(self):
+        return self.name
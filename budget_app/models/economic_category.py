@@ -13,7 +13,7 @@ class EconomicCategoriesManager(models.Manager):
     def _search(self, query, budget, conditions):
         sql = "select * from economic_categories " \
                 "where " + conditions + " and " \
-                "to_tsvector('"+settings.SEARCH_CONFIG+"',description) @@ plainto_tsquery('"+settings.SEARCH_CONFIG+"',%s)"
+                "search_vector @@ plainto_tsquery('"+settings.SEARCH_CONFIG+"',%s)"
 
         if budget:
             sql += " and budget_id='%s'" % budget.id
@@ -43,6 +43,10 @@ class EconomicCategory(models.Model):
 
     class Meta:
         db_table = "economic_categories"
+        indexes = [
+            models.Index(fields=['budget', 'chapter'], name='ec_budget_chapter_idx'),
+            models.Index(fields=['budget', 'article'], name='ec_budget_article_idx'),
+        ]
 
     # Return the 'budget domain' id, used to uniquely identify a category
     # in a budget
@@ -2,6 +2,18 @@ from django.db import models
 from django.conf import settings
 from django.template.defaultfilters import slugify
 
+
+# The level of the temporary entities holding budgets while they're being loaded (see
+# `BudgetManager.create_staging`). They must never show up in the site.
+STAGING_ENTITY_LEVEL = 'staging'
+
+# Their code is the code of the entity being loaded with this prefix, so they can't be mistaken
+# for it when looking entities up by code. Codes are up to 10 characters, see `staging_code`.
+STAGING_ENTITY_CODE_PREFIX = '~'
+
+def staging_code(code):
+    return (STAGING_ENTITY_CODE_PREFIX + code)[:Entity._meta.get_field('code').max_length]
+
 class EntityManager(models.Manager):
     def entities(self, level):
         return self.filter(level=level).order_by('name')
@@ -18,8 +30,9 @@ class EntityManager(models.Manager):
     def search(self, query):
         sql =   "select id, level, name, slug from entities " \
                 "where " \
-                    "to_tsvector('"+settings.SEARCH_CONFIG+"',name) @@ plainto_tsquery('"+settings.SEARCH_CONFIG+"',%s) "
-        return self.raw(sql, [query,])
+                    "search_vector @@ plainto_tsquery('"+settings.SEARCH_CONFIG+"',%s) and " \
+                    "level <> %s"
+        return self.raw(sql, [query, STAGING_ENTITY_LEVEL])
 
 
 class Entity(models.Model):
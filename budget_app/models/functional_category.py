@@ -10,7 +10,7 @@ class FunctionalCategoriesManager(models.Manager):
     def _search(self, query, budget, conditions):
         sql = "select * from functional_categories " \
                 "where " + conditions + " and " \
-                "to_tsvector('"+settings.SEARCH_CONFIG+"',description) @@ plainto_tsquery('"+settings.SEARCH_CONFIG+"',%s)"
+                "search_vector @@ plainto_tsquery('"+settings.SEARCH_CONFIG+"',%s)"
 
         if budget:
             sql += " and budget_id='%s'" % budget.id
@@ -39,6 +39,11 @@ class FunctionalCategory(models.Model):
 
     class Meta:
         db_table = "functional_categories"
+        indexes = [
+            models.Index(fields=['budget', 'policy'], name='fc_budget_policy_idx'),
+            models.Index(fields=['budget', 'programme'], name='fc_budget_programme_idx'),
+            models.Index(fields=['budget', 'subprogramme'], name='fc_budget_subprogramme_idx'),
+        ]
 
     # Returns the 'budget domain' id, used to uniquely identify a category in
     # a given budget.
@@ -10,13 +10,14 @@ class GlossaryTermManager(models.Manager):
 
         # If no query is passed (i.e. we're showing the glossary page),
         # return all the terms.
+        arguments = []
         if query and query != '':
             sql += "and " \
-                "(to_tsvector('"+settings.SEARCH_CONFIG+"',title) @@ plainto_tsquery('"+settings.SEARCH_CONFIG+"',%s) or " \
-                "to_tsvector('"+settings.SEARCH_CONFIG+"',description) @@ plainto_tsquery('"+settings.SEARCH_CONFIG+"',%s)) "
+                "search_vector @@ plainto_tsquery('"+settings.SEARCH_CONFIG+"',%s) "
+            arguments.append(query)
 
         sql += "order by title asc"
-        return self.raw(sql, [query, query])
+        return self.raw(sql, arguments)
 
 
 class GlossaryTerm(models.Model):
@@ -6,7 +6,7 @@ class InstitutionalCategoriesManager(models.Manager):
     def search_departments(self, query, budget):
         sql =   "select * from institutional_categories " \
                     "where department is not null and " \
-                    "to_tsvector('"+settings.SEARCH_CONFIG+"',description) @@ plainto_tsquery('"+settings.SEARCH_CONFIG+"',%s) "
+                    "search_vector @@ plainto_tsquery('"+settings.SEARCH_CONFIG+"',%s) "
 
         if budget:
             sql += " and budget_id='%s'" % budget.id
@@ -28,6 +28,9 @@ class InstitutionalCategory(models.Model):
 
     class Meta:
         db_table = "institutional_categories"
+        indexes = [
+            models.Index(fields=['budget', 'department'], name='ic_budget_department_idx'),
+        ]
 
     # Return the 'budget domain' id, used to uniquely identify a category
     # in a budget
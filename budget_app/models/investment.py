@@ -2,8 +2,12 @@ from django.db import models, connection
 
 from django.conf import settings
 
+from .streaming import stream_raw
+
 class InvestmentManager(models.Manager):
-    def each_denormalized(self, additional_constraints=None, additional_arguments=None):
+    # The results are streamed from the database, `fetch_size` rows at a time (see
+    # StreamingRawQuery), so use `iterator()` if going through them only once.
+    def each_denormalized(self, additional_constraints=None, additional_arguments=None, fetch_size=None):
         sql = \
             "select " \
                 "i.id, i.amount, i.description, TRUE as expense, i.actual, " \
@@ -20,7 +24,7 @@ class InvestmentManager(models.Manager):
         if additional_constraints:
             sql += " where " + additional_constraints
 
-        return self.raw(sql, additional_arguments)
+        return stream_raw(self, sql, additional_arguments, fetch_size)
 
 
 class Investment(models.Model):
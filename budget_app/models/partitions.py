@@ -0,0 +1,78 @@
+from django.db import connection, transaction
+
+
+# The biggest tables can be partitioned by budget (see the `partition_budget_tables`
+# command), so each entity and year has its own table. A budget can then be removed or
+# replaced dropping or swapping its tables, instead of deleting rows one by one.
+PARTITIONED_TABLES = ['budget_items', 'payments']
+
+
+# Whether the given table has been partitioned. Only possible on PostgreSQL (10 or later).
+def is_partitioned(table):
+    if connection.vendor != 'postgresql':
+        return False
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "select 1 from pg_partitioned_table pt "
+                "inner join pg_class c on pt.partrelid = c.oid "
+            "where c.relname = %s and pg_table_is_visible(c.oid)",
+            [table])
+        return cursor.fetchone() is not None
+
+def get_partition_name(table, budget):
+    return '%s_b%d' % (table, budget.id)
+
+def _table_exists(cursor, table):
+    cursor.execute("select to_regclass(%s)", [table])
+    return cursor.fetchone()[0] is not None
+
+
+# Create the partitions for a new budget, for the partitioned tables. If not created,
+# the rows would end up in the default partition, which works but defeats the purpose.
+def create_partitions(budget):
+    for table in PARTITIONED_TABLES:
+        if is_partitioned(table):
+            with connection.cursor() as cursor:
+                cursor.execute("create table if not exists %s partition of %s for values in (%d)" % \
+                                (get_partition_name(table, budget), table, budget.id))
+
+# Drop the partitions of a budget, before deleting it: much faster than deleting the rows.
+# Detaching a partition locks the whole partitioned table, so each one is dropped in its
+# own transaction, released right away. That's only true when called outside a transaction:
+# inside one, our atomic block is just a savepoint, and the locks are held until the outer
+# transaction ends, blocking every reader of the table meanwhile. So don't do that.
+def drop_partitions(budget):
+    for table in PARTITIONED_TABLES:
+        if is_partitioned(table):
+            with transaction.atomic(), connection.cursor() as cursor:
+                partition = get_partition_name(table, budget)
+                if _table_exists(cursor, partition):
+                    cursor.execute("alter table %s detach partition %s" % (table, partition))
+                    cursor.execute("drop table %s" % partition)
+
+
+# Create an empty table to load the new rows of a budget into, with the same columns,
+# indexes and defaults as the partitioned table, to be swapped in later on (see
+# `swap_partition`). The check constraint lets PostgreSQL attach it without having
+# to go through the rows to verify they belong to the budget.
+def create_staging_table(table, budget):
+    staging_table = get_partition_name(table, budget) + '_staging'
+    with connection.cursor() as cursor:
+        cursor.execute("drop table if exists %s" % staging_table)
+        cursor.execute("create table %s (like %s including all)" % (staging_table, table))
+        cursor.execute("alter table %s add constraint %s_budget check (budget_id = %d)" % \
+                        (staging_table, staging_table, budget.id))
+    return staging_table
+
+# Replace the partition of a budget with the given staging table, in a single short
+# transaction, so readers see either the old rows or the new ones, never a mix. As with
+# `drop_partitions`, the transaction is only short if there's no outer one.
+def swap_partition(table, budget, staging_table):
+    partition = get_partition_name(table, budget)
+    with transaction.atomic(), connection.cursor() as cursor:
+        if _table_exists(cursor, partition):
+            cursor.execute("alter table %s detach partition %s" % (table, partition))
+            cursor.execute("drop table %s" % partition)
+        cursor.execute("alter table %s rename to %s" % (staging_table, partition))
+        cursor.execute("alter table %s attach partition %s for values in (%d)" % (table, partition, budget.id))
@@ -0,0 +1,57 @@
+from django.db import models, connection, transaction
+
+from .entity import Entity
+
+
+class PayeeSummaryManager(models.Manager):
+    # Recalculate the payees of the given entity. Called by the payments loader once the
+    # payments have been stored, and after removing budgets.
+    def rebuild(self, entity):
+        sql = \
+            "insert into payee_summaries " \
+                "(entity_id, payee, amount, payments_count, first_year, last_year) " \
+            "select " \
+                "b.entity_id, p.payee, sum(p.amount), count(*), min(b.year), max(b.year) " \
+            "from " \
+                "payments p " \
+                "inner join budgets b on p.budget_id = b.id " \
+            "where " \
+                "b.entity_id = %s " \
+            "group by " \
+                "b.entity_id, p.payee"
+
+        with transaction.atomic():
+            # Years can be loaded in parallel (see `--jobs`), so make sure only one
+            # process at a time rebuilds the payees of an entity.
+            list(Entity.objects.select_for_update().filter(id=entity.id).values_list('id'))
+
+            self.filter(entity=entity).delete()
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [entity.id])
+
+    # Return the payees of an entity containing the given text, sorted by name
+    def search(self, entity, query=''):
+        payees = self.filter(entity=entity)
+        if query:
+            payees = payees.filter(payee__icontains=query)
+        return payees.order_by('payee')
+
+
+# The distinct payees of an entity, with their aggregated payments, calculated when the
+# payments are loaded. Used to list the payees without going through all the payments.
+class PayeeSummary(models.Model):
+    entity = models.ForeignKey('Entity', on_delete=models.CASCADE)
+    payee = models.CharField(max_length=200)
+    amount = models.BigIntegerField()
+    payments_count = models.IntegerField()
+    first_year = models.IntegerField()
+    last_year = models.IntegerField()
+
+    objects = PayeeSummaryManager()
+
+    class Meta:
+        db_table = "payee_summaries"
+        index_together = [['entity', 'payee']]
+
+    def __unicode__(self):
+        return self.payee
@@ -1,8 +1,12 @@
-from django.db import models, connection
+from django.db import models
 from django.conf import settings
 
 from budget_app.models import InstitutionalCategory
 
+from .payment_rollup import PaymentRollup
+from .search_results import SearchResults
+from .streaming import stream_raw
+
 class PaymentManager(models.Manager):
     # Return the list of payees
     def get_payees(self, entity_id):
@@ -34,74 +38,22 @@ class PaymentManager(models.Manager):
                     .order_by('institutional_category__description')
 
 
-    # Return the list of payees.
-    # Unfortunately we couldn't find a way to bend the Django aggregate functions to do this,
-    # and raw() needs the primary key to be in the result list, so we end up having to
-    # access the DB connection directly. :/
+    # Return the biggest payees, the area breakdown and the department breakdown, as
+    # (value, number of payments, amount) tuples. They're calculated adding up the
+    # aggregated payments of each year, see PaymentRollup.
     def get_biggest_payees(self, entity, from_year, to_year, limit):
-        sql = \
-            "select " \
-                "p.payee, count(p.amount), sum(p.amount) " \
-            "from " \
-                "payments p " \
-                "left join budgets b on p.budget_id = b.id " \
-            "where " \
-                "p.anonymized = FALSE and " \
-                "b.entity_id = %s and " \
-                "b.year >= %s and " \
-                "b.year <= %s " \
-            "group by payee " \
-            "order by sum(amount) desc " \
-            "limit " + str(limit)
-
-        with connection.cursor() as cursor:
-            cursor.execute(sql, [str(entity.id), str(from_year), str(to_year)])
-            return list(cursor.fetchall())
-
-
-    # Return the area breakdown. Same issues as above.
-    # Note that we could retrieve all the payments and aggregate them ourselves, but
-    # it's more efficient like this, since we don't need the individual payments.
+        return PaymentRollup.objects.get_breakdown('payee', entity, from_year, to_year, limit)
+
     def get_area_breakdown(self, entity, from_year, to_year):
-        sql = \
-            "select " \
-                "p.area, count(p.amount), sum(p.amount) " \
-            "from " \
-                "payments p " \
-                "left join budgets b on p.budget_id = b.id " \
-            "where " \
-                "b.entity_id = %s and " \
-                "b.year >= %s and " \
-                "b.year <= %s " \
-            "group by area " \
-            "order by sum(amount) desc"
+        return PaymentRollup.objects.get_breakdown('area', entity, from_year, to_year)
 
-        with connection.cursor() as cursor:
-            cursor.execute(sql, [str(entity.id), str(from_year), str(to_year)])
-            return list(cursor.fetchall())
+    def get_department_breakdown(self, entity, from_year, to_year):
+        return PaymentRollup.objects.get_breakdown('department', entity, from_year, to_year)
 
 
-    # Return the department breakdown. Same issues as above.
-    def get_department_breakdown(self, entity, from_year, to_year):
-        sql = \
-            "select " \
-                "ic.department, count(p.amount), sum(p.amount) " \
-            "from " \
-                "payments p " \
-                "left join budgets b on p.budget_id = b.id " \
-                "left join institutional_categories ic on p.institutional_category_id = ic.id " \
-            "where " \
-                "b.entity_id = %s and " \
-                "b.year >= %s and " \
-                "b.year <= %s " \
-            "group by department " \
-            "order by sum(amount) desc"
-        with connection.cursor() as cursor:
-            cursor.execute(sql, [str(entity.id), str(from_year), str(to_year)])
-            return list(cursor.fetchall())
-
-
-    def each_denormalized(self, additional_constraints=None, additional_arguments=None):
+    # The results are streamed from the database, `fetch_size` rows at a time (see
+    # StreamingRawQuery), so use `iterator()` if going through them only once.
+    def each_denormalized(self, additional_constraints=None, additional_arguments=None, fetch_size=None):
         # XXX: Note that this left join syntax works well even when the institutional_category_id is null,
         # as opposed to the way we query for Budget Items. I should probably adopt this all around,
         # and potentially even stop using dummy categories on loaders.
@@ -118,25 +70,29 @@ class PaymentManager(models.Manager):
         if additional_constraints:
             sql += " where " + additional_constraints
 
-        return self.raw(sql, additional_arguments)
+        return stream_raw(self, sql, additional_arguments, fetch_size)
 
-    # Do a full-text search in the database
+    # Do a full-text search in the database. The results are fetched one page
+    # at a time, see SearchResults.
     def search(self, query, year, language):
-        sql = "select " \
+        select = \
             "b.year, " \
             "e.name, e.level, " \
-            "p.id, p.area, p.date, p.description, p.amount, p.expense " \
-          "from " \
+            "p.id, p.area, p.date, p.payee, p.description, p.amount, p.expense"
+        sql = "from " \
             "payments p " \
                 "left join budgets b on p.budget_id = b.id " \
                 "left join entities e on b.entity_id = e.id " \
           "where " \
-            "e.language='"+language+"' and " \
-            "to_tsvector('"+settings.SEARCH_CONFIG+"',p.payee||' '||p.description) @@ plainto_tsquery('"+settings.SEARCH_CONFIG+"',%s)"
+            "e.language = %s and " \
+            "p.search_vector @@ plainto_tsquery('"+settings.SEARCH_CONFIG+"',%s)"
+        arguments = [language, query]
+
         if year:
-            sql += " and b.year='%s'" % year
-        sql += " order by p.amount desc"
-        return self.raw(sql, (query, ))
+            sql += " and b.year = %s"
+            arguments.append(year)
+
+        return SearchResults(self, select, sql, arguments, "p.amount desc, p.id")
 
 
 class Payment(models.Model):
@@ -0,0 +1,79 @@
+from django.db import models, connection
+
+
+# The dimensions payments are added up along, and the expression used for each of them.
+# Anonymized payments are left out of the payee rollup, as in the payments page.
+PAYMENT_ROLLUP_DIMENSIONS = [
+    # Dimension, value, additional constraint
+    ('payee', "p.payee", "p.anonymized = FALSE"),
+    ('area', "p.area", None),
+    ('department', "ic.department", None),
+]
+
+
+class PaymentRollupManager(models.Manager):
+    # Recalculate the aggregated payments for the given budget. Called by the payments
+    # loader once the payments have been stored.
+    def rebuild(self, budget):
+        self.filter(budget=budget).delete()
+
+        with connection.cursor() as cursor:
+            for dimension, value, constraint in PAYMENT_ROLLUP_DIMENSIONS:
+                sql = \
+                    "insert into payment_rollups " \
+                        "(budget_id, dimension, value, payments_count, amount) " \
+                    "select " \
+                        "p.budget_id, %s, " + value + ", count(*), sum(p.amount) " \
+                    "from " \
+                        "payments p " \
+                        "left join institutional_categories ic on p.institutional_category_id = ic.id " \
+                    "where " \
+                        "p.budget_id = %s " + \
+                        ("and " + constraint + " " if constraint else "") + \
+                    "group by p.budget_id, " + value
+                cursor.execute(sql, [dimension, budget.id])
+
+    # Return the aggregated payments of an entity along a dimension for the given years,
+    # as (value, number of payments, amount) tuples, biggest amount first.
+    def get_breakdown(self, dimension, entity, from_year, to_year, limit=None):
+        sql = \
+            "select " \
+                "r.value, sum(r.payments_count), sum(r.amount) " \
+            "from " \
+                "payment_rollups r " \
+                "inner join budgets b on r.budget_id = b.id " \
+            "where " \
+                "r.dimension = %s and " \
+                "b.entity_id = %s and " \
+                "b.year >= %s and " \
+                "b.year <= %s " \
+            "group by r.value " \
+            "order by sum(r.amount) desc"
+        arguments = [dimension, entity.id, from_year, to_year]
+
+        if limit:
+            sql += " limit %s"
+            arguments.append(limit)
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, arguments)
+            return list(cursor.fetchall())
+
+
+# Payments of a budget added up by payee, area or department, so the payments page
+# summary doesn't need to go through all the payments of the selected years.
+class PaymentRollup(models.Model):
+    budget = models.ForeignKey('Budget', on_delete=models.CASCADE)
+    dimension = models.CharField(max_length=20)
+    value = models.CharField(max_length=200, null=True)
+    payments_count = models.IntegerField()
+    amount = models.BigIntegerField()
+
+    objects = PaymentRollupManager()
+
+    class Meta:
+        db_table = "payment_rollups"
+        index_together = [['budget', 'dimension']]
+
+    def __unicode__(self):
+        return self.value
@@ -0,0 +1,79 @@
+import json
+
+from django.conf import settings
+from django.db import connection
+
+
+# Up to how many results we count exactly in a search (Default: 1000). Counting all the
+# matches of a common word takes about as long as fetching them, so above this we rely on
+# the database planner estimate, which is good enough for the pagination controls.
+def get_search_count_limit():
+    if hasattr(settings, 'SEARCH_EXACT_COUNT_LIMIT'):
+        return settings.SEARCH_EXACT_COUNT_LIMIT
+    return 1000
+
+
+# The results of a search query, fetched from the database only as needed: a slice
+# (i.e. a page, as requested by the paginator) is fetched using LIMIT/OFFSET, and
+# `count()` doesn't fetch the results at all. The sorting criteria must be unique,
+# so results don't move across pages: add the id at the end if needed.
+#
+# The count and the slices already fetched are kept, and pickled along with the object,
+# so a cached page can be displayed again without going to the database.
+class SearchResults:
+    def __init__(self, manager, select, tables_and_constraints, arguments, order_by):
+        self.model = manager.model
+        self.select = select
+        self.tables_and_constraints = tables_and_constraints
+        self.arguments = list(arguments)
+        self.order_by = order_by
+        self.is_estimated_count = False
+        self._count = None
+        self._slices = {}
+
+    def count(self):
+        if self._count is None:
+            limit = get_search_count_limit()
+            sql = "select count(*) from (select 1 " + self.tables_and_constraints + " limit %s) results"
+            with connection.cursor() as cursor:
+                cursor.execute(sql, self.arguments + [limit + 1])
+                self._count = cursor.fetchone()[0]
+
+            if self._count > limit:
+                self._count = max(self._count, self._estimate_count())
+                self.is_estimated_count = True
+        return self._count
+
+    def __len__(self):
+        return self.count()
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            if key.step:
+                raise ValueError("SearchResults doesn't support slice steps")
+            start = key.start or 0
+            limit = max(key.stop - start, 0) if key.stop is not None else None     # Null means no limit
+            if (start, limit) not in self._slices:
+                sql = self._get_sql() + " limit %s offset %s"
+                self._slices[(start, limit)] = list(self.model.objects.raw(sql, self.arguments + [limit, start]))
+            return self._slices[(start, limit)]
+
+        results = self[key:key+1]
+        if not results:
+            raise IndexError("SearchResults index out of range")
+        return results[0]
+
+    def __iter__(self):
+        return iter(self.model.objects.raw(self._get_sql(), self.arguments))
+
+    def _get_sql(self):
+        return "select " + self.select + " " + self.tables_and_constraints + " order by " + self.order_by
+
+    # Ask PostgreSQL how many rows it expects the query to return
+    def _estimate_count(self):
+        with connection.cursor() as cursor:
+            cursor.execute("explain (format json) select 1 " + self.tables_and_constraints, self.arguments)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
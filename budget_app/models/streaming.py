@@ -0,0 +1,96 @@
+from django.conf import settings
+from django.db import connections
+from django.db.models.query import RawQuerySet
+from django.db.models.sql.query import RawQuery
+
+
+# Number of rows fetched at a time when streaming the results of big queries (Default: 2000)
+def get_fetch_size():
+    if hasattr(settings, 'DENORMALIZED_FETCH_SIZE'):
+        return settings.DENORMALIZED_FETCH_SIZE
+    return 2000
+
+# Return a cursor that doesn't fetch all the results of a query at once, i.e. a server-side
+# (named) cursor when running on PostgreSQL. As Django does, we fall back to a normal cursor
+# if server-side cursors have been disabled for the database (needed when using a transaction
+# pooler like pgbouncer).
+def get_chunked_cursor(connection):
+    if connection.settings_dict.get('DISABLE_SERVER_SIDE_CURSORS'):
+        return connection.cursor()
+    return connection.chunked_cursor()
+
+
+# A raw query reading its results in chunks through a server-side cursor, instead of having
+# the database driver load the whole result set in memory before we can start iterating.
+# Note that RawQuerySet caches its results when iterated directly, so use `iterator()` to
+# get the items one by one.
+#
+# The cursor is closed as soon as the iteration ends, whether all the rows were read or not,
+# so the server-side cursor isn't left open until the connection is closed.
+class StreamingRawQuery(RawQuery):
+    def __init__(self, sql, using, params=(), fetch_size=None):
+        super().__init__(sql, using, params=params)
+        self.fetch_size = fetch_size or get_fetch_size()
+        self.first_rows = []
+        self.columns = None
+
+    def clone(self, using):
+        return StreamingRawQuery(self.sql, using, params=self.params, fetch_size=self.fetch_size)
+
+    def __iter__(self):
+        # Always execute a new query for a new iterator.
+        self._execute_query()
+        if not connections[self.using].features.can_use_chunked_reads:
+            # If the database can't use chunked reads we need to make sure we
+            # evaluate the entire query up front.
+            return iter(list(self._each_row()))
+        return self._each_row()
+
+    def _each_row(self):
+        try:
+            rows, self.first_rows = self.first_rows, []
+            while rows:
+                yield from rows
+                rows = self.cursor.fetchmany(self.fetch_size)
+        finally:
+            self.cursor.close()
+
+    # The columns are read when the query is executed, since the cursor may be closed by now
+    def get_columns(self):
+        if self.cursor is None:
+            self._execute_query()
+        return self.columns
+
+    def _execute_query(self):
+        connection = connections[self.using]
+
+        # Adapt parameters to the database, as much as possible considering
+        # that the target type isn't known. Same as RawQuery.
+        params_type = self.params_type
+        adapter = connection.ops.adapt_unknown_value
+        if params_type is tuple:
+            params = tuple(adapter(val) for val in self.params)
+        elif params_type is dict:
+            params = {key: adapter(val) for key, val in self.params.items()}
+        else:
+            params = None
+
+        self.cursor = get_chunked_cursor(connection)
+        try:
+            self.cursor.execute(self.sql, params)
+
+            # Server-side cursors don't know the result columns until we fetch some rows,
+            # and RawQuerySet needs them before iterating, so we read the first chunk now.
+            self.first_rows = self.cursor.fetchmany(self.fetch_size)
+        except:
+            self.cursor.close()
+            raise
+
+        converter = connection.introspection.identifier_converter
+        self.columns = [converter(column_meta[0]) for column_meta in self.cursor.description]
+
+
+# Same as `manager.raw(sql, params)`, but streaming the results. See StreamingRawQuery.
+def stream_raw(manager, sql, params=None, fetch_size=None):
+    query = StreamingRawQuery(sql, manager.db, params=params, fetch_size=fetch_size)
+    return RawQuerySet(sql, model=manager.model, query=query, params=params, using=manager.db)
@@ -5,7 +5,41 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
-from django.test import TestCase
+import datetime
+import importlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+from contextlib import redirect_stdout
+from unittest import mock, skipUnless
+
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.db import connection
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from budget_app.loaders import PaymentsLoader
+from budget_app.loaders.budget_loader import BudgetLoader
+from budget_app.management.commands.benchmark_breakdown import CRITERIA as BENCHMARK_CRITERIA, \
+                                                                LegacyBudgetBreakdown, SyntheticItem
+from budget_app.management.commands import build_exports
+from budget_app.management.commands.build_exports import Command as BuildExportsCommand
+from budget_app.management.commands.remove_budget import Command as RemoveBudgetCommand
+from budget_app.models import Budget, BudgetBreakdown, BudgetCube, BudgetItem, EconomicCategory, Entity, \
+                                FunctionalCategory, FundingCategory, InstitutionalCategory, Payment, PaymentRollup, \
+                                STAGING_ENTITY_LEVEL, create_partitions, create_staging_table, get_partition_name, \
+                                is_partitioned, search_results, swap_partition
+from budget_app.models.search_results import SearchResults
+from budget_app.models.streaming import StreamingRawQuery, stream_raw
+from budget_app.views.csv_xls import BreakdownPivot, write_breakdown_item, _unique
+from budget_app.views.helpers import get_budget_breakdown, year_column_name
+from budget_app.views.prebuilt_exports import MANIFEST_FILENAME
+from budget_app.views.typeahead import MAX_QUERY_LENGTH, PrefixIndex
 
 
 class SimpleTest(TestCase):
@@ -14,3 +48,805 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+# A budget to test with, with a few categories along each classification and no items
+def create_test_budget(entity, year):
+    budget = Budget.objects.create(entity=entity, year=year, status='')
+    create_test_categories(budget)
+    return budget
+
+def create_test_categories(budget):
+    InstitutionalCategory.objects.create(budget=budget, institution='1', section='10', department='100', description='Consejería')
+    for programme, description in [('1111', 'Administración'), ('1112', 'Gestión')]:
+        FunctionalCategory.objects.create(budget=budget, area='1', policy='11', function='111', programme=programme, description=description)
+    FunctionalCategory.objects.create(budget=budget, area='X', policy='XX', function='XXX', programme='XXXX', description='Ingresos')
+    for expense, chapter, article, heading, description in [(True, '1', '12', '120', 'Sueldos'),
+                                                            (True, '2', '22', '221', 'Suministros'),
+                                                            (False, '3', '31', '310', 'Tasas')]:
+        EconomicCategory.objects.create(budget=budget, expense=expense, chapter=chapter, article=article, heading=heading, description=description)
+    for expense in [True, False]:
+        FundingCategory.objects.create(budget=budget, expense=expense, source='1', fund_class='10', fund='100', description='Propios')
+
+def create_test_entity(code='1', name='Aragón'):
+    entity = Entity(code=code, level='comunidad', name=name, language='es')
+    entity.save()
+    return entity
+
+
+# A budget line, as returned by `BudgetLoader.add_data_item`
+def budget_data_item(programme, heading, amount, description='', department='100'):
+    return {
+        'ic_institution': department[0],
+        'ic_section': department[0:2],
+        'ic_department': department,
+        'fc_area': programme[0],
+        'fc_policy': programme[0:2],
+        'fc_function': programme[0:3],
+        'fc_programme': programme,
+        'fc_subprogramme': None,
+        'ec_chapter': heading[0],
+        'ec_article': heading[0:2],
+        'ec_heading': heading,
+        'ec_subheading': None,
+        'ec_code': heading,
+        'fdc_code': '100',
+        'item_number': '',
+        'description': description,
+        'amount': amount,
+    }
+
+class SmallBatchBudgetLoader(BudgetLoader):
+    def _get_batch_size(self):
+        return 2
+
+class BudgetLoaderTest(TestCase):
+    def setUp(self):
+        self.budget = create_test_budget(create_test_entity(), 2020)
+
+    def test_categories_matched_in_memory(self):
+        items = [
+            budget_data_item('1111', '120', 1000, 'Nóminas'),
+            budget_data_item('1112', '221', 2000),
+            budget_data_item('1112', '120', 0),                     # No amount
+            budget_data_item('1111', '120', 3000, department='200'),  # Unknown department
+            budget_data_item('1113', '120', 4000),                  # Unknown programme
+            budget_data_item('1111', '999', 5000),                  # Unknown heading
+        ]
+        output = io.StringIO()
+        with redirect_stdout(output):
+            BudgetLoader().process_data_items(self.budget, items, True, False)
+        self.assertEqual(output.getvalue().count("ALERTA"), 3)
+        self.assertIn("No se encuentra la institución '200'", output.getvalue())
+
+        stored = list(BudgetItem.objects.filter(budget=self.budget).order_by('amount') \
+                        .values_list('amount', 'description', 'functional_category__programme',
+                                        'economic_category__heading', 'institutional_category__department',
+                                        'funding_category__fund', 'expense', 'actual'))
+        self.assertEqual(stored, [
+            (1000, 'Nóminas', '1111', '120', '100', '100', True, False),
+            (2000, 'Suministros', '1112', '221', '100', '100', True, False),    # Description from the heading
+        ])
+
+    def test_first_duplicate_category_used(self):
+        first = FunctionalCategory.objects.get(budget=self.budget, programme='1111')
+        FunctionalCategory.objects.create(budget=self.budget, area='1', policy='11', function='111', programme='1111', description='Otro')
+
+        BudgetLoader().process_data_items(self.budget, [budget_data_item('1111', '120', 1000)], True, False)
+        self.assertEqual(BudgetItem.objects.get(budget=self.budget).functional_category_id, first.id)
+
+    def test_items_inserted_in_batches(self):
+        items = [budget_data_item('1111', '120', amount) for amount in range(1, 6)]
+        loader = SmallBatchBudgetLoader()
+        with mock.patch.object(BudgetItem.objects, 'bulk_create', wraps=BudgetItem.objects.bulk_create) as bulk_create:
+            loader.process_data_items(self.budget, items, True, False)
+        self.assertEqual([len(call.args[0]) for call in bulk_create.call_args_list], [2, 2, 1])
+        self.assertEqual(BudgetItem.objects.filter(budget=self.budget).count(), 5)
+
+    def test_categories_forgotten_after_load(self):
+        loader = BudgetLoader()
+        with mock.patch.object(loader, 'load_institutional_hierarchy'), \
+                mock.patch.object(loader, 'load_economic_hierarchy'), \
+                mock.patch.object(loader, 'load_functional_hierarchy'), \
+                mock.patch.object(loader, 'load_funding_hierarchy'), \
+                mock.patch.object(loader, 'load_data_files'), \
+                mock.patch.object(loader, 'load_execution_data_files'), \
+                redirect_stdout(io.StringIO()):
+            loader.load(self.budget.entity, 2021, '/nonexistent', '')
+        self.assertEqual(loader.category_index, {})
+
+    def test_no_queries_per_line(self):
+        loader = BudgetLoader()
+        loader.preload_categories(self.budget)
+        items = [budget_data_item('1111', '120', amount) for amount in range(1, 101)]
+        with CaptureQueriesContext(connection) as queries:
+            loader.process_data_items(self.budget, items, True, False)
+        self.assertEqual([query['sql'] for query in queries.captured_queries if not query['sql'].startswith('INSERT')], [])
+        self.assertEqual(BudgetItem.objects.filter(budget=self.budget).count(), 100)
+
+
+# Compare against the original implementation, kept in the breakdown benchmark
+class BudgetBreakdownTest(SimpleTestCase):
+    def setUp(self):
+        self.items = [
+            SyntheticItem(2019, False, True, 100, '1111', '120', '100', '1'),
+            SyntheticItem(2019, True, True, 80, '1111', '120', '100', '1'),
+            SyntheticItem(2020, False, True, 300, '1111', '221', '100', '2'),
+            SyntheticItem(2020, False, False, 500, '1112', '310', '200', '1'),
+            SyntheticItem(2020, False, True, 40, '1112', '120', '200', '1'),
+            SyntheticItem(2019, False, True, 7, '1111', '120', '100', '1'),
+        ]
+
+    def _aggregate(self, breakdown_class, criteria):
+        breakdown = breakdown_class(criteria)
+        for item in self.items:
+            breakdown.add_item(('actual_' if item.actual else '') + str(item.year), item)
+        return breakdown
+
+    def _subtotal_keys(self, breakdown):
+        return {key: self._subtotal_keys(child) for key, child in breakdown.subtotals.items()}
+
+    def test_same_totals_as_original(self):
+        for criteria in BENCHMARK_CRITERIA:
+            breakdown = self._aggregate(BudgetBreakdown, criteria)
+            legacy = self._aggregate(LegacyBudgetBreakdown, criteria)
+            self.assertEqual(breakdown.to_json(), legacy.to_json())
+            self.assertEqual(breakdown.names, legacy.names)
+            self.assertEqual(self._subtotal_keys(breakdown), self._subtotal_keys(legacy))
+
+    def test_totals(self):
+        breakdown = self._aggregate(BudgetBreakdown, ['programme', 'heading'])
+        self.assertEqual(breakdown.names, ['2019', 'actual_2019', '2020'])
+        self.assertEqual(breakdown.years, {'2019': 2019, 'actual_2019': 2019, '2020': 2020})
+        self.assertEqual(breakdown.total_expense, {'2019': 107, 'actual_2019': 80, '2020': 340})
+        self.assertEqual(breakdown.total_income, {'2020': 500})
+
+        programme = breakdown.subtotals['1111']
+        self.assertEqual(programme.total_expense, {'2019': 107, 'actual_2019': 80, '2020': 300})
+        self.assertEqual(programme.subtotals['120'].total_expense, {'2019': 107, 'actual_2019': 80})
+        self.assertEqual(programme.subtotals['120'].subtotals, {})
+        self.assertEqual(breakdown.subtotals['1112'].total_income, {'2020': 500})
+
+    def test_missing_values_not_broken_down(self):
+        breakdown = self._aggregate(BudgetBreakdown, ['subheading'])
+        self.assertEqual(breakdown.subtotals, {})
+        self.assertEqual(breakdown.total_expense['2019'], 107)
+
+
+class BudgetBreakdownQueryTest(TestCase):
+    CRITERIA = [
+        ['policy', 'programme'],
+        ['chapter', 'article', 'heading', 'uid'],
+        ['institution', 'department'],
+    ]
+
+    def setUp(self):
+        entity = create_test_entity()
+        for year, amounts in [(2019, [100, 250, 3]), (2020, [400, 50, 70])]:
+            budget = create_test_budget(entity, year)
+            items = [budget_data_item('1111', '120', amounts[0], 'Nóminas'),
+                     budget_data_item('1112', '221', amounts[1]),
+                     budget_data_item('1112', '221', amounts[2], 'Otros')]
+            BudgetLoader().process_data_items(budget, items, True, False)
+            BudgetLoader().process_data_items(budget, [budget_data_item('XXXX', '310', amounts[0])], False, True)
+        self.condition = "e.id = %s"
+        self.arguments = [entity.id]
+
+    # The way breakdowns were built originally, from model instances
+    def _legacy_breakdowns(self):
+        breakdowns = [LegacyBudgetBreakdown(criteria) for criteria in self.CRITERIA]
+        for item in BudgetItem.objects.each_denormalized(self.condition, self.arguments):
+            for breakdown in breakdowns:
+                breakdown.add_item(year_column_name(item), item)
+        return breakdowns
+
+    def test_same_totals_as_model_instances(self):
+        breakdowns = [BudgetBreakdown(criteria) for criteria in self.CRITERIA]
+        get_budget_breakdown(self.condition, self.arguments, breakdowns)
+
+        legacy = self._legacy_breakdowns()
+        self.assertEqual([breakdown.to_json() for breakdown in breakdowns], [breakdown.to_json() for breakdown in legacy])
+        self.assertEqual(breakdowns[0].total_expense, {'2019': 353, '2020': 520})
+        self.assertEqual(breakdowns[0].total_income, {'actual_2019': 100, 'actual_2020': 400})
+
+    # Budgets without cubes are read from their items, see `rebuild_cubes`
+    def test_aggregated_same_totals_with_or_without_cubes(self):
+        criteria = self.CRITERIA[0::2]
+        expected = [BudgetBreakdown(c) for c in criteria]
+        get_budget_breakdown(self.condition, self.arguments, expected)
+
+        BudgetCube.objects.rebuild(Budget.objects.get(year=2019))
+        breakdowns = [BudgetBreakdown(c) for c in criteria]
+        get_budget_breakdown(self.condition, self.arguments, breakdowns, aggregated=True)
+        self.assertEqual([breakdown.to_json() for breakdown in breakdowns], [breakdown.to_json() for breakdown in expected])
+
+        # The cubes have one record per combination of categories, not per item
+        self.assertEqual(BudgetCube.objects.count(), 3)
+        self.assertEqual(BudgetCube.objects.get(economic_category__heading='221').amount, 253)
+
+    def test_callback_gets_every_item(self):
+        columns = []
+        get_budget_breakdown(self.condition, self.arguments, [None], lambda column, item: columns.append(column))
+        self.assertCountEqual(columns, ['2019'] * 3 + ['actual_2019'] + ['2020'] * 3 + ['actual_2020'])
+
+
+class PaymentsLoaderTest(SimpleTestCase):
+    def test_to_copy_value(self):
+        loader = PaymentsLoader()
+        self.assertEqual(loader._to_copy_value(None), '\\N')
+        self.assertEqual(loader._to_copy_value(True), 't')
+        self.assertEqual(loader._to_copy_value(False), 'f')
+        self.assertEqual(loader._to_copy_value(datetime.date(2020, 1, 31)), '2020-01-31')
+        self.assertEqual(loader._to_copy_value(datetime.datetime(2020, 1, 31, 12, 30)), '2020-01-31')
+        self.assertEqual(loader._to_copy_value(12345), 12345)
+        self.assertEqual(loader._to_copy_value(''), '')
+        self.assertEqual(loader._to_copy_value('Proveedor, S.A.'), 'Proveedor, S.A.')
+
+
+# A breakdown node, with amounts in cents by column, as in BudgetBreakdown
+class FakeBreakdownItem:
+    def __init__(self, total_expense, total_income=None):
+        self.total_expense = total_expense
+        self.total_income = total_income or {}
+
+class FakeBreakdown:
+    def __init__(self, years):
+        self.years = years
+
+# A CSV writer returning the rows written, like the content generators do
+class ListWriter:
+    def __init__(self):
+        self.rows = []
+
+    def writerow(self, values):
+        self.rows.append(list(values))
+        return values
+
+class BreakdownPivotTest(SimpleTestCase):
+    def setUp(self):
+        self.breakdown = FakeBreakdown({'2019': 2019, 'actual_2019': 2019, '2020': 2020, 'actual_2020': 2020})
+        self.nodes = [
+            (FakeBreakdownItem({'2020': 300, 'actual_2020': 250, '2019': 100}), ['1']),
+            (FakeBreakdownItem({'2019': 0, 'actual_2019': 0, '2020': 0}), ['2']),
+            (FakeBreakdownItem({'actual_2019': 75}), ['1', '11']),
+            (FakeBreakdownItem({'2021': 500}), ['3']),
+            (FakeBreakdownItem({'2019': 20, 'actual_2020': 10}), ['1', '12']),
+        ]
+        self.descriptions = {'1': 'Deuda', '11': 'Intereses'}
+
+    # The way the exports were written before BreakdownPivot: going through the nodes once per year
+    def _write_per_year(self, field, descriptions):
+        writer = ListWriter()
+        for year in sorted(_unique(self.breakdown.years.values())):
+            for item, ids in self.nodes:
+                write_breakdown_item(writer, year, item, field, ids, descriptions)
+        return writer.rows
+
+    def _write_pivot(self, field, descriptions):
+        writer = ListWriter()
+        pivot = BreakdownPivot(self.breakdown, field)
+        for item, ids in self.nodes:
+            pivot.add(item, ids, descriptions)
+        list(pivot.write(writer))
+        return writer.rows
+
+    def test_same_output_as_per_year_loop(self):
+        self.assertEqual(self._write_pivot('expense', self.descriptions),
+                         self._write_per_year('expense', self.descriptions))
+        self.assertEqual(self._write_pivot('expense', None), self._write_per_year('expense', None))
+
+    def test_rows_sorted_by_year(self):
+        rows = self._write_pivot('expense', None)
+        self.assertEqual([row[0] for row in rows], [2019, 2019, 2019, 2020, 2020])
+        self.assertEqual(rows[0], [2019, '1', 1.0, None])
+
+    def test_other_field_ignored(self):
+        self.assertEqual(self._write_pivot('income', None), [])
+
+
+class PaymentRollupTest(TestCase):
+    def setUp(self):
+        self.entity = create_test_entity()
+        payments = [
+            # Year, payee, anonymized, area, department, amount
+            (2019, 'Proveedor A', False, 'Obras', '100', 1000),
+            (2019, 'Proveedor A', False, 'Obras', '100', 500),
+            (2019, 'Proveedor B', False, 'Cultura', None, 300),
+            (2019, 'Persona física', True, 'Cultura', '100', 70),
+            (2020, 'Proveedor B', False, 'Cultura', '100', 2000),
+            (2020, 'Proveedor C', False, None, '100', 40),
+            (2020, 'Persona física', True, 'Obras', None, 9),
+            (2021, 'Proveedor A', False, 'Obras', '100', 20),
+        ]
+        for year in [2019, 2020, 2021]:
+            budget = create_test_budget(self.entity, year)
+            department = InstitutionalCategory.objects.get(budget=budget, department='100')
+            for payment_year, payee, anonymized, area, department_code, amount in payments:
+                if payment_year == year:
+                    Payment.objects.create(budget=budget, area=area, payee=payee, anonymized=anonymized,
+                                            institutional_category=department if department_code else None,
+                                            expense=True, description='', amount=amount)
+            PaymentRollup.objects.rebuild(budget)
+
+    # The way the payments summary was calculated originally, going through all the payments
+    def _legacy_breakdown(self, value, constraint, from_year, to_year):
+        sql = \
+            "select " + value + ", count(p.amount), sum(p.amount) " \
+            "from " \
+                "payments p " \
+                "left join budgets b on p.budget_id = b.id " \
+                "left join institutional_categories ic on p.institutional_category_id = ic.id " \
+            "where " + (constraint + " and " if constraint else "") + \
+                "b.entity_id = %s and b.year >= %s and b.year <= %s " \
+            "group by " + value + " " \
+            "order by sum(p.amount) desc"
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [self.entity.id, from_year, to_year])
+            return list(cursor.fetchall())
+
+    def test_same_totals_as_payments(self):
+        for from_year, to_year in [(2019, 2021), (2019, 2019), (2020, 2021), (2022, 2023)]:
+            self.assertEqual(Payment.objects.get_biggest_payees(self.entity, from_year, to_year, 10),
+                             self._legacy_breakdown("p.payee", "p.anonymized = FALSE", from_year, to_year))
+            self.assertEqual(Payment.objects.get_area_breakdown(self.entity, from_year, to_year),
+                             self._legacy_breakdown("p.area", None, from_year, to_year))
+            self.assertEqual(Payment.objects.get_department_breakdown(self.entity, from_year, to_year),
+                             self._legacy_breakdown("ic.department", None, from_year, to_year))
+
+    def test_biggest_payees(self):
+        self.assertEqual(Payment.objects.get_biggest_payees(self.entity, 2019, 2021, 2),
+                         [('Proveedor B', 2, 2300), ('Proveedor A', 3, 1520)])
+
+    def test_rebuild_replaces_rollups(self):
+        budget = Budget.objects.get(year=2021)
+        Payment.objects.filter(budget=budget).update(amount=25)
+        PaymentRollup.objects.rebuild(budget)
+        self.assertEqual(Payment.objects.get_area_breakdown(self.entity, 2021, 2021), [('Obras', 1, 25)])
+
+
+class StagingBudgetTest(TestCase):
+    def setUp(self):
+        self.entity = create_test_entity()
+        self.budget = create_test_budget(self.entity, 2020)
+        BudgetLoader().process_data_items(self.budget, [budget_data_item('1111', '120', 1000)], True, False)
+
+    def _create_staging(self, amount):
+        staging = Budget.objects.create_staging(self.entity, 2020, '')
+        create_test_categories(staging)
+        BudgetLoader().process_data_items(staging, [budget_data_item('1112', '221', amount)], True, False)
+        return staging
+
+    def test_staging_entity_hidden(self):
+        staging = Budget.objects.create_staging(self.entity, 2020, '')
+        self.assertEqual(staging.entity.code, '~1')
+        self.assertEqual(staging.entity.level, STAGING_ENTITY_LEVEL)
+        self.assertEqual(list(Entity.objects.filter(code=self.entity.code)), [self.entity])
+        self.assertEqual(list(Budget.objects.filter(entity=self.entity)), [self.budget])
+
+    def test_staging_code_length(self):
+        staging = Budget.objects.create_staging(create_test_entity('1234567890', 'Otra'), 2020, '')
+        self.assertEqual(staging.entity.code, '~123456789')
+
+    def test_publish_replaces_budget(self):
+        staging = self._create_staging(2500)
+        staging_entity = staging.entity
+        Budget.objects.publish(staging, self.entity)
+
+        self.assertEqual(list(Budget.objects.filter(entity=self.entity)), [staging])
+        self.assertFalse(Budget.objects.filter(id=self.budget.id).exists())
+        self.assertFalse(Entity.objects.filter(id=staging_entity.id).exists())
+        self.assertEqual(list(BudgetItem.objects.values_list('budget_id', 'amount')), [(staging.id, 2500)])
+        self.assertEqual(list(BudgetCube.objects.values_list('budget_id', 'amount')), [(staging.id, 2500)])
+        self.assertEqual(FunctionalCategory.objects.filter(budget=self.budget).count(), 0)
+
+    def test_publish_new_year(self):
+        staging = Budget.objects.create_staging(self.entity, 2021, '')
+        Budget.objects.publish(staging, self.entity)
+        self.assertEqual(list(Budget.objects.filter(entity=self.entity).order_by('year')), [self.budget, staging])
+        self.assertFalse(Entity.objects.filter(level=STAGING_ENTITY_LEVEL).exists())
+
+    def test_failed_load_discards_staging(self):
+        def fail(budget, path):
+            create_test_categories(budget)
+            raise ValueError("Fichero incorrecto")
+
+        with mock.patch.object(BudgetLoader, 'load_institutional_hierarchy', side_effect=fail):
+            with self.assertRaises(ValueError), redirect_stdout(io.StringIO()):
+                BudgetLoader().load(self.entity, 2020, '/nonexistent', '')
+
+        self.assertEqual(list(Budget.objects.all()), [self.budget])
+        self.assertFalse(Entity.objects.filter(level=STAGING_ENTITY_LEVEL).exists())
+        self.assertFalse(FunctionalCategory.objects.exclude(budget=self.budget).exists())
+        self.assertEqual(BudgetItem.objects.get().amount, 1000)
+
+    def test_failed_publish_discards_staging(self):
+        staging = self._create_staging(2500)
+        with mock.patch.object(BudgetCube.objects, 'rebuild', side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                Budget.objects.publish(staging, self.entity)
+
+        self.assertEqual(list(Budget.objects.all()), [self.budget])
+        self.assertFalse(Entity.objects.filter(level=STAGING_ENTITY_LEVEL).exists())
+        self.assertEqual(BudgetItem.objects.get().amount, 1000)
+
+
+class DeleteBudgetsTest(TestCase):
+    def test_only_given_budgets_deleted(self):
+        entity = create_test_entity()
+        budgets = [create_test_budget(entity, year) for year in [2019, 2020, 2021]]
+        for budget in budgets:
+            BudgetLoader().process_data_items(budget, [budget_data_item('1111', '120', budget.year)], True, False)
+            BudgetCube.objects.rebuild(budget)
+
+        result = dict(Budget.objects.delete_budgets(budgets[0:2]))
+        self.assertEqual(result['budgets'], 2)
+        self.assertEqual(result['budget_items'], 2)
+        self.assertEqual(result['budget_cubes'], 2)
+        self.assertEqual(result['functional_categories'], 6)
+
+        self.assertEqual(list(Budget.objects.all()), [budgets[2]])
+        self.assertEqual(list(BudgetItem.objects.values_list('amount', flat=True)), [2021])
+        self.assertEqual(FunctionalCategory.objects.exclude(budget=budgets[2]).count(), 0)
+
+    def test_nothing_to_delete(self):
+        self.assertEqual(Budget.objects.delete_budgets([]), [])
+
+
+class RemoveBudgetCommandTest(SimpleTestCase):
+    def test_parse_number_range(self):
+        self.assertEqual(RemoveBudgetCommand._parse_number_range('2020'), ['2020'])
+        self.assertEqual(RemoveBudgetCommand._parse_number_range('2015-2017'), ['2015', '2016', '2017'])
+        self.assertEqual(RemoveBudgetCommand._parse_number_range('2012,2015-2016,2020'), ['2012', '2015', '2016', '2020'])
+        self.assertEqual(RemoveBudgetCommand._parse_number_range('2017-2015'), [])
+
+    def test_parse_number_range_invalid(self):
+        with self.assertRaises(ValueError):
+            RemoveBudgetCommand._parse_number_range('2015-')
+        with self.assertRaises(ValueError):
+            RemoveBudgetCommand._parse_number_range('abc')
+
+
+class PrefixIndexTest(SimpleTestCase):
+    def setUp(self):
+        self.index = PrefixIndex([
+            {'label': 'Educación'},
+            {'label': 'Ayuntamiento de Madrid'},
+            {'label': 'Madrid Río, Madrid'},
+            {'label': 'Ciudad Educativa'},
+        ])
+
+    def _labels(self, prefix, limit=10):
+        return [suggestion['label'] for suggestion in self.index.lookup(prefix, limit)]
+
+    def test_accents_and_case_ignored(self):
+        self.assertCountEqual(self._labels('EDUCA'), ['Ciudad Educativa', 'Educación'])
+        self.assertEqual(self._labels('educación'), ['Educación'])
+        self.assertEqual(self._labels('rio'), ['Madrid Río, Madrid'])
+
+    def test_matches_start_of_words_only(self):
+        self.assertEqual(self._labels('de mad'), ['Ayuntamiento de Madrid'])
+        self.assertEqual(self._labels('adrid'), [])
+        self.assertEqual(self._labels('cación'), [])
+
+    def test_no_duplicates(self):
+        self.assertCountEqual(self._labels('madrid'), ['Madrid Río, Madrid', 'Ayuntamiento de Madrid'])
+
+    def test_limit(self):
+        self.assertEqual(len(self._labels('madrid', 1)), 1)
+        self.assertEqual(len(self._labels('', 10)), 0)
+        self.assertEqual(len(self._labels('   ', 10)), 0)
+
+    def test_suggestions_returned_whole(self):
+        index = PrefixIndex([{'type': 'term', 'label': 'Educación', 'url': '/glosario'}])
+        self.assertEqual(index.lookup('edu', 10), [{'type': 'term', 'label': 'Educación', 'url': '/glosario'}])
+
+    def test_long_names(self):
+        label = 'Proveedor ' + 'a' * 150
+        index = PrefixIndex([{'label': label}])
+        self.assertTrue(all(len(key) <= MAX_QUERY_LENGTH for key in index.keys))
+        self.assertEqual(len(index.lookup(label[:MAX_QUERY_LENGTH], 10)), 1)
+        self.assertEqual(len(index.lookup(label, 10)), 1)
+
+    def test_repeated_keys_shared(self):
+        index = PrefixIndex([{'label': 'Proveedor ' + name + ' S.L.'} for name in ['uno', 'dos']])
+        keys = [key for key in index.keys if key == 's.l.']
+        self.assertEqual(len(keys), 2)
+        self.assertIs(keys[0], keys[1])
+
+
+# A thread running its target right away when started
+class ImmediateThread:
+    def __init__(self, target, args, daemon):
+        self.target = target
+        self.args = args
+
+    def start(self):
+        self.target(*self.args)
+
+# The module, not the view of the same name exported by budget_app.views
+typeahead = importlib.import_module('budget_app.views.typeahead')
+
+class PrefixIndexCacheTest(SimpleTestCase):
+    def setUp(self):
+        typeahead._indexes.clear()
+        self.versions = iter([1, 2, 2])
+        patches = [
+            mock.patch.object(typeahead.DataVersion.objects, 'cached', side_effect=lambda name: next(self.versions)),
+            mock.patch.object(typeahead, '_get_suggestions', side_effect=lambda language: [{'label': 'Datos %s' % language}]),
+            mock.patch.object(typeahead.threading, 'Thread', ImmediateThread),
+            mock.patch.object(typeahead, 'connection'),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        self.addCleanup(typeahead._indexes.clear)
+
+    def test_previous_index_used_while_rebuilding(self):
+        first = typeahead.get_prefix_index('es')
+        self.assertEqual(typeahead.get_prefix_index('es'), first)     # The rebuild is started, not awaited
+        second = typeahead.get_prefix_index('es')
+        self.assertIsNot(second, first)
+        self.assertEqual(second.lookup('datos', 10), [{'type': None, 'label': 'Datos es', 'url': None}])
+
+
+class BuildExportsCommandTest(SimpleTestCase):
+    def setUp(self):
+        self.exports_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.exports_path)
+
+    def _render(self, response):
+        match = mock.Mock(args=[], kwargs={})
+        match.func.return_value = response
+        with mock.patch.object(build_exports, 'resolve', return_value=match):
+            return BuildExportsCommand()._render('/presupuestos/gastos.csv', 'es', self.exports_path)
+
+    def test_render(self):
+        response = HttpResponse(b'a,b\n', content_type='text/csv')
+        response['Content-Disposition'] = 'attachment; filename="gastos.csv"'
+        export = self._render(response)
+        self.assertEqual(os.listdir(self.exports_path), [export['file']])
+        self.assertTrue(export['file'].endswith('.csv'))
+
+    def test_no_file_left_when_rendering_fails(self):
+        def content():
+            yield b'a,b\n'
+            raise ValueError("Error en la consulta")
+
+        with self.assertRaises(ValueError):
+            self._render(StreamingHttpResponse(content(), content_type='text/csv'))
+        self.assertEqual(os.listdir(self.exports_path), [])
+
+    def test_failures_make_the_command_fail(self):
+        def render(path, language, exports_path):
+            if path.endswith('.xlsx'):
+                raise ValueError("Error en la consulta")
+            return {'file': 'a.csv', 'content_type': 'text/csv', 'content_disposition': ''}
+
+        command = BuildExportsCommand(stdout=io.StringIO(), stderr=io.StringIO())
+        with override_settings(EXPORTS_PATH=self.exports_path), \
+                mock.patch.object(build_exports.DataVersion.objects, 'current', return_value=1), \
+                mock.patch.object(command, '_get_languages', return_value=['es']), \
+                mock.patch.object(command, '_get_exports', return_value=[('policies', [])]), \
+                mock.patch.object(build_exports, 'reverse', side_effect=lambda name, args: '/politicas.' + args[-1]), \
+                mock.patch.object(command, '_render', side_effect=render), \
+                redirect_stdout(io.StringIO()):
+            with self.assertRaisesMessage(CommandError, "1 de 2 ficheros fallaron"):
+                command.handle(formats=None)
+
+        self.assertIn("Error en la consulta /politicas.xlsx", command.stderr._out.getvalue())
+        with open(os.path.join(self.exports_path, MANIFEST_FILENAME)) as f:
+            self.assertEqual(list(json.load(f)['files']), ['/politicas.csv'])
+
+
+class StreamingRawQueryTest(TestCase):
+    def setUp(self):
+        self.budget = create_test_budget(create_test_entity(), 2020)
+        items = [budget_data_item('1111', '120', amount) for amount in range(1, 6)]
+        BudgetLoader().process_data_items(self.budget, items, True, False)
+
+    def test_all_rows_read(self):
+        items = stream_raw(BudgetItem.objects, "select * from budget_items order by amount", fetch_size=2)
+        self.assertEqual([item.amount for item in items.iterator()], [1, 2, 3, 4, 5])
+
+    def test_cursor_closed_when_done(self):
+        query = StreamingRawQuery("select amount from budget_items order by amount", 'default', fetch_size=2)
+        rows = iter(query)
+        with mock.patch.object(query.cursor, 'close') as close:
+            self.assertEqual([row[0] for row in rows], [1, 2, 3, 4, 5])
+        close.assert_called_once_with()
+        self.assertEqual(query.get_columns(), ['amount'])
+
+    def test_cursor_closed_when_stopped(self):
+        query = StreamingRawQuery("select amount from budget_items order by amount", 'default', fetch_size=2)
+        rows = iter(query)
+        with mock.patch.object(query.cursor, 'close') as close:
+            next(rows)
+            rows.close()
+        close.assert_called_once_with()
+
+
+# The search module, not the view of the same name exported by budget_app.views
+search = importlib.import_module('budget_app.views.search')
+
+class SearchTest(SimpleTestCase):
+    def test_no_queries_run_for_stop_words(self):
+        with mock.patch.object(search.GlossaryTerm.objects, 'search') as search_terms, \
+                mock.patch.object(search.BudgetItem.objects, 'search') as search_items:
+            results = search._search('de la', None, None, 'es', 1, run=False)
+        search_terms.assert_not_called()
+        search_items.assert_not_called()
+        self.assertEqual(results['results_size'], 0)
+        self.assertEqual(results['terms'], [])
+        self.assertNotIn('items', results)
+
+    def test_all_terms_for_empty_query(self):
+        with mock.patch.object(search.GlossaryTerm.objects, 'search', return_value=['IRPF', 'IVA']) as search_terms:
+            results = search._search('', None, None, 'es', 1, run=False)
+        search_terms.assert_called_once_with('', 'es')
+        self.assertEqual(results['terms'], ['IRPF', 'IVA'])
+        self.assertEqual(results['results_size'], 2)
+
+    @override_settings(SEARCH_THREADS=2)
+    def test_threads_shared_by_searches(self):
+        queries = {'a': lambda: threading.current_thread().name, 'b': lambda: 2}
+        with mock.patch.object(search, 'close_old_connections') as close_old_connections:
+            self.assertEqual(search._run_queries(queries)['b'], 2)
+            executor = search._get_executor()
+            self.assertTrue(search._run_queries(queries)['a'].startswith('search'))
+        self.assertIs(search._get_executor(), executor)
+        self.assertEqual(close_old_connections.call_count, 8)
+
+    @override_settings(SEARCH_THREADS=1)
+    def test_no_threads(self):
+        name = threading.current_thread().name
+        self.assertEqual(search._run_queries({'a': lambda: threading.current_thread().name}), {'a': name})
+
+
+# Needs a PostgreSQL database, where the tables can be partitioned
+@skipUnless(connection.vendor == 'postgresql', "Partitioning needs PostgreSQL")
+class PartitionsTest(TestCase):
+    def setUp(self):
+        with redirect_stdout(io.StringIO()):
+            call_command('partition_budget_tables')
+        self.entity = create_test_entity()
+
+    def _table_exists(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute("select to_regclass(%s)", [table])
+            return cursor.fetchone()[0] is not None
+
+    def _count(self, table):
+        with connection.cursor() as cursor:
+            cursor.execute("select count(*) from %s" % table)
+            return cursor.fetchone()[0]
+
+    def test_tables_partitioned(self):
+        self.assertTrue(is_partitioned('budget_items'))
+        self.assertTrue(is_partitioned('payments'))
+
+    def test_create_and_drop_partitions(self):
+        budget = Budget.objects.create_staging(self.entity, 2020, '')
+        create_test_categories(budget)
+        BudgetLoader().process_data_items(budget, [budget_data_item('1111', '120', 1000)], True, False)
+
+        items_partition = get_partition_name('budget_items', budget)
+        payments_partition = get_partition_name('payments', budget)
+        self.assertTrue(self._table_exists(payments_partition))
+        self.assertEqual(self._count(items_partition), 1)
+
+        Budget.objects.delete_budgets([budget])
+        self.assertFalse(self._table_exists(items_partition))
+        self.assertFalse(self._table_exists(payments_partition))
+        self.assertFalse(Budget.objects.filter(id=budget.id).exists())
+        self.assertEqual(self._count('budget_items'), 0)
+
+    def test_swap_partition(self):
+        budget = create_test_budget(self.entity, 2020)
+        create_partitions(budget)
+        Payment.objects.create(budget=budget, payee='Proveedor A', expense=True, description='', amount=100)
+
+        staging_table = create_staging_table('payments', budget)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "insert into %s (budget_id, payee, payee_fiscal_id, anonymized, expense, description, amount, created_at, updated_at) "
+                "values (%%s, 'Proveedor B', '', false, true, '', 200, now(), now())" % staging_table,
+                [budget.id])
+        swap_partition('payments', budget, staging_table)
+
+        self.assertFalse(self._table_exists(staging_table))
+        self.assertEqual(list(Payment.objects.filter(budget=budget).values_list('payee', 'amount')), [('Proveedor B', 200)])
+        self.assertEqual(self._count(get_partition_name('payments', budget)), 1)
+
+
+# A model whose raw queries return the requested window of a list of numbers, so we can
+# tell which LIMIT/OFFSET was used, and how many queries were run
+class FakeRawModel:
+    rows = list(range(25))
+    queries = []
+
+    class objects:
+        @staticmethod
+        def raw(sql, arguments):
+            FakeRawModel.queries.append((sql, arguments))
+            if 'limit' not in sql:
+                return list(FakeRawModel.rows)
+            limit, offset = arguments[-2:]
+            return FakeRawModel.rows[offset:offset+limit] if limit is not None else FakeRawModel.rows[offset:]
+
+class FakeManager:
+    model = FakeRawModel
+
+# A cursor returning the given value as the result of a count
+class FakeCursor:
+    def __init__(self, count):
+        self.count = count
+        self.executed = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, sql, arguments):
+        self.executed.append((sql, arguments))
+
+    def fetchone(self):
+        return [self.count]
+
+class SearchResultsTest(SimpleTestCase):
+    def setUp(self):
+        FakeRawModel.queries = []
+        self.results = SearchResults(FakeManager(), "*", "from items where x = %s", ['foo'], "amount desc, id")
+
+    def _count(self, cursor):
+        fake_connection = mock.Mock()
+        fake_connection.cursor.return_value = cursor
+        with mock.patch.object(search_results, 'connection', fake_connection):
+            return self.results.count()
+
+    def test_slicing(self):
+        self.assertEqual(self.results[0:10], list(range(10)))
+        self.assertEqual(self.results[20:30], list(range(20, 25)))
+        self.assertEqual(self.results[:3], [0, 1, 2])
+        self.assertEqual(self.results[23:], [23, 24])
+        self.assertEqual(self.results[5], 5)
+        with self.assertRaises(IndexError):
+            self.results[30]
+        with self.assertRaises(ValueError):
+            self.results[0:10:2]
+
+        sql, arguments = FakeRawModel.queries[0]
+        self.assertTrue(sql.endswith("order by amount desc, id limit %s offset %s"))
+        self.assertEqual(arguments, ['foo', 10, 0])
+
+    def test_slices_fetched_once(self):
+        self.results[10:20]
+        self.results[10:20]
+        self.assertEqual(len(FakeRawModel.queries), 1)
+
+        self.results[0:10]
+        self.assertEqual(len(FakeRawModel.queries), 2)
+
+    @override_settings(SEARCH_EXACT_COUNT_LIMIT=100)
+    def test_exact_count_below_limit(self):
+        cursor = FakeCursor(42)
+        self.assertEqual(self._count(cursor), 42)
+        self.assertFalse(self.results.is_estimated_count)
+        self.assertEqual(cursor.executed[0][1], ['foo', 101])
+
+        # The count is kept, no need to go to the database again
+        self.assertEqual(len(self.results), 42)
+        self.assertEqual(len(cursor.executed), 1)
+
+    @override_settings(SEARCH_EXACT_COUNT_LIMIT=100)
+    def test_estimated_count_above_limit(self):
+        with mock.patch.object(SearchResults, '_estimate_count', return_value=5000):
+            self.assertEqual(self._count(FakeCursor(101)), 5000)
+        self.assertTrue(self.results.is_estimated_count)
+
+    @override_settings(SEARCH_EXACT_COUNT_LIMIT=100)
+    def test_estimated_count_never_below_limit(self):
+        with mock.patch.object(SearchResults, '_estimate_count', return_value=30):
+            self.assertEqual(self._count(FakeCursor(101)), 101)
+        self.assertTrue(self.results.is_estimated_count)
@@ -1,7 +1,7 @@
 from .budgets import budgets
 from .entities import entities_policies, entities_show_helper, entities_policies_show, entities_programmes, entities_programmes_show
 from .entities import entities_income_articles, entities_income_articles_show, entities_expense_articles, entities_expense_articles_show
-from .entities import entities_payments, entities_payments_search
+from .entities import entities_payments, entities_payments_search, entities_payment_payees
 from .guided_visit import guided_visit
 from .investments import investments, investments_show
 from .main_investments import main_investments
@@ -12,8 +12,9 @@ from .search import search
 from .sections import sections_show
 from .tax_receipt import tax_receipt
 from .terms import terms
+from .typeahead import typeahead
 from .pages import pages
-from .payments import payments, payments_helper, payment_search, payment_search_helper
+from .payments import payments, payments_helper, payment_search, payment_search_helper, payment_payees, payment_payees_helper
 from .welcome import welcome
 
 from .towns_and_counties import towns, towns_show, towns_compare, towns_show_income, towns_show_expense, towns_show_functional
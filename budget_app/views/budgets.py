@@ -2,7 +2,7 @@
 
 from django.conf import settings
 from django.utils.translation import ugettext as _
-from budget_app.models import Budget, BudgetBreakdown, BudgetItem
+from budget_app.models import Budget, BudgetBreakdown
 from .helpers import *
 
 
@@ -19,13 +19,16 @@ def budgets(request, render_callback=None):
         'economic': BudgetBreakdown(['article', 'heading']),
         'chapter': BudgetBreakdown(['chapter']) # Used for indicators
     }
-    for item in BudgetItem.objects.each_denormalized("e.id = %s", [main_entity.id]):
-        column_name = year_column_name(item)
-        c['breakdowns']['chapter'].add_item(column_name, item)
+    def _add_non_financial_item(column_name, item):
         if c['include_financial_chapters'] or not item.is_financial():
             c['breakdowns']['functional'].add_item(column_name, item)
             c['breakdowns']['economic'].add_item(column_name, item)
 
+    get_budget_breakdown(   "e.id = %s", [ main_entity.id ],
+                            [ c['breakdowns']['chapter'] ],
+                            _add_non_financial_item,
+                            aggregated=True )
+
     # Additional data needed by the view
     populate_stats(c)
     populate_descriptions(c)
@@ -1,14 +1,16 @@
 # -*- coding: UTF-8 -*-
 
 import csv
+import itertools
 
-from django.http import HttpResponse
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, StreamingHttpResponse
+from django.utils import translation
 from django.utils.translation import ugettext as _
-from functools import reduce
 from openpyxl import Workbook
-from tempfile import NamedTemporaryFile
+from tempfile import SpooledTemporaryFile
 
-from budget_app.models import Entity, Payment
+from budget_app.models import Entity
 from budget_app.views import *
 from .helpers import get_context
 
@@ -34,65 +36,68 @@ from .helpers import get_context
 #
 # ENTITY BREAKDOWNS
 #
-def write_entity_functional_breakdown(c, writer):
-    write_header(writer, [u'Año.csv', u'Id Política', u'Nombre Política', 'Id Programa', 'Nombre Programa', 'Presupuesto Gasto', 'Gasto Real'])
-    for year in sorted(_unique(c['breakdowns']['functional'].years.values())):
-        for policy_id, policy in c['breakdowns']['functional'].subtotals.items():
-            write_breakdown_item(writer, year, policy, 'expense', [policy_id, None], c['descriptions']['functional'])
-            for programme_id, programme in policy.subtotals.items():
-                write_breakdown_item(writer, year, programme, 'expense', [policy_id, programme_id], c['descriptions']['functional'])
-
-def write_entity_institutional_breakdown(c, writer):
-    write_header(writer, [u'Año.csv', u'Id Institución', u'Nombre Institución', u'Id Sección', u'Nombre Sección', 'Presupuesto Gasto', 'Gasto Real'])
-    for year in sorted(_unique(c['breakdowns']['institutional'].years.values())):
-        for institution_id, institution in c['breakdowns']['institutional'].subtotals.items():
-            write_breakdown_item(writer, year, institution, 'expense', [institution_id, None], c['descriptions']['institutional'])
-            for section_id, section in institution.subtotals.items():
-                write_breakdown_item(writer, year, section, 'expense', [institution_id, section_id], c['descriptions']['institutional'])
-
-def write_entity_economic_breakdown(c, field, writer):
+def stream_entity_functional_breakdown(c, writer):
+    yield write_header(writer, [u'Año.csv', u'Id Política', u'Nombre Política', 'Id Programa', 'Nombre Programa', 'Presupuesto Gasto', 'Gasto Real'])
+    pivot = BreakdownPivot(c['breakdowns']['functional'], 'expense')
+    for policy_id, policy in c['breakdowns']['functional'].subtotals.items():
+        pivot.add(policy, [policy_id, None], c['descriptions']['functional'])
+        for programme_id, programme in policy.subtotals.items():
+            pivot.add(programme, [policy_id, programme_id], c['descriptions']['functional'])
+    yield from pivot.write(writer)
+
+def stream_entity_institutional_breakdown(c, writer):
+    yield write_header(writer, [u'Año.csv', u'Id Institución', u'Nombre Institución', u'Id Sección', u'Nombre Sección', 'Presupuesto Gasto', 'Gasto Real'])
+    pivot = BreakdownPivot(c['breakdowns']['institutional'], 'expense')
+    for institution_id, institution in c['breakdowns']['institutional'].subtotals.items():
+        pivot.add(institution, [institution_id, None], c['descriptions']['institutional'])
+        for section_id, section in institution.subtotals.items():
+            pivot.add(section, [institution_id, section_id], c['descriptions']['institutional'])
+    yield from pivot.write(writer)
+
+def stream_entity_economic_breakdown(c, field, writer):
     field_username = 'Gastos' if field == 'expense' else 'Ingresos'
-    write_header(writer, [u'Año.csv', u'Id Artículo', u'Nombre Artículo', 'Id Concepto', 'Nombre Concepto', 'Presupuesto '+field_username, field_username+' Reales'])
-    for year in sorted(_unique(c['breakdowns']['economic'].years.values())):
-        for article_id, article in c['breakdowns']['economic'].subtotals.items():
-            write_breakdown_item(writer, year, article, field, [article_id, None], c['descriptions'][field])
-            for heading_id, heading in article.subtotals.items():
-                write_breakdown_item(writer, year, heading, field, [article_id, heading_id], c['descriptions'][field])
+    yield write_header(writer, [u'Año.csv', u'Id Artículo', u'Nombre Artículo', 'Id Concepto', 'Nombre Concepto', 'Presupuesto '+field_username, field_username+' Reales'])
+    pivot = BreakdownPivot(c['breakdowns']['economic'], field)
+    for article_id, article in c['breakdowns']['economic'].subtotals.items():
+        pivot.add(article, [article_id, None], c['descriptions'][field])
+        for heading_id, heading in article.subtotals.items():
+            pivot.add(heading, [article_id, heading_id], c['descriptions'][field])
+    yield from pivot.write(writer)
 
-def write_entity_economic_expense_breakdown(c, writer):
-    return write_entity_economic_breakdown(c, 'expense', writer)
+def stream_entity_economic_expense_breakdown(c, writer):
+    return stream_entity_economic_breakdown(c, 'expense', writer)
 
-def write_entity_income_breakdown(c, writer):
-    return write_entity_economic_breakdown(c, 'income', writer)
+def stream_entity_income_breakdown(c, writer):
+    return stream_entity_economic_breakdown(c, 'income', writer)
 
 def entity_expenses(request, level, slug, format):
     c = get_context(request)
     entity = Entity.objects.get(level=level, slug=slug, language=c['LANGUAGE_CODE'])
-    return entities_show_helper(request, c, entity, _generator('gastos-%s-%s' % (level, slug), format, write_entity_economic_expense_breakdown))
+    return entities_show_helper(request, c, entity, _generator('gastos-%s-%s' % (level, slug), format, stream_entity_economic_expense_breakdown))
 
 def entity_functional(request, level, slug, format):
     c = get_context(request)
     entity = Entity.objects.get(level=level, slug=slug, language=c['LANGUAGE_CODE'])
-    return entities_show_helper(request, c, entity, _generator('gastosf-%s-%s' % (level, slug), format, write_entity_functional_breakdown))
+    return entities_show_helper(request, c, entity, _generator('gastosf-%s-%s' % (level, slug), format, stream_entity_functional_breakdown))
 
 def entity_institutional(request, level, slug, format):
     c = get_context(request)
     entity = Entity.objects.get(level=level, slug=slug, language=c['LANGUAGE_CODE'])
-    return entities_show_helper(request, c, entity, _generator('gastosi-%s-%s' % (level, slug), format, write_entity_institutional_breakdown))
+    return entities_show_helper(request, c, entity, _generator('gastosi-%s-%s' % (level, slug), format, stream_entity_institutional_breakdown))
 
 def entity_income(request, level, slug, format):
     c = get_context(request)
     entity = Entity.objects.get(level=level, slug=slug, language=c['LANGUAGE_CODE'])
-    return entities_show_helper(request, c, entity, _generator('ingresos-%s-%s' % (level, slug), format, write_entity_income_breakdown))
+    return entities_show_helper(request, c, entity, _generator('ingresos-%s-%s' % (level, slug), format, stream_entity_income_breakdown))
 
 
 #
 # PAYMENTS BREAKDOWN
 #
-def write_entity_payment_breakdown(c, writer):
-    write_header(writer, [u'Año.csv', u'Área/Política', 'Beneficiario', 'Concepto', 'Cantidad'])
+def stream_entity_payment_breakdown(c, writer):
+    yield write_header(writer, [u'Año.csv', u'Área/Política', 'Beneficiario', 'Concepto', 'Cantidad'])
     for payment in c['payments']:
-        writer.writerow([
+        yield writer.writerow([
             payment.year,
             payment.area,
             payment.payee,
@@ -101,53 +106,54 @@ def write_entity_payment_breakdown(c, writer):
         ])
 
 def entity_payments(request, slug, format):
-    c = get_context(request)
-    c['payments'] = Payment.objects.all().prefetch_related('budget').order_by("-budget__year")
-    return payment_search(request, _generator('pagos-%s' % (slug), format, write_entity_payment_breakdown))
+    return payment_search(request, _generator('pagos-%s' % (slug), format, stream_entity_payment_breakdown))
 
 
 #
 # INVESTMENTS BREAKDOWN
 #
-def write_entity_investments_breakdown(c, writer):
-    write_header(writer, [u'Año.csv', u'Id Área', u'Nombre Área', 'Presupuesto Gasto', 'Gasto Real'])
-    for year in sorted(_unique(c['area_breakdown'].years.values())):
-        for area_id, area in c['area_breakdown'].subtotals.items():
-            write_breakdown_item(writer, year, area, 'expense', [area_id], c['descriptions']['geographic'])
-        for area_id, area in c['no_area_breakdown'].subtotals.items():
-            write_breakdown_item(writer, year, area, 'expense', [area_id], c['descriptions']['geographic'])
-
-def write_entity_investment_line_breakdown(c, writer):
-    write_header(writer, [u'Año.csv', u'Id Línea', u'Nombre Línea', u'Inversión', u'Inversión', 'Presupuesto Gasto', 'Gasto Real'])
-    for year in sorted(_unique(c['area_breakdown'].years.values())):
-        for line_id, line in c['area_breakdown'].subtotals.items():
-            write_breakdown_item(writer, year, line, 'expense', [line_id, None], c['descriptions']['functional'])
-            for investment_id, investment in line.subtotals.items():
-                write_breakdown_item(writer, year, investment, 'expense', [line_id, investment_id], c['descriptions']['functional'])
+def stream_entity_investments_breakdown(c, writer):
+    yield write_header(writer, [u'Año.csv', u'Id Área', u'Nombre Área', 'Presupuesto Gasto', 'Gasto Real'])
+    pivot = BreakdownPivot(c['area_breakdown'], 'expense')
+    for area_id, area in c['area_breakdown'].subtotals.items():
+        pivot.add(area, [area_id], c['descriptions']['geographic'])
+    for area_id, area in c['no_area_breakdown'].subtotals.items():
+        pivot.add(area, [area_id], c['descriptions']['geographic'])
+    yield from pivot.write(writer)
+
+def stream_entity_investment_line_breakdown(c, writer):
+    yield write_header(writer, [u'Año.csv', u'Id Línea', u'Nombre Línea', u'Inversión', u'Inversión', 'Presupuesto Gasto', 'Gasto Real'])
+    pivot = BreakdownPivot(c['area_breakdown'], 'expense')
+    for line_id, line in c['area_breakdown'].subtotals.items():
+        pivot.add(line, [line_id, None], c['descriptions']['functional'])
+        for investment_id, investment in line.subtotals.items():
+            pivot.add(investment, [line_id, investment_id], c['descriptions']['functional'])
+    yield from pivot.write(writer)
 
 def entity_investments_breakdown(request, slug, format):
     c = get_context(request)
-    return investments(request, _generator('inversiones-%s' % (slug), format, write_entity_investments_breakdown))
+    return investments(request, _generator('inversiones-%s' % (slug), format, stream_entity_investments_breakdown))
 
 def entity_investment_line_breakdown(request, slug, id, format):
     c = get_context(request)
-    return investments_show(request, id, '', _generator('inversiones-%s-%s' % (slug, id), format, write_entity_investment_line_breakdown))
+    return investments_show(request, id, '', _generator('inversiones-%s-%s' % (slug, id), format, stream_entity_investment_line_breakdown))
 
 
 #
 # MAIN INVESTMENTS BREAKDOWN
 #
-def write_entity_main_investments_breakdown(c, writer):
-    write_header(writer, [u'Año.csv', u'Nombre Área', u'Inversión', u'Presupuesto año en curso', 'Presupuesto total'])
-    for year in sorted(_unique(c['area_breakdown'].years.values())):
-        for area_id, area in c['area_breakdown'].subtotals.items():
-            write_breakdown_item(writer, year, area, 'expense', [area_id, None], None)
-            for investment_id, investment in area.subtotals.items():
-                write_breakdown_item(writer, year, investment, 'expense', [area_id, investment_id], None)
+def stream_entity_main_investments_breakdown(c, writer):
+    yield write_header(writer, [u'Año.csv', u'Nombre Área', u'Inversión', u'Presupuesto año en curso', 'Presupuesto total'])
+    pivot = BreakdownPivot(c['area_breakdown'], 'expense')
+    for area_id, area in c['area_breakdown'].subtotals.items():
+        pivot.add(area, [area_id, None], None)
+        for investment_id, investment in area.subtotals.items():
+            pivot.add(investment, [area_id, investment_id], None)
+    yield from pivot.write(writer)
 
 def entity_main_investments_breakdown(request, slug, format):
     c = get_context(request)
-    return main_investments(request, _generator('inversiones-principales-%s' % (slug), format, write_entity_main_investments_breakdown))
+    return main_investments(request, _generator('inversiones-principales-%s' % (slug), format, stream_entity_main_investments_breakdown))
 
 
 #
@@ -156,13 +162,13 @@ def entity_main_investments_breakdown(request, slug, format):
 def format_progress(score):
     return format(score*100.0, ".2f")
 
-def write_policy_monitoring_breakdown(c, writer):
-    write_header(writer, [u'Año.csv', u'Id Programa', u'Nombre Programa', u'Cumplimiento %'])
+def stream_policy_monitoring_breakdown(c, writer):
+    yield write_header(writer, [u'Año.csv', u'Id Programa', u'Nombre Programa', u'Cumplimiento %'])
 
     # Write policy-level results
     for year, score in sorted(c['monitoring_totals'].items()):
         if score != '':
-            writer.writerow([
+            yield writer.writerow([
                 year,
                 '',
                 '',
@@ -175,7 +181,7 @@ def write_policy_monitoring_breakdown(c, writer):
             if programme_id in c['monitoring_totals_per_programme']:
                 programme_data = c['monitoring_totals_per_programme'][programme_id]
                 score = programme_data[3]/programme_data[4]
-                writer.writerow([
+                yield writer.writerow([
                     year,
                     programme_number,
                     programme_description,
@@ -183,15 +189,15 @@ def write_policy_monitoring_breakdown(c, writer):
                 ])
 
 def policy_monitoring_breakdown(request, id, format):
-    return policies_show(request, id, '', _generator("%s_objetivos" % id, format, write_policy_monitoring_breakdown))
+    return policies_show(request, id, '', _generator("%s_objetivos" % id, format, stream_policy_monitoring_breakdown))
 
-def write_programme_monitoring_breakdown(c, writer):
-    write_header(writer, [u'Año.csv', u'Sección', u'Cumplimiento %'])
+def stream_programme_monitoring_breakdown(c, writer):
+    yield write_header(writer, [u'Año.csv', u'Sección', u'Cumplimiento %'])
 
     # Write programme-level results
     for year, score in sorted(c['monitoring_totals'].items()):
         if score != '':
-            writer.writerow([
+            yield writer.writerow([
                 year,
                 '',
                 format_progress(score)
@@ -203,206 +209,255 @@ def write_programme_monitoring_breakdown(c, writer):
             if section_id in c['monitoring_totals_per_section']:
                 section_data = c['monitoring_totals_per_section'][section_id]
                 score = section_data[1]/section_data[2]
-                writer.writerow([
+                yield writer.writerow([
                     year,
                     section_description,
                     format_progress(score)
                 ])
 
 def programme_monitoring_breakdown(request, id, format):
-    return programmes_show(request, id, '', _generator("%s_objetivos" % id, format, write_programme_monitoring_breakdown))
+    return programmes_show(request, id, '', _generator("%s_objetivos" % id, format, stream_programme_monitoring_breakdown))
 
 
 #
 # FUNCTIONAL BREAKDOWN
 #
-def write_functional_breakdown(c, writer):
-    write_header(writer, [u'Año.csv', u'Id Política', u'Nombre Política', 'Id Programa', 'Nombre Programa', 'Presupuesto Gastos', 'Gastos Reales'])
-    for year in sorted(_unique(c['breakdowns']['functional'].years.values())):
-        for programme_id, programme in c['breakdowns']['functional'].subtotals.items():
-            write_breakdown_item(writer, year, programme, 'expense', [c['policy_uid'], programme_id], c['descriptions']['functional'])
+def stream_functional_breakdown(c, writer):
+    yield write_header(writer, [u'Año.csv', u'Id Política', u'Nombre Política', 'Id Programa', 'Nombre Programa', 'Presupuesto Gastos', 'Gastos Reales'])
+    pivot = BreakdownPivot(c['breakdowns']['functional'], 'expense')
+    for programme_id, programme in c['breakdowns']['functional'].subtotals.items():
+        pivot.add(programme, [c['policy_uid'], programme_id], c['descriptions']['functional'])
+    yield from pivot.write(writer)
 
 def functional_policy_breakdown(request, id, format):
-    return policies_show(request, id, '', _generator("%s.funcional" % id, format, write_functional_breakdown))
+    return policies_show(request, id, '', _generator("%s.funcional" % id, format, stream_functional_breakdown))
 
-def write_functional_programme_breakdown(c, writer):
-    write_header(writer, [u'Año.csv', 'Id Programa', 'Nombre Programa', 'Id Subprograma', 'Nombre Subprograma', 'Presupuesto Gastos', 'Gastos Reales'])
-    for year in sorted(_unique(c['breakdowns']['functional'].years.values())):
-        for subprogramme_id, subprogramme in c['breakdowns']['functional'].subtotals.items():
-            write_breakdown_item(writer, year, subprogramme, 'expense', [c['programme_id'], subprogramme_id], c['descriptions']['functional'])
+def stream_functional_programme_breakdown(c, writer):
+    yield write_header(writer, [u'Año.csv', 'Id Programa', 'Nombre Programa', 'Id Subprograma', 'Nombre Subprograma', 'Presupuesto Gastos', 'Gastos Reales'])
+    pivot = BreakdownPivot(c['breakdowns']['functional'], 'expense')
+    for subprogramme_id, subprogramme in c['breakdowns']['functional'].subtotals.items():
+        pivot.add(subprogramme, [c['programme_id'], subprogramme_id], c['descriptions']['functional'])
+    yield from pivot.write(writer)
 
 def functional_programme_breakdown(request, id, format):
-    return programmes_show(request, id, '', _generator("%s.funcional" % id, format, write_functional_programme_breakdown))
+    return programmes_show(request, id, '', _generator("%s.funcional" % id, format, stream_functional_programme_breakdown))
 
 def functional_article_expenditures_breakdown(request, id, format):
-    return expense_articles_show(request, id, format, _generator("%s.funcional" % id, format, write_entity_functional_breakdown))
+    return expense_articles_show(request, id, format, _generator("%s.funcional" % id, format, stream_entity_functional_breakdown))
 
 def functional_section_breakdown(request, id, format):
-    return sections_show(request, id, format, _generator("%s.funcional" % id, format, write_entity_functional_breakdown))
+    return sections_show(request, id, format, _generator("%s.funcional" % id, format, stream_entity_functional_breakdown))
 
 def entity_article_functional(request, level, slug, id, format):
     c = get_context(request)
     entity = Entity.objects.get(level=level, slug=slug, language=c['LANGUAGE_CODE'])
-    return entities_show_policy(request, c, entity, id, '', _generator('gastosf-%s-%s-%s' % (level, slug, id), format, write_entity_functional_breakdown))
+    return entities_show_policy(request, c, entity, id, '', _generator('gastosf-%s-%s-%s' % (level, slug, id), format, stream_entity_functional_breakdown))
 
 
 #
 # ECONOMIC BREAKDOWN
 #
-def write_economic_breakdown(c, writer):
-    write_header(writer, [u'Año.csv', u'Id Capítulo', u'Nombre Capítulo', u'Id Artículo', u'Nombre Artículo', 'Id Concepto', 'Nombre Concepto', 'Presupuesto Gastos', 'Gastos Reales'])
-    for year in sorted(_unique(c['breakdowns']['economic'].years.values())):
-        for chapter_id, chapter in c['breakdowns']['economic'].subtotals.items():
-            write_breakdown_item(writer, year, chapter, 'expense', [chapter_id, None, None], c['descriptions']['economic'])
-            for article_id, article in chapter.subtotals.items():
-                write_breakdown_item(writer, year, article, 'expense', [chapter_id, article_id, None], c['descriptions']['economic'])
-                for heading_id, heading in article.subtotals.items():
-                    write_breakdown_item(writer, year, heading, 'expense', [chapter_id, article_id, heading_id], c['descriptions']['economic'])
+def stream_economic_breakdown(c, writer):
+    yield write_header(writer, [u'Año.csv', u'Id Capítulo', u'Nombre Capítulo', u'Id Artículo', u'Nombre Artículo', 'Id Concepto', 'Nombre Concepto', 'Presupuesto Gastos', 'Gastos Reales'])
+    pivot = BreakdownPivot(c['breakdowns']['economic'], 'expense')
+    for chapter_id, chapter in c['breakdowns']['economic'].subtotals.items():
+        pivot.add(chapter, [chapter_id, None, None], c['descriptions']['economic'])
+        for article_id, article in chapter.subtotals.items():
+            pivot.add(article, [chapter_id, article_id, None], c['descriptions']['economic'])
+            for heading_id, heading in article.subtotals.items():
+                pivot.add(heading, [chapter_id, article_id, heading_id], c['descriptions']['economic'])
+    yield from pivot.write(writer)
 
 def economic_policy_breakdown(request, id, format):
-    return policies_show(request, id, '', _generator("%s.economica" % id, format, write_economic_breakdown))
-
-def write_detailed_economic_breakdown(c, writer):
-    write_header(writer, [u'Año.csv', u'Id Capítulo', u'Nombre Capítulo', u'Id Artículo', u'Nombre Artículo', 'Id Subconcepto', 'Nombre Subconcepto', 'Presupuesto Gastos', 'Gastos Reales'])
-    for year in sorted(_unique(c['breakdowns']['economic'].years.values())):
-        for chapter_id, chapter in c['breakdowns']['economic'].subtotals.items():
-            write_breakdown_item(writer, year, chapter, 'expense', [chapter_id, None, None], c['descriptions']['economic'])
-            for article_id, article in chapter.subtotals.items():
-                write_breakdown_item(writer, year, article, 'expense', [chapter_id, article_id, None], c['descriptions']['economic'])
-                for heading_id, heading in article.subtotals.items():
-                    for subheading_id, subheading in heading.subtotals.items():
-                        write_breakdown_item(writer, year, subheading, 'expense', [chapter_id, article_id, subheading_id], c['descriptions']['economic'])
+    return policies_show(request, id, '', _generator("%s.economica" % id, format, stream_economic_breakdown))
+
+def stream_detailed_economic_breakdown(c, writer):
+    yield write_header(writer, [u'Año.csv', u'Id Capítulo', u'Nombre Capítulo', u'Id Artículo', u'Nombre Artículo', 'Id Subconcepto', 'Nombre Subconcepto', 'Presupuesto Gastos', 'Gastos Reales'])
+    pivot = BreakdownPivot(c['breakdowns']['economic'], 'expense')
+    for chapter_id, chapter in c['breakdowns']['economic'].subtotals.items():
+        pivot.add(chapter, [chapter_id, None, None], c['descriptions']['economic'])
+        for article_id, article in chapter.subtotals.items():
+            pivot.add(article, [chapter_id, article_id, None], c['descriptions']['economic'])
+            for heading_id, heading in article.subtotals.items():
+                for subheading_id, subheading in heading.subtotals.items():
+                    pivot.add(subheading, [chapter_id, article_id, subheading_id], c['descriptions']['economic'])
+    yield from pivot.write(writer)
 
 def economic_programme_breakdown(request, id, format):
-    return programmes_show(request, id, '', _generator("%s.economica" % id, format, write_detailed_economic_breakdown))
+    return programmes_show(request, id, '', _generator("%s.economica" % id, format, stream_detailed_economic_breakdown))
 
 def economic_subprogramme_breakdown(request, id, format):
-    return subprogrammes_show(request, id, '', _generator("%s.economica" % id, format, write_detailed_economic_breakdown))
+    return subprogrammes_show(request, id, '', _generator("%s.economica" % id, format, stream_detailed_economic_breakdown))
 
 def economic_section_breakdown(request, id, format):
-    return sections_show(request, id, '', _generator("%s.economica" % id, format, write_detailed_economic_breakdown))
+    return sections_show(request, id, '', _generator("%s.economica" % id, format, stream_detailed_economic_breakdown))
 
 
 #
 # ECONOMIC ARTICLE BREAKDOWN
 #
-def write_economic_article_breakdown(c, field, writer):
+def stream_economic_article_breakdown(c, field, writer):
     field_username = 'Gastos' if field == 'expense' else 'Ingresos'
-    write_header(writer, [u'Año.csv', u'Id Artículo', u'Nombre Artículo', 'Id Concepto', 'Nombre Concepto', 'Id Subconcepto', 'Nombre Subconcepto', 'Presupuesto '+field_username, field_username+' Reales'])
-    for year in sorted(_unique(c['breakdowns']['economic'].years.values())):
-        write_breakdown_item(writer, year, c['breakdowns']['economic'], field, [c['article_id'], None, None], c['descriptions']['economic'])
-        for heading_id, heading in c['breakdowns']['economic'].subtotals.items():
-            write_breakdown_item(writer, year, heading, field, [c['article_id'], heading_id, None], c['descriptions']['economic'])
-            for item_uid, item in heading.subtotals.items():
-                write_breakdown_item(writer, year, item, field, [c['article_id'], heading_id, item_uid], c['descriptions']['economic'])
+    yield write_header(writer, [u'Año.csv', u'Id Artículo', u'Nombre Artículo', 'Id Concepto', 'Nombre Concepto', 'Id Subconcepto', 'Nombre Subconcepto', 'Presupuesto '+field_username, field_username+' Reales'])
+    pivot = BreakdownPivot(c['breakdowns']['economic'], field)
+    pivot.add(c['breakdowns']['economic'], [c['article_id'], None, None], c['descriptions']['economic'])
+    for heading_id, heading in c['breakdowns']['economic'].subtotals.items():
+        pivot.add(heading, [c['article_id'], heading_id, None], c['descriptions']['economic'])
+        for item_uid, item in heading.subtotals.items():
+            pivot.add(item, [c['article_id'], heading_id, item_uid], c['descriptions']['economic'])
+    yield from pivot.write(writer)
 
-def write_economic_article_expense_breakdown(c, writer):
-    return write_economic_article_breakdown(c, 'expense', writer);
+def stream_economic_article_expense_breakdown(c, writer):
+    return stream_economic_article_breakdown(c, 'expense', writer);
 
-def write_economic_article_income_breakdown(c, writer):
-    return write_economic_article_breakdown(c, 'income', writer);
+def stream_economic_article_income_breakdown(c, writer):
+    return stream_economic_article_breakdown(c, 'income', writer);
 
 def economic_article_revenues_breakdown(request, id, format):
-    return income_articles_show(request, id, format, _generator("%s.ingresos.economica" % id, format, write_economic_article_income_breakdown))
+    return income_articles_show(request, id, format, _generator("%s.ingresos.economica" % id, format, stream_economic_article_income_breakdown))
 
 def economic_article_expenditures_breakdown(request, id, format):
-    return expense_articles_show(request, id, format, _generator("%s.gastos.economica" % id, format, write_economic_article_expense_breakdown))
+    return expense_articles_show(request, id, format, _generator("%s.gastos.economica" % id, format, stream_economic_article_expense_breakdown))
 
 def entity_article_expenses(request, level, slug, id, format):
     c = get_context(request)
     entity = Entity.objects.get(level=level, slug=slug, language=c['LANGUAGE_CODE'])
-    return entities_show_article(request, c, entity, id, '', 'expense', _generator('ingresos-%s-%s-%s' % (level, slug, id), format, write_economic_article_expense_breakdown))
+    return entities_show_article(request, c, entity, id, '', 'expense', _generator('ingresos-%s-%s-%s' % (level, slug, id), format, stream_economic_article_expense_breakdown))
 
 def entity_article_income(request, level, slug, id, format):
     c = get_context(request)
     entity = Entity.objects.get(level=level, slug=slug, language=c['LANGUAGE_CODE'])
-    return entities_show_article(request, c, entity, id, '', 'income', _generator('ingresos-%s-%s-%s' % (level, slug, id), format, write_economic_article_income_breakdown))
+    return entities_show_article(request, c, entity, id, '', 'income', _generator('ingresos-%s-%s-%s' % (level, slug, id), format, stream_economic_article_income_breakdown))
 
 
 #
 # FUNDING BREAKDOWN
 #
-def write_funding_breakdown(c, writer):
+def stream_funding_breakdown(c, writer):
     field_username = 'Gastos' if c['show_side'] == 'expense' else 'Ingresos'
-    write_header(writer, [u'Año.csv', 'Id Fuente', 'Nombre Fuente', 'Id Fondo', 'Nombre Fondo', 'Presupuesto '+field_username, field_username+' Reales'])
-    for year in sorted(_unique(c['breakdowns']['funding'].years.values())):
-        for source_id, source in c['breakdowns']['funding'].subtotals.items():
-            write_breakdown_item(writer, year, source, c['show_side'], [source_id, None], c['descriptions']['funding'])
-            for fund_id, fund in source.subtotals.items():
-                write_breakdown_item(writer, year, fund, c['show_side'], [source_id, fund_id], c['descriptions']['funding'])
+    yield write_header(writer, [u'Año.csv', 'Id Fuente', 'Nombre Fuente', 'Id Fondo', 'Nombre Fondo', 'Presupuesto '+field_username, field_username+' Reales'])
+    pivot = BreakdownPivot(c['breakdowns']['funding'], c['show_side'])
+    for source_id, source in c['breakdowns']['funding'].subtotals.items():
+        pivot.add(source, [source_id, None], c['descriptions']['funding'])
+        for fund_id, fund in source.subtotals.items():
+            pivot.add(fund, [source_id, fund_id], c['descriptions']['funding'])
+    yield from pivot.write(writer)
 
 def funding_policy_breakdown(request, id, format):
-    return policies_show(request, id, '', _generator("%s.financiacion" % id, format, write_funding_breakdown))
+    return policies_show(request, id, '', _generator("%s.financiacion" % id, format, stream_funding_breakdown))
 
 def funding_programme_breakdown(request, id, format):
-    return programmes_show(request, id, '', _generator("%s.financiacion" % id, format, write_funding_breakdown))
+    return programmes_show(request, id, '', _generator("%s.financiacion" % id, format, stream_funding_breakdown))
 
 def funding_subprogramme_breakdown(request, id, format):
-    return subprogrammes_show(request, id, '', _generator("%s.financiacion" % id, format, write_funding_breakdown))
+    return subprogrammes_show(request, id, '', _generator("%s.financiacion" % id, format, stream_funding_breakdown))
 
 def funding_article_revenues_breakdown(request, id, format):
-    return income_articles_show(request, id, '', _generator("%s.ingresos.financiacion" % id, format, write_funding_breakdown))
+    return income_articles_show(request, id, '', _generator("%s.ingresos.financiacion" % id, format, stream_funding_breakdown))
 
 def funding_article_expenditures_breakdown(request, id, format):
-    return expense_articles_show(request, id, '', _generator("%s.gastos.financiacion" % id, format, write_funding_breakdown))
+    return expense_articles_show(request, id, '', _generator("%s.gastos.financiacion" % id, format, stream_funding_breakdown))
 
 
 #
 # INSTITUTIONAL BREAKDOWN
 #
-def write_institutional_breakdown(c, writer):
+def stream_institutional_breakdown(c, writer):
     field_username = 'Gastos' if c['show_side'] == 'expense' else 'Ingresos'
-    write_header(writer, [u'Año.csv', 'Id Organismo', 'Nombre Organismo', 'Id Departamento', 'Nombre Departamento', 'Presupuesto '+field_username, field_username+' Reales'])
-    for year in sorted(_unique(c['breakdowns']['institutional'].years.values())):
-        for institution_id, institution in c['breakdowns']['institutional'].subtotals.items():
-            write_breakdown_item(writer, year, institution, c['show_side'], [institution_id, None], c['descriptions']['institutional'])
-            for department_id, department in institution.subtotals.items():
-                write_breakdown_item(writer, year, department, c['show_side'], [institution_id, department_id], c['descriptions']['institutional'])
+    yield write_header(writer, [u'Año.csv', 'Id Organismo', 'Nombre Organismo', 'Id Departamento', 'Nombre Departamento', 'Presupuesto '+field_username, field_username+' Reales'])
+    pivot = BreakdownPivot(c['breakdowns']['institutional'], c['show_side'])
+    for institution_id, institution in c['breakdowns']['institutional'].subtotals.items():
+        pivot.add(institution, [institution_id, None], c['descriptions']['institutional'])
+        for department_id, department in institution.subtotals.items():
+            pivot.add(department, [institution_id, department_id], c['descriptions']['institutional'])
+    yield from pivot.write(writer)
 
 def institutional_policy_breakdown(request, id, format):
-    return policies_show(request, id, '', _generator("%s.organica" % id, format, write_institutional_breakdown))
+    return policies_show(request, id, '', _generator("%s.organica" % id, format, stream_institutional_breakdown))
 
 def institutional_programme_breakdown(request, id, format):
-    return programmes_show(request, id, '', _generator("%s.organica" % id, format, write_institutional_breakdown))
+    return programmes_show(request, id, '', _generator("%s.organica" % id, format, stream_institutional_breakdown))
 
 def institutional_subprogramme_breakdown(request, id, format):
-    return subprogrammes_show(request, id, '', _generator("%s.organica" % id, format, write_institutional_breakdown))
+    return subprogrammes_show(request, id, '', _generator("%s.organica" % id, format, stream_institutional_breakdown))
 
 def institutional_article_revenues_breakdown(request, id, format):
-    return income_articles_show(request, id, '', _generator("%s.ingresos.organica" % id, format, write_institutional_breakdown))
+    return income_articles_show(request, id, '', _generator("%s.ingresos.organica" % id, format, stream_institutional_breakdown))
 
 def institutional_article_expenditures_breakdown(request, id, format):
-    return expense_articles_show(request, id, '', _generator("%s.gastos.organica" % id, format, write_institutional_breakdown))
+    return expense_articles_show(request, id, '', _generator("%s.gastos.organica" % id, format, stream_institutional_breakdown))
 
 
 #
 # ENTITIES LISTS
 #
-def write_entities_breakdown(c, field, writer):
+def stream_entities_breakdown(c, field, writer):
     field_username = 'Gastos' if field == 'expense' else 'Ingresos'
-    write_header(writer, [u'Año.csv', 'Entidad', 'Presupuesto '+field_username, field_username+' Reales'])
-    for year in sorted(_unique(c['breakdowns']['economic'].years.values())):
-        for entity_id, entity in c['breakdowns']['economic'].subtotals.items():
-            write_breakdown_item(writer, year, entity, field, [entity_id])
+    yield write_header(writer, [u'Año.csv', 'Entidad', 'Presupuesto '+field_username, field_username+' Reales'])
+    pivot = BreakdownPivot(c['breakdowns']['economic'], field)
+    for entity_id, entity in c['breakdowns']['economic'].subtotals.items():
+        pivot.add(entity, [entity_id])
+    yield from pivot.write(writer)
 
-def write_entities_expenses_breakdown(c, writer):
-    return write_entities_breakdown(c, 'expense', writer)
+def stream_entities_expenses_breakdown(c, writer):
+    return stream_entities_breakdown(c, 'expense', writer)
 
 def entities_expenses(request, level, format):
-    return entities_index(request, get_context(request), level, _generator('gastos_%ss' % level, format, write_entities_expenses_breakdown))
+    return entities_index(request, get_context(request), level, _generator('gastos_%ss' % level, format, stream_entities_expenses_breakdown))
 
-def write_entities_income_breakdown(c, writer):
-    return write_entities_breakdown(c, 'income', writer)
+def stream_entities_income_breakdown(c, writer):
+    return stream_entities_breakdown(c, 'income', writer)
 
 def entities_income(request, level, format):
-    return entities_index(request, get_context(request), level, _generator('ingresos_%ss' % level, format, write_entities_income_breakdown))
+    return entities_index(request, get_context(request), level, _generator('ingresos_%ss' % level, format, stream_entities_income_breakdown))
+
+
+#
+# Until the CSV exports were streamed, the functions writing the content took a writer and
+# wrote everything in one go; now they're generators, yielding after each line, renamed to
+# `stream_*`. Themes may call the old `write_*` functions as plain functions, e.g. from their
+# own content generators, so those are kept, writing the whole content when called.
+#
+def _write_all(stream):
+    def write(*args):
+        for line in stream(*args):
+            pass
+    return write
+
+write_entity_functional_breakdown = _write_all(stream_entity_functional_breakdown)
+write_entity_institutional_breakdown = _write_all(stream_entity_institutional_breakdown)
+write_entity_economic_breakdown = _write_all(stream_entity_economic_breakdown)
+write_entity_economic_expense_breakdown = _write_all(stream_entity_economic_expense_breakdown)
+write_entity_income_breakdown = _write_all(stream_entity_income_breakdown)
+write_entity_payment_breakdown = _write_all(stream_entity_payment_breakdown)
+write_entity_investments_breakdown = _write_all(stream_entity_investments_breakdown)
+write_entity_investment_line_breakdown = _write_all(stream_entity_investment_line_breakdown)
+write_entity_main_investments_breakdown = _write_all(stream_entity_main_investments_breakdown)
+write_policy_monitoring_breakdown = _write_all(stream_policy_monitoring_breakdown)
+write_programme_monitoring_breakdown = _write_all(stream_programme_monitoring_breakdown)
+write_functional_breakdown = _write_all(stream_functional_breakdown)
+write_functional_programme_breakdown = _write_all(stream_functional_programme_breakdown)
+write_economic_breakdown = _write_all(stream_economic_breakdown)
+write_detailed_economic_breakdown = _write_all(stream_detailed_economic_breakdown)
+write_economic_article_breakdown = _write_all(stream_economic_article_breakdown)
+write_economic_article_expense_breakdown = _write_all(stream_economic_article_expense_breakdown)
+write_economic_article_income_breakdown = _write_all(stream_economic_article_income_breakdown)
+write_funding_breakdown = _write_all(stream_funding_breakdown)
+write_institutional_breakdown = _write_all(stream_institutional_breakdown)
+write_entities_breakdown = _write_all(stream_entities_breakdown)
+write_entities_expenses_breakdown = _write_all(stream_entities_expenses_breakdown)
+write_entities_income_breakdown = _write_all(stream_entities_income_breakdown)
 
 
 #
 # Helper code to output any CSV/Excel line
 #
+# The content generators above (`stream_*`) are Python generators: they yield after writing
+# each line, so the CSV output can be sent to the browser as it's produced, instead of building
+# the whole file in memory first. See CSVGenerator.
+#
 def write_header(writer, columns):
-    writer.writerow(map(lambda column: _(column), columns))
+    return writer.writerow(map(lambda column: _(column), columns))
 
 def write_breakdown_item(writer, year, item, field, ids, descriptions=None):
     budget_column_name = str(year)
@@ -410,7 +465,7 @@ def write_breakdown_item(writer, year, item, field, ids, descriptions=None):
     totals = item.total_expense if field == 'expense' else item.total_income
 
     if not totals.get(budget_column_name) and not totals.get(actual_column_name):
-        return
+        return None
 
     values = [year]
 
@@ -423,56 +478,178 @@ def write_breakdown_item(writer, year, item, field, ids, descriptions=None):
     values.append( totals[budget_column_name] / 100.0 if budget_column_name in totals else None )
     values.append( totals[actual_column_name] / 100.0 if actual_column_name in totals else None )
 
-    writer.writerow(values)
+    return writer.writerow(values)
+
+
+# Rearrange the amounts of a breakdown by year, so they can be output one year after the
+# other without going through the whole tree once per year. Nodes are added in the order
+# they should appear within each year, and those with no amounts in a year are skipped.
+class BreakdownPivot:
+    def __init__(self, breakdown, field):
+        self.field = field
+        self.rows = {}
+
+        # Which year and amount (budget or actual) goes in each column, worked out once
+        self.columns = {}
+        for year in _unique(breakdown.years.values()):
+            self.columns[str(year)] = (year, 0)
+            self.columns['actual_'+str(year)] = (year, 1)
+            self.rows[year] = []
+
+    def add(self, item, ids, descriptions=None):
+        totals = item.total_expense if self.field == 'expense' else item.total_income
+
+        amounts = {}
+        for column_name, amount in totals.items():
+            column = self.columns.get(column_name)
+            if column:
+                amounts.setdefault(column[0], [None, None])[column[1]] = amount
+
+        if not amounts:
+            return
+
+        values = []
+        for id in ids:
+            values.append(id)
+            if descriptions!=None:
+                values.append( descriptions.get(id, '') )
+
+        for year, (budget_amount, actual_amount) in amounts.items():
+            if not budget_amount and not actual_amount:
+                continue
+
+            # The original amounts are in cents:
+            self.rows[year].append([year] + values + [
+                budget_amount / 100.0 if budget_amount is not None else None,
+                actual_amount / 100.0 if actual_amount is not None else None
+            ])
+
+    def write(self, writer):
+        for year in sorted(self.rows):
+            for values in self.rows[year]:
+                yield writer.writerow(values)
 
 
 #
 # Helper classes to reuse CSV/Excel generation code
 #
+# Number of lines sent to the browser at a time when streaming CSV files
+CSV_LINES_PER_CHUNK = 500
+
+# Size up to which exports are sent in one go, instead of streamed (Default: 1MB).
+# The page cache skips streamed responses, so only these are cached.
+def get_exports_cacheable_max_size():
+    if hasattr(settings, 'EXPORTS_CACHEABLE_MAX_SIZE'):
+        return settings.EXPORTS_CACHEABLE_MAX_SIZE
+    return 1024 * 1024
+
+# A file-like object keeping the lines written by the CSV writer until they're sent
+class csvBuffer:
+    def __init__(self):
+        self.lines = []
+
+    def write(self, value):
+        self.lines.append(value)
+
+    def flush(self):
+        content = ''.join(self.lines)
+        self.lines = []
+        return content
+
 class CSVGenerator:
     def __init__(self, filename, content_generator):
         self.filename = filename
         self.content_generator = content_generator
 
     def generate_response(self, c):
-        # Create the HttpResponse object with the appropriate CSV header
-        response = HttpResponse(content_type='text/csv; charset=utf-8')
-        response['Content-Disposition'] = 'attachment; filename="%s"' % self.filename
+        # Small files are sent in one go, so they can be cached. Otherwise we stream the file,
+        # sending the lines as they're written, so big exports (e.g. payments, read through
+        # a server-side cursor) don't have to fit in memory.
+        chunks = self._each_chunk(c, translation.get_language())
+        first_chunks = []
+        size = 0
+        for chunk in chunks:
+            first_chunks.append(chunk)
+            size += len(chunk)
+            if size > get_exports_cacheable_max_size():
+                response = StreamingHttpResponse(itertools.chain(first_chunks, chunks),
+                                                    content_type='text/csv; charset=utf-8')
+                break
+        else:
+            response = HttpResponse(''.join(first_chunks), content_type='text/csv; charset=utf-8')
 
-        writer = csv.writer(response)
-        self.content_generator(c, writer)
+        response['Content-Disposition'] = 'attachment; filename="%s"' % self.filename
         return response
 
+    def _each_chunk(self, c, language):
+        # The content is generated after the view has returned, so make sure the
+        # column names are still translated to the language of the request.
+        with translation.override(language):
+            buffer = csvBuffer()
+            writer = csv.writer(buffer)
+
+            # Content generators written as plain functions (e.g. in old themes) just write
+            # everything in one go, so we can only send it at the end.
+            lines = self.content_generator(c, writer) or []
+            for i, line in enumerate(lines):
+                # Send the header straight away, and then the lines in small batches
+                if i == 0 or len(buffer.lines) >= CSV_LINES_PER_CHUNK:
+                    yield buffer.flush()
+            if buffer.lines:
+                yield buffer.flush()
+
+# Maximum number of rows in an Excel worksheet. Bigger exports continue in a new sheet.
+XLSX_MAX_ROWS = 1048576
+
 class worksheetWrapper:
-    def __init__(self, worksheet):
-        self.worksheet = worksheet
+    def __init__(self, workbook):
+        self.workbook = workbook
+        self.worksheet = workbook.create_sheet()
         self.current_row = 1
 
     def writerow(self, values):
-        column = 1
-        for value in values:
-            self.worksheet.cell(column=column, row=self.current_row, value=value)
-            column += 1
+        if self.current_row > XLSX_MAX_ROWS:
+            self.worksheet = self.workbook.create_sheet()
+            self.current_row = 1
+
+        self.worksheet.append(list(values))
         self.current_row += 1
 
+# Size up to which the Excel files are kept in memory before going to disk (Default: 10MB)
+def get_xlsx_max_memory_size():
+    if hasattr(settings, 'XLSX_EXPORT_MAX_MEMORY_SIZE'):
+        return settings.XLSX_EXPORT_MAX_MEMORY_SIZE
+    return 10 * 1024 * 1024
+
 class XLSXGenerator:
     def __init__(self, filename, content_generator):
         self.filename = filename
         self.content_generator = content_generator
 
     def generate_response(self, c):
-        workbook = Workbook()
-        worksheet = workbook.worksheets[0]
-        self.content_generator(c, worksheetWrapper(worksheet))
-
-        # See https://stackoverflow.com/a/58351964
-        with NamedTemporaryFile() as tmp:
-            workbook.save(tmp.name)
-            tmp.seek(0)
-
-            response = HttpResponse(tmp.read(), content_type='application/ms-excel; charset=utf-8')
-            response['Content-Disposition'] = 'attachment; filename="%s"' % self.filename
-            return response
+        # We use a write-only workbook, where rows are appended as they're generated and
+        # written out to a temporary file by openpyxl, instead of keeping every cell in memory.
+        # The finished (compressed) file is then kept in memory if it's small enough, or on
+        # disk otherwise (see XLSX_EXPORT_MAX_MEMORY_SIZE), and sent to the browser in chunks.
+        # So, memory use doesn't depend on the number of rows, although, unlike CSV files,
+        # the whole file needs to be generated before the download can start. Small files
+        # are sent in one go instead, so they can be cached, see `get_exports_cacheable_max_size`.
+        workbook = Workbook(write_only=True)
+        for line in (self.content_generator(c, worksheetWrapper(workbook)) or []):
+            pass
+
+        file = SpooledTemporaryFile(max_size=get_xlsx_max_memory_size())
+        workbook.save(file)
+        size = file.tell()
+        file.seek(0)
+
+        if size <= get_exports_cacheable_max_size():
+            response = HttpResponse(file.read(), content_type='application/ms-excel; charset=utf-8')
+        else:
+            response = FileResponse(file, content_type='application/ms-excel; charset=utf-8')
+            response['Content-Length'] = size
+        response['Content-Disposition'] = 'attachment; filename="%s"' % self.filename
+        return response
 
 def _generator(filename, format, content_generator):
     try:
@@ -481,9 +658,8 @@ def _generator(filename, format, content_generator):
         raise ValueError("Provided format is not valid: {}. valid values are [csv, xlsx]".format(format))
 
 # Remove duplicates from list, maintaining order
-# See https://stackoverflow.com/a/37163210
 def _unique(list):
-    return reduce(lambda l, x: l.append(x) or l if x not in l else l, list, [])
+    return [*dict.fromkeys(list)]
 
 
 GENERATORS = {
@@ -1,8 +1,8 @@
 # -*- coding: UTF-8 -*-
 
-from budget_app.models import BudgetBreakdown, Entity, EconomicCategory
+from budget_app.models import BudgetBreakdown, Entity, EconomicCategory, STAGING_ENTITY_LEVEL
 from .policies_helpers import policies_show_helper, programmes_show_helper, articles_show_helper
-from .payments import payments_helper, payment_search_helper
+from .payments import payments_helper, payment_search_helper, payment_payees_helper
 from .helpers import *
 
 def entities_policies(request, id, render_callback=None):
@@ -30,7 +30,8 @@ def entities_show_helper(request, c, entity, render_callback=None):
                                 [c['breakdowns']['economic']],
                                 get_financial_breakdown_callback(c, \
                                     [c['breakdowns']['functional'], \
-                                    c['breakdowns']['institutional']]) )
+                                    c['breakdowns']['institutional']]),
+                                aggregated=True )
     else:
         # Small entities have a varying level of detail: often we don't have any breakdown below
         # chapter, so we have to start there. Also, to be honest, the heading level doesn't add
@@ -44,9 +45,11 @@ def entities_show_helper(request, c, entity, render_callback=None):
                                 [],
                                 get_financial_breakdown_callback(c, \
                                     [c['breakdowns']['functional'], \
-                                    c['breakdowns']['institutional']]) )
+                                    c['breakdowns']['institutional']]),
+                                aggregated=True )
         get_budget_breakdown(   "e.id = %s and ec.chapter <> 'X'", [ entity.id ],
-                                [ c['breakdowns']['economic'] ] )
+                                [ c['breakdowns']['economic'] ],
+                                aggregated=True )
 
     # Additional data needed by the view
     populate_level(c, entity.level)
@@ -112,9 +115,15 @@ def entities_payments_search(request, id, render_callback=None):
     return payment_search_helper(request, c, entity, render_callback)
 
 
+def entities_payment_payees(request, id):
+    c = get_context(request)
+    entity = _fetch_entity(c, id)
+    return payment_payees_helper(request, c, entity)
+
+
 def _fetch_entity(c, id):
     # Retrieve the entity to display
-    entity = Entity.objects.filter(code=id).first()
+    entity = Entity.objects.filter(code=id).exclude(level=STAGING_ENTITY_LEVEL).first()
     set_title(c, entity.name)
 
     # Set the entity id and name
@@ -12,7 +12,7 @@ def investments(request, render_callback=None):
 
     # Get the investments breakdown
     query = "e.id = %s"
-    investments = Investment.objects.each_denormalized(query, [ entity.id ])
+    investments = Investment.objects.each_denormalized(query, [ entity.id ]).iterator()
     c['area_breakdown'] = BudgetBreakdown(['area'])
     c['special_investments_area_breakdown'] = BudgetBreakdown(['area'])
     c['no_area_breakdown'] = BudgetBreakdown(['area'])
@@ -58,7 +58,7 @@ def investments_show(request, id, title, render_callback=None):
 
     # Get the investments breakdown
     query = "gc.code = %s and e.id = %s"
-    investments = Investment.objects.each_denormalized(query, [ id, entity.id ])
+    investments = Investment.objects.each_denormalized(query, [ id, entity.id ]).iterator()
     c['area_breakdown'] = BudgetBreakdown(['policy', 'description'])
     c['special_investments_area_breakdown'] = BudgetBreakdown(['policy', 'description'])
     for item in investments:
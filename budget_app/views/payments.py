@@ -3,11 +3,13 @@
 import json
 
 from django.conf import settings
-from django.http import HttpResponse
+from django.http import HttpResponse, JsonResponse
 from django.utils.translation import ugettext as _
-from budget_app.models import BudgetBreakdown, Payment
+from budget_app.models import BudgetBreakdown, Payment, PayeeSummary
 from .helpers import *
 
+PAYEES_PAGE_LENGTH = 100
+
 # Auxiliary class needed to access arbitrary attributes as objects.
 # See https://stackoverflow.com/a/2827664
 class MockPayment(object):
@@ -20,9 +22,9 @@ def payments(request, render_callback=None):
     return payments_helper(request, c, main_entity, render_callback)
 
 def payments_helper(request, c, entity, render_callback=None):
-    # Retrieve the information needed for the search form: years, areas, departments and payees
+    # Retrieve the information needed for the search form: years, areas and departments.
+    # Payees can be many, so they're requested as needed (see `payment_payees`).
     __set_year_range(c, entity)
-    c['payees'] = Payment.objects.get_payees(entity)
     c['areas'] = Payment.objects.get_areas(entity)
     # For the department dropdown+tab to make sense, we need to have institutional codes,
     # and we need them to be consistent along the years.
@@ -102,7 +104,7 @@ def payment_search_helper(request, c, entity, render_callback=None):
         active_filters.append('fiscalId')
 
     if ( description != '' ):
-        query += " AND to_tsvector('"+settings.SEARCH_CONFIG+"',p.description) @@ plainto_tsquery('"+settings.SEARCH_CONFIG+"',%s)"
+        query += " AND p.description_search_vector @@ plainto_tsquery('"+settings.SEARCH_CONFIG+"',%s)"
         query_arguments.append(description)
 
     # At this point we check whether there's actually any search criteria. If not, displaying
@@ -120,7 +122,7 @@ def payment_search_helper(request, c, entity, render_callback=None):
             query_arguments.extend([from_year, to_year])
 
         # ...and query the database, finally.
-        c['payments'] = Payment.objects.each_denormalized(query, query_arguments)
+        c['payments'] = Payment.objects.each_denormalized(query, query_arguments).iterator()
 
         # Populate the breakdowns, unless we're rendering CSV/Excels, not needed then
         if not render_callback:
@@ -129,6 +131,29 @@ def payment_search_helper(request, c, entity, render_callback=None):
     return render(c, render_callback, 'payments/search.json', content_type='application/json')
 
 
+def payment_payees(request):
+    c = get_context(request)
+    main_entity = get_main_entity(c)
+    return payment_payees_helper(request, c, main_entity)
+
+# Return a page of the payees containing the given text, for the search form dropdown
+def payment_payees_helper(request, c, entity):
+    query = request.GET.get('q', '')
+    try:
+        page = max(int(request.GET.get('page', 1)), 1)
+    except ValueError:
+        page = 1
+
+    offset = (page - 1) * PAYEES_PAGE_LENGTH
+    payees = list(PayeeSummary.objects.search(entity, query) \
+                    .values_list('payee', flat=True)[offset:offset+PAYEES_PAGE_LENGTH+1])
+
+    return JsonResponse({
+        'results': payees[:PAYEES_PAGE_LENGTH],
+        'more': len(payees) > PAYEES_PAGE_LENGTH
+    })
+
+
 def __populate_summary_breakdowns(c, entity, from_year, to_year):
     payments_count = 0
     total_amount = 0
@@ -22,7 +22,8 @@ def policies_show_helper(request, c, entity, id, title, render_callback=None):
                                 c['breakdowns']['economic'],
                                 c['breakdowns']['funding'],
                                 c['breakdowns']['institutional']
-                            ])
+                            ],
+                            aggregated=True)
 
     # Add monitoring information, if needed
     if (c['show_monitoring']):
@@ -0,0 +1,93 @@
+# -*- coding: UTF-8 -*-
+
+import json
+import os
+import os.path
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse
+from django.utils.cache import get_conditional_response
+
+from budget_app.models import DataVersion, GLOBAL_DATA_VERSION
+
+
+# The CSV/Excel files are expensive to generate, since we need to calculate the same
+# breakdowns as the corresponding page, but they only change when new data is loaded.
+# So the `build_exports` command renders them in advance and stores them in EXPORTS_PATH,
+# named after a hash of their content, together with a manifest mapping each URL path to
+# its file. Downloads are then served straight from disk (see PrebuiltExportsMiddleware),
+# as long as the manifest was built for the current version of the data.
+MANIFEST_FILENAME = 'manifest.json'
+
+def get_exports_path():
+    if hasattr(settings, 'EXPORTS_PATH'):
+        return settings.EXPORTS_PATH
+    return None
+
+
+# Store a new manifest. We write a temporary file and then move it, so the web processes
+# never read a half-written manifest.
+def write_manifest(version, files):
+    manifest_path = os.path.join(get_exports_path(), MANIFEST_FILENAME)
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'version': version, 'files': files}, f)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+# The manifest is read once per process, and again only when the file changes
+_manifest = {'mtime': None, 'content': None}
+
+def read_manifest():
+    try:
+        mtime = os.stat(os.path.join(get_exports_path(), MANIFEST_FILENAME)).st_mtime
+    except (OSError, TypeError):
+        return None
+
+    if mtime != _manifest['mtime']:
+        with open(os.path.join(get_exports_path(), MANIFEST_FILENAME), 'r', encoding='utf-8') as f:
+            _manifest['content'] = json.load(f)
+        _manifest['mtime'] = mtime
+    return _manifest['content']
+
+
+# Return the response for a pre-rendered export, or None if there's no (up-to-date) file
+# for the given request, in which case the export is generated as usual.
+def get_prebuilt_export_response(request):
+    # Only plain downloads are pre-rendered, not filtered ones (e.g. payment searches)
+    if request.method not in ('GET', 'HEAD') or request.META.get('QUERY_STRING'):
+        return None
+
+    manifest = read_manifest()
+    if not manifest:
+        return None
+
+    export = manifest['files'].get(request.path_info)
+    if not export:
+        return None
+
+    # Ignore files rendered before the data was last changed
+    if manifest['version'] != DataVersion.objects.cached(GLOBAL_DATA_VERSION):
+        return None
+
+    # The file name is the hash of its content, so it's a good ETag
+    etag = '"%s"' % export['file'].split('.')[0]
+    response = get_conditional_response(request, etag=etag)
+    if response:
+        return response
+
+    # Let the web server send the file, if it knows how (X-Sendfile, X-Accel-Redirect...)
+    file_path = os.path.join(get_exports_path(), export['file'])
+    if hasattr(settings, 'EXPORTS_SENDFILE_HEADER') and settings.EXPORTS_SENDFILE_HEADER:
+        response = HttpResponse(content_type=export['content_type'])
+        if hasattr(settings, 'EXPORTS_SENDFILE_URL') and settings.EXPORTS_SENDFILE_URL:
+            response[settings.EXPORTS_SENDFILE_HEADER] = settings.EXPORTS_SENDFILE_URL.rstrip('/') + '/' + export['file']
+        else:
+            response[settings.EXPORTS_SENDFILE_HEADER] = os.path.abspath(file_path)
+    else:
+        try:
+            response = FileResponse(open(file_path, 'rb'), content_type=export['content_type'])
+        except OSError:
+            return None
+
+    response['Content-Disposition'] = export['content_disposition']
+    response['ETag'] = etag
+    return response
@@ -1,5 +1,11 @@
+import hashlib
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from django.core.cache import cache
 from django.core.paginator import EmptyPage
 from django.conf import settings
+from django.db import close_old_connections, connection
 from budget_app.models import *
 from .helpers import *
 from .paginator import DiggPaginator as Paginator
@@ -28,76 +34,173 @@ def search(request):
     # Get search results
     c['years'] = map(str, Budget.objects.get_years(get_main_entity(c).id))
 
-    c['terms'] = list(GlossaryTerm.objects.search(c['query'], c['LANGUAGE_CODE']))
+    # Many people search for the same few things, so we cache the results. Different ways
+    # of writing the same search (accents, plurals...) share the same cached results.
+    # Searches made only of stop words (or empty) can't match anything, no need to go on.
+    normalized_query = _normalize_query(c['query'])
+    if not normalized_query:
+        results = _search(c['query'], year, budget, c['LANGUAGE_CODE'], c['page'], run=False)
+    else:
+        cache_key = _get_cache_key(normalized_query, c['selected_year'], c['LANGUAGE_CODE'], c['page'])
+        results = cache.get(cache_key)
+        if results is None:
+            results = _search(c['query'], year, budget, c['LANGUAGE_CODE'], c['page'])
+            cache.set(cache_key, results)
+    c.update(results)
 
-    if hasattr(settings, 'SEARCH_ENTITIES') and settings.SEARCH_ENTITIES:
-        c['entities'] = list(Entity.objects.search(c['query']))
-        c['show_entity_names'] = True
+    # XXX: Note we only have top-level descriptions. Beware on the view not to use
+    # the wrong descriptions. We should fetch the descriptions from the DB together with
+    # the results if needed.
+    populate_descriptions(c)
 
-    if hasattr(settings, 'SHOW_SECTION_PAGES') and settings.SHOW_SECTION_PAGES:
-        c['departments'] = list(InstitutionalCategory.objects.search_departments(c['query'], budget))
+    # Extra info
+    c['formatter'] = add_thousands_separator
+    c['main_entity_level'] = settings.MAIN_ENTITY_LEVEL
+
+    return render_response('search/index.html', c)
 
-    all_items = list(BudgetItem.objects.search(c['query'], year, c['LANGUAGE_CODE'], c['page']))
-    try:
-        c['items'] = Paginator(all_items, PAGE_LENGTH, body=6, padding=2).page(c['page'])
-    except EmptyPage:
-        pass
 
+# The results of a search, as a dictionary to be added to the view context. If `run` is
+# false the searches are not run, and come back empty, except for the glossary terms,
+# all of which are returned for an empty query.
+def _search(query, year, budget, language, page, run=True):
+    queries = {
+        'terms': lambda: list(GlossaryTerm.objects.search(query, language)),
+        # Items and payments can be many, so we fetch only the page being displayed
+        'items': lambda: _paginate(BudgetItem.objects.search(query, year, language, page), page),
+        'articles': lambda: list(EconomicCategory.objects.search_articles(query, budget)),
+        'headings': lambda: list(EconomicCategory.objects.search_headings(query, budget)),
+        # XXX: We're searching only in top-level entity, the other ones are spotty,
+        # not sure it's worth the effort; plus the search results UX is complicated.
+        'policies': lambda: list(FunctionalCategory.objects.search_policies(query, budget)),
+        'programmes': lambda: list(FunctionalCategory.objects.search_programmes(query, budget)),
+    }
+    if hasattr(settings, 'SEARCH_ENTITIES') and settings.SEARCH_ENTITIES:
+        queries['entities'] = lambda: list(Entity.objects.search(query))
+    if hasattr(settings, 'SHOW_SECTION_PAGES') and settings.SHOW_SECTION_PAGES:
+        queries['departments'] = lambda: list(InstitutionalCategory.objects.search_departments(query, budget))
     if hasattr(settings, 'SHOW_PAYMENTS') and settings.SHOW_PAYMENTS:
-        all_payments = list(Payment.objects.search(c['query'], year, c['LANGUAGE_CODE']))
-        try:
-            c['payments'] = Paginator(all_payments, PAGE_LENGTH, body=6, padding=2).page(c['page'])
-        except EmptyPage:
-            pass
+        queries['payments'] = lambda: _paginate(Payment.objects.search(query, year, language), page)
+
+    if run:
+        r = _run_queries(queries)
+    else:
+        r = dict((name, (None, 0, False) if name in ['items', 'payments'] else []) for name in queries)
+        if not query:
+            r['terms'] = queries['terms']()
+
+    results = {
+        'terms': r['terms']
+    }
+
+    if 'entities' in r:
+        results['entities'] = r['entities']
+        results['show_entity_names'] = True
+
+    if 'departments' in r:
+        results['departments'] = r['departments']
+
+    items, items_count, items_estimated = r['items']
+    if items:
+        results['items'] = items
+
+    if r.get('payments') and r['payments'][0]:
+        results['payments'] = r['payments'][0]
+
+    # Large result sets are not counted exactly, see `get_search_count_limit`
+    results['is_estimated_count'] = items_estimated or (r.get('payments') and r['payments'][2]) or False
 
     # Consolidate articles and headings search results, to avoid duplicates.
-    articles = list(EconomicCategory.objects.search_articles(c['query'], budget))
-    headings = list(EconomicCategory.objects.search_headings(c['query'], budget))
-    c['income_articles_ids'] = list(set( article.uid() for article in articles if not article.expense ))
-    c['expense_articles_ids'] = list(set( article.uid() for article in articles if article.expense ))
-    c['headings_per_income_article'] = {}
-    c['headings_per_expense_article'] = {}
-    for heading in headings:
-        s = c['headings_per_expense_article'] if heading.expense else c['headings_per_income_article']
+    results['income_articles_ids'] = list(set( article.uid() for article in r['articles'] if not article.expense ))
+    results['expense_articles_ids'] = list(set( article.uid() for article in r['articles'] if article.expense ))
+    results['headings_per_income_article'] = {}
+    results['headings_per_expense_article'] = {}
+    for heading in r['headings']:
+        s = results['headings_per_expense_article'] if heading.expense else results['headings_per_income_article']
         if not s.get(heading.article, None):
             s[heading.article] = set()
         s[heading.article].add(heading.heading)
 
     # Consolidate policies and programmes search results, to avoid duplicates
-    # XXX: We're searching only in top-level entity, the other ones are spotty,
-    # not sure it's worth the effort; plus the search results UX is complicated.
-    policies = list(FunctionalCategory.objects.search_policies(c['query'], budget))
-    programmes = list(FunctionalCategory.objects.search_programmes(c['query'], budget))
-    c['policies_ids'] = list(set(policy.uid() for policy in policies))
-    c['programmes_per_policy'] = {}
-    for programme in programmes:
-        if not c['programmes_per_policy'].get(programme.policy, None):
-            c['programmes_per_policy'][programme.policy] = set()
-        c['programmes_per_policy'][programme.policy].add(programme.programme)
-
-    # XXX: Note we only have top-level descriptions. Beware on the view not to use
-    # the wrong descriptions. We should fetch the descriptions from the DB together with
-    # the results if needed.
-    populate_descriptions(c)
+    results['policies_ids'] = list(set(policy.uid() for policy in r['policies']))
+    results['programmes_per_policy'] = {}
+    for programme in r['programmes']:
+        if not results['programmes_per_policy'].get(programme.policy, None):
+            results['programmes_per_policy'][programme.policy] = set()
+        results['programmes_per_policy'][programme.policy].add(programme.programme)
 
     # Count the results
-    c['results_size'] = len(c['terms']) + \
-                        (len(c['entities']) if 'entities' in c else 0) + \
-                        (len(c['departments']) if 'departments' in c else 0) + \
-                        len(c['policies_ids']) + \
-                        len(c['income_articles_ids']) + \
-                        len(c['expense_articles_ids']) + \
-                        len(all_items) + \
-                        (len(all_payments) if 'payments' in c else 0)
-    for headings in c['headings_per_income_article'].values():
-        c['results_size'] += len(headings)
-    for headings in c['headings_per_expense_article'].values():
-        c['results_size'] += len(headings)
-    for programmes in c['programmes_per_policy'].values():
-        c['results_size'] += len(programmes)
-
-    # Extra info
-    c['formatter'] = add_thousands_separator
-    c['main_entity_level'] = settings.MAIN_ENTITY_LEVEL
-
-    return render_response('search/index.html', c)
+    results['results_size'] = len(results['terms']) + \
+                        (len(results['entities']) if 'entities' in results else 0) + \
+                        (len(results['departments']) if 'departments' in results else 0) + \
+                        len(results['policies_ids']) + \
+                        len(results['income_articles_ids']) + \
+                        len(results['expense_articles_ids']) + \
+                        items_count + \
+                        (results['payments'].paginator.count if 'payments' in results else 0)
+    for headings in results['headings_per_income_article'].values():
+        results['results_size'] += len(headings)
+    for headings in results['headings_per_expense_article'].values():
+        results['results_size'] += len(headings)
+    for programmes in results['programmes_per_policy'].values():
+        results['results_size'] += len(programmes)
+
+    return results
+
+# Return the requested page of results, if it exists, the total number of results and
+# whether that number is just an estimate
+def _paginate(results, page):
+    try:
+        page = Paginator(results, PAGE_LENGTH, body=6, padding=2).page(page)
+    except EmptyPage:
+        page = None
+    return (page, results.count(), results.is_estimated_count)
+
+# Run the given search queries, concurrently if possible (see SEARCH_THREADS), and
+# return their results
+def _run_queries(queries):
+    executor = _get_executor()
+    if executor is None:
+        return dict((name, query()) for name, query in queries.items())
+
+    futures = dict((name, executor.submit(_run_query, query)) for name, query in queries.items())
+    return dict((name, future.result()) for name, future in futures.items())
+
+# The threads running the searches are shared by all the requests of the process, so they're
+# not started for every search. Each of them has its own database connection, which is looked
+# after as Django does for requests, i.e. closed if unusable or older than CONN_MAX_AGE.
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    threads = settings.SEARCH_THREADS if hasattr(settings, 'SEARCH_THREADS') else 4
+    if threads <= 1:
+        return None
+
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix='search')
+    return _executor
+
+def _run_query(query):
+    close_old_connections()
+    try:
+        return query()
+    finally:
+        close_old_connections()
+
+# Let the database normalize the query the same way it's going to do when searching, i.e.
+# remove accents, stop words, suffixes..., depending on the SEARCH_CONFIG
+def _normalize_query(query):
+    with connection.cursor() as cursor:
+        cursor.execute("select plainto_tsquery('"+settings.SEARCH_CONFIG+"',%s)::text", [query])
+        return cursor.fetchone()[0]
+
+# The cache key for a search, given its normalized query. It includes the data version, so
+# results are refreshed after a load.
+def _get_cache_key(normalized_query, year, language, page):
+    key = '%s|%s|%s|%s' % (normalized_query, year, language, page)
+    return 'search_%s_v%s' % (hashlib.sha1(key.encode('utf-8')).hexdigest(),
+                                DataVersion.objects.cached(GLOBAL_DATA_VERSION))
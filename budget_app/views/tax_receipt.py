@@ -1,7 +1,7 @@
 # -*- coding: UTF-8 -*-
 
 from django.utils.translation import ugettext as _
-from budget_app.models import Budget, BudgetBreakdown, BudgetItem, Entity
+from budget_app.models import Budget, BudgetBreakdown, BudgetCube, Entity
 from .helpers import *
 
 
@@ -16,7 +16,7 @@ def tax_receipt(request):
 
     # Get the budget breakdown
     c['breakdown'] = BudgetBreakdown(['policy', 'programme'])
-    for item in BudgetItem.objects.each_denormalized("b.id = %s", [c['latest_budget'].id]):
+    for item in BudgetCube.objects.each_aggregated_tuple("b.id = %s", [c['latest_budget'].id]):
         if c['include_financial_chapters'] or not item.is_financial():
             c['breakdown'].add_item(c['latest_budget'].name(), item)
 
@@ -105,7 +105,8 @@ def entities_index(request, c, level, render_callback=None):
     get_budget_breakdown(   "e.level = %s and ec.chapter <> 'X'", [ level ],
                             [
                                 c['breakdowns']['economic']
-                            ])
+                            ],
+                            aggregated=True)
 
     # Additional data needed by the view
     populate_level(c, level)
@@ -131,13 +132,15 @@ def entities_compare(request, c, entity_left, entity_right):
     get_budget_breakdown(   "e.name = %s and ec.chapter <> 'X'", [ entity_left.name ],
                             [
                                 c['breakdowns']['economic_left']
-                            ])
+                            ],
+                            aggregated=True)
 
     c['breakdowns']['economic_right'] = BudgetBreakdown(['chapter', 'article'])
     get_budget_breakdown(   "e.name = %s and ec.chapter <> 'X'", [ entity_right.name ],
                             [
                                 c['breakdowns']['economic_right']
-                            ])
+                            ],
+                            aggregated=True)
 
     # Additional data needed by the view
     populate_level(c, entity_left.level)
@@ -169,7 +172,8 @@ def entities_show_policy(request, c, entity, id, title, render_callback=None):
                             [
                                 c['breakdowns']['functional'],
                                 c['breakdowns']['economic']
-                            ])
+                            ],
+                            aggregated=True)
 
     # Additional data needed by the view
     show_side = 'expense'
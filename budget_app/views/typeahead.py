@@ -0,0 +1,197 @@
+# -*- coding: UTF-8 -*-
+
+import re
+import sys
+import threading
+import unicodedata
+
+from array import array
+from bisect import bisect_left
+
+from django.conf import settings
+from django.db import connection
+from django.http import JsonResponse
+from django.urls import reverse, NoReverseMatch
+from django.utils import translation
+from django.utils.http import urlencode
+from django.utils.text import slugify
+from budget_app.models import DataVersion, GLOBAL_DATA_VERSION, Entity, FunctionalCategory, GlossaryTerm, PayeeSummary
+from .helpers import *
+
+
+# Maximum number of suggestions returned (Default: 10). Clients can ask for less, not more.
+def get_typeahead_max_results():
+    if hasattr(settings, 'TYPEAHEAD_MAX_RESULTS'):
+        return settings.TYPEAHEAD_MAX_RESULTS
+    return 10
+
+# Longer queries are truncated: no name in the index is that long anyway
+MAX_QUERY_LENGTH = 100
+
+
+# Lowercase and remove accents, so 'Educación' can be found typing 'educa'
+def normalize(text):
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+_word_start = re.compile(r'(?<!\w)\w', re.UNICODE)
+
+
+# A compact prefix index for the suggestions: every suggestion is indexed under the
+# normalized text starting at each of its words, so 'madrid' finds 'Ayuntamiento de Madrid'.
+# The keys are kept in a sorted list, so the matches for a prefix are the consecutive keys
+# from the position found using binary search.
+#
+# There may be hundreds of thousands of suggestions (payees mostly), so the index is kept
+# small: keys are cut to the longest prefix we may be asked for, and interned, since many
+# of them (the last words of names, mostly) are repeated; and suggestions are stored as
+# tuples, and only turned into dictionaries when returned.
+SUGGESTION_FIELDS = ('type', 'label', 'url')
+
+class PrefixIndex:
+    def __init__(self, suggestions):
+        self.suggestions = [tuple(suggestion.get(field) for field in SUGGESTION_FIELDS) for suggestion in suggestions]
+
+        keys = []
+        for position, suggestion in enumerate(suggestions):
+            text = normalize(suggestion['label'])
+            for word in _word_start.finditer(text):
+                keys.append((sys.intern(text[word.start():word.start()+MAX_QUERY_LENGTH]), position))
+        keys.sort()
+
+        self.keys = [key for key, position in keys]
+        self.positions = array('I', [position for key, position in keys])
+
+    def lookup(self, prefix, limit):
+        # Normalizing may change the length of the query, so make sure it's not longer than the keys
+        prefix = normalize(prefix).strip()[:MAX_QUERY_LENGTH]
+        if not prefix:
+            return []
+
+        results = []
+        found = set()
+        i = bisect_left(self.keys, prefix)
+        while i < len(self.keys) and len(results) < limit and self.keys[i].startswith(prefix):
+            position = self.positions[i]
+            if position not in found:
+                found.add(position)
+                results.append(dict(zip(SUGGESTION_FIELDS, self.suggestions[position])))
+            i += 1
+        return results
+
+
+# There's one index per language in every process. They're built when the process starts
+# (see `build_prefix_indexes`), so no visitor has to wait for them, and again after the data
+# changes, like the descriptions (see Budget.get_all_descriptions). While an index is being
+# rebuilt, in the background, the previous one is still used.
+_indexes = {}
+_indexes_lock = threading.Lock()
+_rebuilding = set()
+
+def get_prefix_index(language):
+    version = DataVersion.objects.cached(GLOBAL_DATA_VERSION)
+
+    cached = _indexes.get(language)
+    if cached is None:
+        # Not built on startup, we have no choice but to wait
+        with _indexes_lock:
+            cached = _indexes.get(language)
+            if cached is None:
+                cached = _build_prefix_index(language, version)
+    elif cached[0] != version:
+        with _indexes_lock:
+            if language not in _rebuilding:
+                _rebuilding.add(language)
+                threading.Thread(target=_rebuild_prefix_index, args=(language, version), daemon=True).start()
+    return cached[1]
+
+def _build_prefix_index(language, version):
+    with translation.override(language):
+        cached = (version, PrefixIndex(_get_suggestions(language)))
+    _indexes[language] = cached
+    return cached
+
+def _rebuild_prefix_index(language, version):
+    try:
+        _build_prefix_index(language, version)
+    finally:
+        _rebuilding.discard(language)
+        connection.close()   # The thread's own connection
+
+# Build the indexes for all the site languages. Called when the web process starts, see wsgi.py.
+def build_prefix_indexes():
+    version = DataVersion.objects.cached(GLOBAL_DATA_VERSION)
+    if len(settings.LANGUAGES) > 1:
+        languages = [language for language, name in settings.LANGUAGES]
+    else:
+        languages = [settings.LANGUAGE_CODE]
+
+    with _indexes_lock:
+        for language in languages:
+            _build_prefix_index(language, version)
+
+# The page of a policy or programme. Its title goes in the URL, unless it has none (the
+# description may be empty, or made only of symbols). Codes the URL patterns don't accept
+# get no link, rather than breaking the whole index.
+def _get_category_url(url_name, code, description):
+    title = slugify(description)
+    try:
+        return reverse(url_name, args=[code, title] if title else [code])
+    except NoReverseMatch:
+        return None
+
+def _get_suggestions(language):
+    suggestions = []
+    main_entity = get_main_entity({'LANGUAGE_CODE': language})
+
+    for term in GlossaryTerm.objects.search('', language):
+        suggestions.append({'type': 'term', 'label': term.title, 'url': reverse('glossary')+'?'+urlencode({'q': term.title})})
+
+    if hasattr(settings, 'SEARCH_ENTITIES') and settings.SEARCH_ENTITIES:
+        for entity in Entity.objects.filter(language=language).order_by('name'):
+            try:
+                if entity.level == settings.MAIN_ENTITY_LEVEL:
+                    url = reverse('policies')
+                else:
+                    url = reverse('counties_show' if entity.level=='comarca' else 'towns_show', args=[entity.slug])
+            except NoReverseMatch:  # Not all themes have pages for secondary entities
+                url = None
+            suggestions.append({'type': 'entity', 'label': entity.name, 'url': url})
+
+    if main_entity:
+        # Descriptions can change along the years: keep the latest one
+        categories = FunctionalCategory.objects.filter(budget__entity=main_entity).order_by('budget__year')
+        policies = dict(categories.filter(policy__isnull=False, function__isnull=True) \
+                                    .exclude(area='X').exclude(policy='XX') \
+                                    .values_list('policy', 'description'))
+        for policy, description in sorted(policies.items()):
+            suggestions.append({'type': 'policy', 'label': description, 'url': _get_category_url('policies_show', policy, description)})
+
+        programmes = dict(categories.filter(programme__isnull=False, subprogramme__isnull=True) \
+                                    .exclude(programme='XXXX') \
+                                    .values_list('programme', 'description'))
+        for programme, description in sorted(programmes.items()):
+            suggestions.append({'type': 'programme', 'label': description, 'url': _get_category_url('programmes_show', programme, description)})
+
+        if hasattr(settings, 'SHOW_PAYMENTS') and settings.SHOW_PAYMENTS:
+            payments_url = reverse('payments')
+            for payee in PayeeSummary.objects.search(main_entity).values_list('payee', flat=True):
+                suggestions.append({'type': 'payee', 'label': payee, 'url': payments_url+'#'+urlencode({'payee': payee})})
+
+    return suggestions
+
+
+def typeahead(request):
+    c = get_context(request)
+    query = request.GET.get('q', '')[:MAX_QUERY_LENGTH]
+
+    limit = get_typeahead_max_results()
+    try:
+        limit = max(min(int(request.GET.get('limit', limit)), limit), 0)
+    except ValueError:
+        pass
+
+    return JsonResponse({
+        'query': query,
+        'results': get_prefix_index(c['LANGUAGE_CODE']).lookup(query, limit)
+    })
@@ -1,5 +1,10 @@
+from django.middleware.cache import UpdateCacheMiddleware, FetchFromCacheMiddleware
 from django.utils.deprecation import MiddlewareMixin
 
+from budget_app.models import DataVersion, GLOBAL_DATA_VERSION
+from budget_app.views.prebuilt_exports import get_prebuilt_export_response
+
+import copy
 import re
 
 # Use Django 1.10 transitional Mixin.
@@ -35,3 +40,37 @@ class RemoveCacheBreakingHeadersMiddleware(MiddlewareMixin):
         for arg in ['mc_cid', 'mc_eid', 'fbclid', 'fbaid', 'utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content']:
             q.pop(arg, None)
         request.META['QUERY_STRING'] = q.urlencode()
+
+
+# Cache middleware including the data version in the cache key, so pages cached before
+# the data was last changed by a management command are not served anymore. This way we
+# don't need to clear the whole cache after loading data.
+# The version is read once per request, and kept in it, so a page rendered while the data
+# was being changed is stored under the version it was looked up with, not the new one.
+# It's read from memory most of the time (see `DataVersionManager.cached`), so pages served
+# from the cache don't touch the database, and are refreshed a few seconds after a load.
+class DataVersionCacheKeyMixin:
+    # Return a copy of this middleware with the data version of the request in the key
+    # prefix. The middleware is shared by all the requests, so we can't change it.
+    def _for_request(self, request):
+        if not hasattr(request, '_data_version'):
+            request._data_version = DataVersion.objects.cached(GLOBAL_DATA_VERSION)
+        middleware = copy.copy(self)
+        middleware.key_prefix = '%s.v%s' % (self.key_prefix, request._data_version)
+        return middleware
+
+class VersionedUpdateCacheMiddleware(DataVersionCacheKeyMixin, UpdateCacheMiddleware):
+    def process_response(self, request, response):
+        return super(VersionedUpdateCacheMiddleware, self._for_request(request)).process_response(request, response)
+
+class VersionedFetchFromCacheMiddleware(DataVersionCacheKeyMixin, FetchFromCacheMiddleware):
+    def process_request(self, request):
+        return super(VersionedFetchFromCacheMiddleware, self._for_request(request)).process_request(request)
+
+
+# Serve the CSV/Excel files pre-rendered by the `build_exports` command, if available,
+# instead of calculating them again. See budget_app.views.prebuilt_exports.
+class PrebuiltExportsMiddleware(MiddlewareMixin):
+    def process_request(self, request):
+        if request.path_info.endswith(('.csv', '.xlsx')):
+            return get_prebuilt_export_response(request)
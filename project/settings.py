@@ -139,14 +139,16 @@ if DEBUG:
     MIDDLEWARE = (
         'django.middleware.common.CommonMiddleware',
         'django.middleware.locale.LocaleMiddleware',
+        'project.middleware.PrebuiltExportsMiddleware',
     )
 else:
     MIDDLEWARE = (
         'project.middleware.RemoveCacheBreakingHeadersMiddleware',
-        'django.middleware.cache.UpdateCacheMiddleware',
+        'project.middleware.VersionedUpdateCacheMiddleware',
         'django.middleware.common.CommonMiddleware',
         'django.middleware.locale.LocaleMiddleware',
-        'django.middleware.cache.FetchFromCacheMiddleware',
+        'project.middleware.PrebuiltExportsMiddleware',
+        'project.middleware.VersionedFetchFromCacheMiddleware',
     )
 
 ROOT_URLCONF = 'project.urls'
@@ -263,6 +265,25 @@ DEFAULT_CACHES = {
     }
 }
 CACHES = ENV.get('CACHES', DEFAULT_CACHES)
+
+# Budget descriptions are expensive to calculate, and shared by all pages, so we keep them
+# in a cache shared by all the processes, on disk by default. Entries never expire: loaders
+# invalidate them explicitly when the data changes.
+DEFAULT_DESCRIPTIONS_CACHE = {
+    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+    'LOCATION': ENV.get('DESCRIPTIONS_CACHE_PATH', os.path.join(ROOT_PATH, 'cache', 'descriptions')),
+    'TIMEOUT': None
+}
+if 'descriptions' not in CACHES:
+    CACHES['descriptions'] = DEFAULT_DESCRIPTIONS_CACHE
 CACHE_MIDDLEWARE_ALIAS = 'default'
 CACHE_MIDDLEWARE_SECONDS = 60 * 60 * 24  # 1 Day: data doesn't actually change
 CACHE_MIDDLEWARE_KEY_PREFIX = 'budget_app'
+
+# CSV/Excel files pre-rendered by the `build_exports` command. They can be sent by the web
+# server itself, instead of Django, setting EXPORTS_SENDFILE_HEADER: 'X-Sendfile' for Apache,
+# or 'X-Accel-Redirect' for nginx, together with EXPORTS_SENDFILE_URL, the internal location
+# pointing to EXPORTS_PATH.
+EXPORTS_PATH = ENV.get('EXPORTS_PATH', os.path.join(ROOT_PATH, 'cache', 'exports'))
+EXPORTS_SENDFILE_HEADER = ENV.get('EXPORTS_SENDFILE_HEADER')
+EXPORTS_SENDFILE_URL = ENV.get('EXPORTS_SENDFILE_URL')
@@ -37,6 +37,7 @@ budget_app_urlpatterns += add_url_patterns([
     url(r'^glosario$', terms, name='glossary'),
 
     url(r'^busqueda$', search, name='search'),
+    url(r'^busqueda/sugerencias$', typeahead, name='typeahead'),
 
     url(r'^recibo$', tax_receipt, name='tax_receipt'),
 
@@ -47,6 +48,7 @@ budget_app_urlpatterns += add_url_patterns([
     # Payments
     url(r'^pagos$', payments, name='payments'),
     url(r'^pagos/search$', payment_search, name='payment_search'),
+    url(r'^pagos/beneficiarios$', payment_payees, name='payment_payees'),
 
     # Investments
     url(r'^inversiones$', investments, name='investments'),
@@ -98,6 +100,7 @@ budget_app_urlpatterns += add_url_patterns([
     url(r'^entidades/(?P<id>[0-9A-Z]+)/articulos/g/(?P<article_id>[0-9]+)/(?P<title>.+)$', entities_expense_articles_show, name='entities_expense_articles_show'),
     url(r'^entidades/(?P<id>[0-9A-Z]+)/pagos$', entities_payments, name='entities_payments'),
     url(r'^entidades/(?P<id>[0-9A-Z]+)/pagos/search$', entities_payments_search, name='entities_payments_search'),
+    url(r'^entidades/(?P<id>[0-9A-Z]+)/pagos/beneficiarios$', entities_payment_payees, name='entities_payment_payees'),
 
     # Counties
     url(r'^comarcas$', counties, name='counties'),
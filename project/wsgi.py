@@ -23,3 +23,7 @@ os.environ['DJANGO_SETTINGS_MODULE'] = 'project.settings'
 
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
+
+# Build the search suggestions indexes before serving any request, see budget_app.views.typeahead
+from budget_app.views.typeahead import build_prefix_indexes
+build_prefix_indexes()